@@ -1,58 +1,317 @@
-import os
-import requests
+import asyncio
 import base64
-from datetime import datetime
+import json
+import logging
+import os
+import secrets
+import time
+from datetime import datetime, timedelta
+from config import config
+from http_clients import get_client
+from blobstore import blob_store
+from db import claim_alerts, finish_alerts, requeue_sending_alerts
+from metrics import STAGE_SECONDS
 
-SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
+logger = logging.getLogger(__name__)
 
-def send_email_alert(to_email, decoy_email, sender, ip, geo, subject, body_text, eml_data=None):
-    # Attach the original .eml if available
-    attachments = []
-    if eml_data:
-        attachments.append({
-            "content": base64.b64encode(eml_data).decode(),
-            "type": "message/rfc822",
-            "filename": f"{decoy_email.replace('@', '_')}.eml",
-            "disposition": "attachment"
-        })
+# Raw bytes read per base64 chunk; a multiple of 3 so chunks concatenate cleanly
+ATTACHMENT_CHUNK_BYTES = 3 * 16 * 1024
 
-    message = {
-        "personalizations": [{
-            "to": [{"email": to_email}],
-            "subject": f"Your decoy {decoy_email} was triggered"
-        }],
-        "from": {"email": "florianboymond@gmail.com", "name": "Decoys Alerts"}, # TODO: Switch to canary@honeypotalerts.com once domain is verified
-        "content": [{
-            "type": "text/plain",
-            "value": f"""Heads up — your decoy email {decoy_email} received a message.
+# SendGrid caps personalizations per request and substitution data per personalization
+MAX_PERSONALIZATIONS = 1000
+MAX_SUBSTITUTION_BYTES = 9000
+DIGEST_TOKEN = "-digest_body-"
+MAX_DIGEST_ENTRIES = 200
+
+# One SendGrid request, whether a single alert or a batch of digests
+SEND_ALERT = STAGE_SECONDS.labels("send_alert")
+
+ALERT_FROM = {"email": "florianboymond@gmail.com", "name": "Decoys Alerts"} # TODO: Switch to canary@honeypotalerts.com once domain is verified
+
+def file_attachment(eml_file):
+    """(size, async chunk iterator) for an open binary file"""
+    eml_file.seek(0, os.SEEK_END)
+    size = eml_file.tell()
+
+    async def chunks():
+        eml_file.seek(0)
+        while chunk := eml_file.read(ATTACHMENT_CHUNK_BYTES):
+            yield chunk
+
+    return size, chunks()
+
+def encoded_json_body(message, placeholder, size, chunks):
+    """Serialise message, streaming the attachment as base64 in place of placeholder.
+
+    Returns (content_length, async iterator of bytes). Only one chunk of the
+    attachment is held in memory at a time.
+    """
+    head, tail = json.dumps(message).encode().split(f'"{placeholder}"'.encode(), 1)
+    content_length = len(head) + 2 + 4 * ((size + 2) // 3) + len(tail)
+
+    async def body():
+        yield head + b'"'
+        carry = b""
+        async for chunk in chunks:
+            data = carry + chunk
+            cut = len(data) - len(data) % 3
+            carry = data[cut:]
+            if cut:
+                yield base64.b64encode(data[:cut])
+        yield base64.b64encode(carry) + b'"' + tail
+
+    return content_length, body()
+
+def alert_text(decoy_email, sender, ip, geo, subject, body_text, created_at):
+    return f"""Heads up — your decoy email {decoy_email} received a message.
 
 This may indicate a document leak or unauthorized access.
 From: {sender}
 IP Address: {ip}
 Subject: {subject}
 Location: {geo}
-Time: {datetime.utcnow().isoformat()}
+Time: {created_at}
 
 Body Preview:
 {body_text[:5000] if body_text else "[No body text available]"}
 
 """
+
+def digest_text(alerts):
+    lines = [f"Heads up — your decoys received {len(alerts)} messages.", "",
+             "This may indicate a document leak or unauthorized access.", ""]
+    for alert in alerts[:MAX_DIGEST_ENTRIES]:
+        lines.append(f"{alert['created_at']}  {alert['decoy_email']}")
+        lines.append(f"    From: {alert['sender']}  IP: {alert['ip']}  Location: {alert['geo']}")
+        lines.append(f"    Subject: {alert['subject']}")
+    if len(alerts) > MAX_DIGEST_ENTRIES:
+        lines.append(f"... and {len(alerts) - MAX_DIGEST_ENTRIES} more.")
+    lines += ["", "The raw messages can be downloaded from the dashboard.", ""]
+    return "\n".join(lines)
+
+async def send_email_alert(to_email, decoy_email, sender, ip, geo, subject, body_text, attachment=None, created_at=None):
+    """Send one alert, optionally with the original .eml as a (size, chunks) attachment.
+
+    Returns the SendGrid response.
+    """
+    message = {
+        "personalizations": [{
+            "to": [{"email": to_email}],
+            "subject": f"Your decoy {decoy_email} was triggered"
+        }],
+        "from": ALERT_FROM,
+        "content": [{
+            "type": "text/plain",
+            "value": alert_text(decoy_email, sender, ip, geo, subject, body_text,
+                                created_at or datetime.utcnow().isoformat())
         }]
     }
 
-    if attachments:
-        message["attachments"] = attachments
+    if attachment is None:
+        return await get_client("sendgrid").post("/v3/mail/send", json=message)
 
-    response = requests.post(
-        "https://api.sendgrid.com/v3/mail/send",
-        headers={
-            "Authorization": f"Bearer {SENDGRID_API_KEY}",
-            "Content-Type": "application/json"
-        },
-        json=message
+    # The message is serialised with a random placeholder that the streamed
+    # base64 content replaces
+    placeholder = secrets.token_hex(16)
+    message["attachments"] = [{
+        "content": placeholder,
+        "type": "message/rfc822",
+        "filename": f"{decoy_email.replace('@', '_')}.eml",
+        "disposition": "attachment"
+    }]
+    size, chunks = attachment
+    content_length, content = encoded_json_body(message, placeholder, size, chunks)
+    return await get_client("sendgrid").post(
+        "/v3/mail/send",
+        content=content,
+        headers={"Content-Type": "application/json", "Content-Length": str(content_length)}
     )
 
-    if response.status_code >= 400:
-        print("❌ Failed to send alert:", response.text)
-    else:
-        print(f"✅ Alert sent to {to_email}")
+async def send_digest(customer_email, alerts, text):
+    """Send one customer's digest with the text as the content, for digests too big to substitute"""
+    message = {
+        "personalizations": [{
+            "to": [{"email": customer_email}],
+            "subject": f"{len(alerts)} of your decoys were triggered"
+        }],
+        "from": ALERT_FROM,
+        "content": [{"type": "text/plain", "value": text}]
+    }
+    return await get_client("sendgrid").post("/v3/mail/send", json=message)
+
+async def send_digests(digests):
+    """Send several customers' digests in one request via per-personalization substitutions"""
+    message = {
+        "personalizations": [{
+            "to": [{"email": customer_email}],
+            "subject": f"{len(alerts)} of your decoys were triggered",
+            "substitutions": {DIGEST_TOKEN: text}
+        } for customer_email, alerts, text in digests],
+        "from": ALERT_FROM,
+        "content": [{"type": "text/plain", "value": DIGEST_TOKEN}]
+    }
+    return await get_client("sendgrid").post("/v3/mail/send", json=message)
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Drain the bucket so nothing is sent for the next `seconds`"""
+        self.tokens = -seconds * self.rate
+        self.updated = time.monotonic()
+
+class AlertDispatcher:
+    """Delivers queued alerts, one email per customer per digest window.
+
+    A customer's pending alerts are sent once the oldest has waited
+    ALERT_DIGEST_WINDOW_SECONDS: a single alert goes out as before with the
+    raw .eml attached, several become one digest. Digests for different
+    customers share a request where SendGrid's limits allow. Requests are
+    paced by a token bucket; 429 and 5xx responses are retried with backoff
+    and alerts are only marked delivered once SendGrid accepts them.
+    """
+
+    def __init__(self):
+        self.bucket = TokenBucket(config.ALERT_RATE_PER_SECOND, config.ALERT_RATE_BURST)
+        self._task = None
+        self.sent_requests = 0
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+
+    async def start(self):
+        requeued = await requeue_sending_alerts()
+        if requeued:
+            logger.info("Requeued alerts interrupted mid-send", extra={"count": requeued})
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                while await self.dispatch_once():
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Alert dispatcher error")
+            await asyncio.sleep(config.ALERT_POLL_INTERVAL_SECONDS)
+
+    async def dispatch_once(self) -> bool:
+        """Claim and send every customer batch that is due. Returns False if none were."""
+        by_customer = {}
+        for alert in await claim_alerts(config.ALERT_DIGEST_WINDOW_SECONDS, MAX_PERSONALIZATIONS):
+            by_customer.setdefault(alert["customer_email"], []).append(alert)
+        if not by_customer:
+            return False
+
+        digests = []
+        for customer_email, alerts in by_customer.items():
+            if len(alerts) == 1:
+                await self._send_single(alerts[0])
+                continue
+            text = digest_text(alerts)
+            if len(text.encode()) > MAX_SUBSTITUTION_BYTES:
+                # SendGrid rejects substitutions this large, so this digest goes out on its own
+                await self._send([alerts], lambda: send_digest(customer_email, alerts, text))
+            else:
+                digests.append((customer_email, alerts, text))
+
+        for i in range(0, len(digests), MAX_PERSONALIZATIONS):
+            batch = digests[i:i + MAX_PERSONALIZATIONS]
+            await self._send([alerts for _, alerts, _ in batch], lambda: send_digests(batch))
+        return True
+
+    async def _send_single(self, alert):
+        def request(attach=True):
+            attachment = None
+            if attach and alert["eml_hash"] and alert["eml_size"] is not None \
+                    and os.path.exists(blob_store.path_for(alert["eml_hash"])):
+                attachment = (alert["eml_size"], blob_store.iter_blob(alert["eml_hash"]))
+            return send_email_alert(alert["customer_email"], alert["decoy_email"], alert["sender"], alert["ip"],
+                                    alert["geo"], alert["subject"], alert["body_preview"], attachment,
+                                    alert["created_at"])
+        # If SendGrid refuses the message with the .eml attached, the alert still goes out without it
+        fallback = (lambda: request(attach=False)) if alert["eml_hash"] else None
+        await self._send([[alert]], request, fallback)
+
+    async def _send(self, groups, request, fallback=None):
+        alert_ids = [alert["id"] for alerts in groups for alert in alerts]
+        attempts = max(alert["attempts"] for alerts in groups for alert in alerts)
+        await self.bucket.acquire()
+        self.sent_requests += 1
+        retry_after = None
+        try:
+            with SEND_ALERT.time():
+                response = await request()
+            status, error = response.status_code, response.text[:500]
+            retry_after = response.headers.get("Retry-After")
+        except Exception as e:
+            status, error = None, f"{type(e).__name__}: {e}"
+
+        if status is not None and status < 400:
+            await finish_alerts(alert_ids, "delivered")
+            self.delivered += len(alert_ids)
+            for alerts in groups:
+                logger.info("Alert sent", extra={"customer_email": alerts[0]["customer_email"], "hits": len(alerts),
+                                                 "correlation_ids": [alert["correlation_id"] for alert in alerts]})
+            return
+
+        if status is not None and status < 500 and status != 429:
+            if fallback is not None:
+                logger.warning("SendGrid rejected the alert, retrying without the attachment",
+                               extra={"status": status, "error": error})
+                await self._send(groups, fallback)
+                return
+            logger.error("SendGrid rejected alerts", extra={"status": status, "alerts": len(alert_ids), "error": error})
+            await finish_alerts(alert_ids, "dead", error)
+            self.dead += len(alert_ids)
+            return
+
+        if attempts >= config.ALERT_MAX_ATTEMPTS:
+            logger.error("Giving up on alerts", extra={"alerts": len(alert_ids), "attempts": attempts, "error": error})
+            await finish_alerts(alert_ids, "dead", error)
+            self.dead += len(alert_ids)
+            return
+
+        delay = config.ALERT_BACKOFF_SECONDS * (2 ** (attempts - 1))
+        if status == 429:
+            try:
+                delay = max(delay, float(retry_after))
+            except (TypeError, ValueError):
+                pass
+            self.bucket.pause(delay)
+        logger.warning("Retrying alerts", extra={"status": status, "alerts": len(alert_ids), "delay": round(delay, 1)})
+        await finish_alerts(alert_ids, "pending", error, datetime.utcnow() + timedelta(seconds=delay))
+        self.retried += len(alert_ids)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.sent_requests,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "dead": self.dead,
+            "tokens": round(self.bucket.tokens, 2),
+        }
+
+alert_dispatcher = AlertDispatcher()
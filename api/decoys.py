@@ -1,36 +1,61 @@
-from fastapi import APIRouter, Depends
-import aiosqlite
-from config import config
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
+from dbpool import pool
 from auth import get_current_user
+from api.pagination import page_size, encode_cursor, decode_cursor, page_response
+from provisioning import DecoyLoader, FORMATS, format_for, iter_lines
 
 router = APIRouter()
 
+# Keyset pagination over idx_decoys_tenant_created_at (customer_email, created_at, decoy_email).
+# Alert counts come from the decoy_stats rollup rather than a join over events.
+DECOYS_QUERY = """
+    SELECT
+        d.decoy_email,
+        d.use_case,
+        d.created_at,
+        COALESCE(s.alerts, 0) as alerts
+    FROM decoys d
+    LEFT JOIN decoy_stats s ON s.decoy_email = d.decoy_email
+    WHERE d.customer_email = ? {where}
+    ORDER BY d.created_at DESC, d.decoy_email DESC
+    LIMIT ?
+"""
+
+def decoys_query(customer_email, cursor):
+    if cursor is None:
+        return DECOYS_QUERY.format(where=""), (customer_email,)
+    return DECOYS_QUERY.format(where="AND (d.created_at, d.decoy_email) < (?, ?)"), (customer_email, *cursor)
+
 @router.get("/api/decoys")
-async def get_decoys(current_user: str = Depends(get_current_user)):
-    async with aiosqlite.connect(config.DATABASE_PATH) as db:
+async def get_decoys(request: Request, cursor: Optional[str] = None, limit: Optional[int] = None,
+                     current_user: str = Depends(get_current_user)):
+    size = page_size(limit)
+    query, params = decoys_query(current_user, decode_cursor(cursor, (str, str)))
+    async with pool.reader() as db:
         # Get decoys with alert counts
-        query = """
-        SELECT 
-            d.decoy_email,
-            d.use_case,
-            d.created_at,
-            COUNT(e.id) as alerts
-        FROM decoys d
-        LEFT JOIN events e ON d.decoy_email = e.decoy_email
-        GROUP BY d.decoy_email, d.use_case, d.created_at
-        ORDER BY d.created_at DESC
-        """
-        
-        async with db.execute(query) as cursor:
-            rows = await cursor.fetchall()
-            
-            decoys = []
-            for row in rows:
-                decoys.append({
-                    "decoy_email": row[0],
-                    "use_case": row[1],
-                    "created_at": row[2][:10] if row[2] else None,  # Format as YYYY-MM-DD
-                    "alerts": row[3]
-                })
-            
-            return decoys
\ No newline at end of file
+        async with db.execute(query, params + (size + 1,)) as result:
+            rows = await result.fetchall()
+
+    next_cursor = encode_cursor([rows[size - 1][2], rows[size - 1][0]]) if len(rows) > size else None
+    decoys = [{
+        "decoy_email": decoy_email,
+        "use_case": use_case,
+        "created_at": created_at[:10] if created_at else None,  # Format as YYYY-MM-DD
+        "alerts": alerts
+    } for decoy_email, use_case, created_at, alerts in rows[:size]]
+    return page_response(request, decoys, next_cursor)
+
+@router.post("/api/decoys/bulk")
+async def bulk_provision_decoys(request: Request, format: Optional[str] = None,
+                                current_user: str = Depends(get_current_user)):
+    """Provision decoys for the caller from a streamed CSV or NDJSON body.
+
+    Bad rows are reported by line number without stopping the load, and
+    re-sending the same body changes nothing.
+    """
+    fmt = format or format_for(request.headers.get("content-type"))
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+    loader = DecoyLoader(fmt, owner=current_user)
+    return await loader.load(iter_lines(request.stream()))
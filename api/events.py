@@ -0,0 +1,170 @@
+import json
+import os
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from config import config
+from dbpool import pool
+from blobstore import blob_store
+from pubsub import event_bus
+from retention import ARCHIVE_FOR_ID_QUERY, archive_partitions, archive_table
+from auth import get_current_user, get_stream_user
+from api.pagination import page_size, encode_cursor, decode_cursor, page_response, parse_time
+
+router = APIRouter()
+
+EVENT_FIELDS = ("id", "decoy_email", "sender_email", "sender_ip", "subject", "geo", "created_at", "has_eml")
+
+def events_query(customer_email, decoy=None, sender=None, ip=None, since=None, until=None, cursor=None,
+                 partitions=("events",)):
+    """Build the feed query, newest first, keyed on (created_at, id).
+
+    Every index on events leads with the tenant, so SQLite seeks on
+    (customer_email[, filter column], created_at) instead of using OFFSET
+    or scanning other tenants' rows. With archive tables in partitions,
+    each is read the same way and SQLite merges them in order.
+    """
+    where, params = ["e.customer_email = ?"], [customer_email]
+    for column, value in (("e.decoy_email", decoy), ("e.sender_email", sender), ("e.sender_ip", ip)):
+        if value:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if since:
+        where.append("e.created_at >= ?")
+        params.append(since)
+    if until:
+        where.append("e.created_at < ?")
+        params.append(until)
+    if cursor:
+        where.append("(e.created_at, e.id) < (?, ?)")
+        params.extend(cursor)
+
+    selects = [f"""
+        SELECT e.id, e.decoy_email, e.sender_email, e.sender_ip, e.subject, e.geo, e.created_at,
+               e.eml_hash IS NOT NULL AS has_eml
+        FROM {table} e
+        WHERE {" AND ".join(where)}
+    """ for table in partitions]
+    if len(selects) == 1:
+        return selects[0] + "ORDER BY e.created_at DESC, e.id DESC\n        LIMIT ?", params
+    return " UNION ALL ".join(selects) + "ORDER BY created_at DESC, id DESC\n        LIMIT ?", params * len(selects)
+
+@router.get("/api/events")
+async def get_events(request: Request, decoy: Optional[str] = None, sender: Optional[str] = None,
+                     ip: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                     cursor: Optional[str] = None, limit: Optional[int] = None,
+                     current_user: str = Depends(get_current_user)):
+    """Recent hits on the caller's decoys, newest first, one page at a time"""
+    size = page_size(limit)
+    page_cursor = decode_cursor(cursor, (str, int))
+    since = parse_time(since, "since").isoformat() if since else None
+    until = parse_time(until, "until").isoformat() if until else None
+    query, params = events_query(current_user, decoy, sender, ip, since, until, page_cursor)
+    async with pool.reader() as db:
+        async with db.execute(query, params + [size + 1]) as result:
+            rows = await result.fetchall()
+
+        # Archived months are read only when the page reaches back to them
+        upper = min(filter(None, (until, page_cursor[0] if page_cursor else None)), default=None)
+        archives = await archive_partitions(db, since, upper)
+        if archives and (len(rows) <= size or rows[size][6] <= archives[0][1]):
+            query, params = events_query(current_user, decoy, sender, ip, since, until, page_cursor,
+                                         ["events", *(table for table, _ in archives)])
+            async with db.execute(query, params + [size + 1]) as result:
+                rows = await result.fetchall()
+
+    next_cursor = encode_cursor([rows[size - 1][6], rows[size - 1][0]]) if len(rows) > size else None
+    events = [dict(zip(EVENT_FIELDS, row)) for row in rows[:size]]
+    for event in events:
+        event["has_eml"] = bool(event["has_eml"])
+    return page_response(request, events, next_cursor)
+
+REPLAY_QUERY = """
+    SELECT id, decoy_email, sender_email, sender_ip, subject, geo, created_at, eml_hash IS NOT NULL
+    FROM events
+    WHERE customer_email = ? AND id > ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+def sse_message(event: dict) -> str:
+    return f"id: {event['id']}\nevent: hit\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+@router.get("/api/events/stream")
+async def stream_events(request: Request, last_event_id: Optional[str] = Header(None),
+                        current_user: str = Depends(get_stream_user)):
+    """Server-Sent Events feed of the caller's hits as they are logged.
+
+    A reconnecting client sends Last-Event-ID and first receives the hits
+    it missed from the events table. Browsers, whose EventSource cannot set
+    headers, pass a ticket from POST /auth/stream-ticket instead.
+    """
+    # Subscribe before replaying so nothing logged in between is missed
+    subscription = event_bus.subscribe(current_user)
+
+    async def messages():
+        try:
+            last_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+            if last_id is not None:
+                # Replayed SSE_REPLAY_LIMIT rows at a time, with the reader released in
+                # between, until a short page shows the rest will arrive live
+                while True:
+                    async with pool.reader() as db:
+                        async with db.execute(REPLAY_QUERY, (current_user, last_id, config.SSE_REPLAY_LIMIT)) as result:
+                            rows = await result.fetchall()
+                    for row in rows:
+                        event = dict(zip(EVENT_FIELDS, row))
+                        event["has_eml"] = bool(event["has_eml"])
+                        last_id = event["id"]
+                        yield sse_message(event)
+                    if len(rows) < config.SSE_REPLAY_LIMIT:
+                        break
+            else:
+                yield ": connected\n\n"
+
+            while not await request.is_disconnected():
+                event = await subscription.get(timeout=config.SSE_HEARTBEAT_SECONDS)
+                if event is None:
+                    if subscription.closed:
+                        break
+                    yield ": heartbeat\n\n"
+                    continue
+                if last_id is not None and event["id"] <= last_id:
+                    continue
+                yield sse_message(event)
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        messages(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+EVENT_EML_QUERY = "SELECT decoy_email, eml_hash FROM {table} WHERE id = ? AND customer_email = ?"
+
+@router.get("/api/events/{event_id}/eml")
+async def download_eml(event_id: int, current_user: str = Depends(get_current_user)):
+    """Stream the stored raw message for one of the caller's events"""
+    async with pool.reader() as db:
+        async with db.execute(EVENT_EML_QUERY.format(table="events"), (event_id, current_user)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            async with db.execute(ARCHIVE_FOR_ID_QUERY, (event_id, event_id)) as cursor:
+                months = [month for (month,) in await cursor.fetchall()]
+            for month in months:
+                async with db.execute(EVENT_EML_QUERY.format(table=archive_table(month)),
+                                      (event_id, current_user)) as cursor:
+                    row = await cursor.fetchone()
+                if row is not None:
+                    break
+
+    if not row or not row[1] or not os.path.exists(blob_store.path_for(row[1])):
+        raise HTTPException(status_code=404, detail="Message not found")
+
+    decoy_email, eml_hash = row
+    return StreamingResponse(
+        blob_store.iter_blob(eml_hash),
+        media_type="message/rfc822",
+        headers={"Content-Disposition": f"attachment; filename={decoy_email.replace('@', '_')}_{event_id}.eml"}
+    )
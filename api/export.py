@@ -1,12 +1,10 @@
 from fastapi import APIRouter, Query, HTTPException, Depends
 from fastapi.responses import StreamingResponse
-import aiosqlite
-import csv
 import io
-import zipfile
 from config import config
+from dbpool import pool
 from auth import get_current_user
-from typing import Dict, List
+from typing import Dict, Optional
 
 router = APIRouter()
 
@@ -38,48 +36,104 @@ CRM_MAPPINGS = {
     }
 }
 
-def get_sample_data() -> List[Dict]:
-    """Generate sample CRM data based on decoy information"""
-    return [
-        {
-            "email": "john.doe@acumenpulse.com",
-            "first_name": "John",
-            "last_name": "Doe", 
-            "company": "Acumen Pulse",
-            "title": "CEO",
-            "phone": "+1-555-0123"
-        },
-        {
-            "email": "sarah.smith@techcorp.com",
-            "first_name": "Sarah",
-            "last_name": "Smith",
-            "company": "TechCorp", 
-            "title": "VP Sales",
-            "phone": "+1-555-0456"
-        }
-    ]
-
-def create_csv_content(data: List[Dict], crm_type: str) -> str:
-    """Create CSV content with CRM-specific field mappings"""
-    if crm_type not in CRM_MAPPINGS:
-        raise HTTPException(status_code=400, detail=f"Unsupported CRM type: {crm_type}")
-    
+class ZipStream(io.RawIOBase):
+    """Write-only, unseekable sink for zipfile that hands bytes back as they are produced.
+
+    zipfile falls back to data descriptors when it cannot seek, so entries
+    can be written without knowing their size up front.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def decoy_contact(decoy_email: str) -> Dict:
+    """Standard contact fields for a decoy address, e.g. john.doe@acme.com -> John Doe, Acme"""
+    local, _, domain = decoy_email.partition("@")
+    names = [part.capitalize() for part in local.replace("_", ".").replace("-", ".").split(".") if part]
+    return {
+        "email": decoy_email,
+        "first_name": names[0] if names else "",
+        "last_name": " ".join(names[1:]),
+        "company": domain.split(".")[0].capitalize() if domain else "",
+        "title": "",
+        "phone": ""
+    }
+
+# Keyset pagination over idx_decoys_tenant_created_at (customer_email, created_at, decoy_email)
+EXPORT_QUERY = """
+    SELECT created_at, decoy_email FROM decoys
+    WHERE customer_email = ? {where}
+    ORDER BY created_at, decoy_email
+    LIMIT ?
+"""
+
+def export_query(customer_email, use_case=None, after=None):
+    """One page of the export, starting after the (created_at, decoy_email) of the previous page's last row"""
+    where, params = [], [customer_email]
+    if use_case is not None:
+        where.append("AND use_case = ?")
+        params.append(use_case)
+    if after is not None:
+        where.append("AND (created_at, decoy_email) > (?, ?)")
+        params.extend(after)
+    return EXPORT_QUERY.format(where=" ".join(where)), tuple(params)
+
+async def export_chunks(customer_email: str, crm_type: str, use_case: Optional[str] = None):
+    """Yield the export ZIP in pieces while reading the caller's decoys in chunks.
+
+    Memory use stays bounded by one chunk of rows and its compressed output,
+    whatever the number of decoys. Each chunk is read with a pooled
+    connection that goes back to the pool before the chunk is sent, so a
+    slow download neither holds a reader nor keeps a read transaction open.
+    """
+    import csv
+    import zipfile
+
     mapping = CRM_MAPPINGS[crm_type]
-    output = io.StringIO()
-    
-    if data:
-        # Use CRM-specific headers
-        headers = list(mapping.values())
-        writer = csv.DictWriter(output, fieldnames=headers)
-        writer.writeheader()
-        
-        for row in data:
-            mapped_row = {}
-            for standard_field, crm_field in mapping.items():
-                mapped_row[crm_field] = row.get(standard_field, "")
-            writer.writerow(mapped_row)
-    
-    return output.getvalue()
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        with zip_file.open(f"{crm_type}_contacts.csv", "w", force_zip64=True) as entry:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            # Use CRM-specific headers
+            writer.writerow(mapping.values())
+            after = None
+            while True:
+                query, params = export_query(customer_email, use_case, after)
+                async with pool.reader() as db:
+                    async with db.execute(query, params + (config.EXPORT_CHUNK_ROWS,)) as cursor:
+                        rows = await cursor.fetchall()
+                for _, decoy_email in rows:
+                    contact = decoy_contact(decoy_email)
+                    writer.writerow(contact.get(field, "") for field in mapping)
+                entry.write(buffer.getvalue().encode())
+                buffer.seek(0)
+                buffer.truncate()
+                if len(rows) < config.EXPORT_CHUNK_ROWS:
+                    break
+                after = rows[-1]
+                if data := stream.drain():
+                    yield data
+        # Add instructions
+        zip_file.writestr("import_instructions.txt", create_instructions(crm_type))
+    yield stream.drain()
 
 def create_instructions(crm_type: str) -> str:
     """Create instruction file for CRM upload"""
@@ -126,28 +180,9 @@ async def export_data(crm: str = Query(..., description="CRM type (salesforce, h
     if crm not in CRM_MAPPINGS:
         raise HTTPException(status_code=400, detail=f"Unsupported CRM type: {crm}")
     
-    # Get sample data (in real implementation, fetch from database)
-    data = get_sample_data()
-    
-    # Create CSV content
-    csv_content = create_csv_content(data, crm)
-    
-    # Create instructions
-    instructions = create_instructions(crm)
-    
-    # Create ZIP file in memory
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        # Add CSV file
-        zip_file.writestr(f"{crm}_contacts.csv", csv_content)
-        # Add instructions
-        zip_file.writestr("import_instructions.txt", instructions)
-    
-    zip_buffer.seek(0)
-    
-    # Return as streaming response
+    # Stream the ZIP as it is built from the database
     return StreamingResponse(
-        io.BytesIO(zip_buffer.read()),
+        export_chunks(current_user, crm),
         media_type="application/zip",
         headers={"Content-Disposition": f"attachment; filename={crm}_export.zip"}
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,52 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import FileResponse, JSONResponse
+from pydantic import BaseModel
+from typing import Optional
+import os
+from api.export import CRM_MAPPINGS
+from export_store import export_store
+from auth import get_current_user
+
+router = APIRouter()
+
+class ExportRequest(BaseModel):
+    crm: str
+    use_case: Optional[str] = None
+
+@router.post("/api/exports")
+async def create_export(request: ExportRequest, current_user: str = Depends(get_current_user)):
+    """Start a background export, or return the existing one for unchanged data"""
+    if request.crm not in CRM_MAPPINGS:
+        raise HTTPException(status_code=400, detail=f"Unsupported CRM type: {request.crm}")
+
+    export = await export_store.request(current_user, request.crm, request.use_case)
+    return JSONResponse(content=export, status_code=200 if export["status"] == "done" else 202)
+
+@router.get("/api/exports/{export_id}")
+async def get_export(export_id: int, current_user: str = Depends(get_current_user)):
+    """Poll the status of an export"""
+    export = await export_store.get(export_id, current_user)
+    if export is None:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return export
+
+@router.get("/api/exports/{export_id}/download")
+async def download_export(export_id: int, current_user: str = Depends(get_current_user)):
+    """Download a finished export. Supports Range and If-Range so broken transfers can resume."""
+    export = await export_store.get(export_id, current_user)
+    if export is None:
+        raise HTTPException(status_code=404, detail="Export not found")
+    if export["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Export is {export['status']}")
+
+    path = export_store.path_for(export_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="Export has expired")
+
+    await export_store.touch(export_id)
+    return FileResponse(
+        path,
+        media_type="application/zip",
+        filename=f"{export['crm']}_export.zip",
+        headers={"ETag": f'"{export["fingerprint"]}"'}
+    )
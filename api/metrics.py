@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from auth import get_ops_user
+from dbpool import pool
+from event_writer import event_writer
+from metrics import Gauge, render
+
+router = APIRouter()
+
+Gauge("honeypot_db_readers", "Reader connections in the pool", read=lambda: {(): pool.size})
+Gauge("honeypot_db_readers_idle", "Reader connections not in use", read=lambda: {(): pool.stats()["readers_idle"]})
+Gauge("honeypot_db_writer_busy", "1 while a transaction holds the writer connection",
+      read=lambda: {(): pool.stats()["writer_busy"]})
+Gauge("honeypot_event_writer_pending", "Events buffered for the next group commit",
+      read=lambda: {(): event_writer.pending()})
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(ops_user: str = Depends(get_ops_user)):
+    """Prometheus scrape endpoint; configure the scrape job with OPS_TOKEN as its bearer token"""
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
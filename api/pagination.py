@@ -0,0 +1,58 @@
+import base64
+import hashlib
+import json
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi import HTTPException, Request, Response
+from config import config
+
+def page_size(limit: Optional[int]) -> int:
+    """Server-side page size; clients may ask for less, never more"""
+    if not limit or limit < 1:
+        return config.PAGE_SIZE_DEFAULT
+    return min(limit, config.PAGE_SIZE_MAX)
+
+def encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: Optional[str], types: tuple):
+    """The values of a cursor from encode_cursor, one of each type in types, or 400"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    # Cursors come back from clients, so anything sqlite cannot bind or compare is refused here
+    if not isinstance(values, list) or len(values) != len(types) \
+            or not all(type(value) is kind for value, kind in zip(values, types)):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def parse_time(value: str, name: str) -> datetime:
+    """A naive UTC datetime from an ISO 8601 query parameter, or 400"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: expected an ISO 8601 date or time")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def page_response(request: Request, items, next_cursor: Optional[str]) -> Response:
+    """Compact JSON page with an ETag; answers 304 when If-None-Match matches.
+
+    The next page is advertised in X-Next-Cursor and a Link header so the
+    body stays a plain list.
+    """
+    body = json.dumps(items, separators=(",", ":")).encode()
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends
+from datetime import datetime
+from db import job_queue_stats, alert_queue_stats
+from alerts import alert_dispatcher
+from auth import get_ops_user
+
+router = APIRouter()
+
+@router.get("/api/queue")
+async def get_queue(ops_user: str = Depends(get_ops_user)):
+    now = datetime.utcnow()
+    statuses = {}
+    for status, count, oldest_created_at, max_attempts in await job_queue_stats():
+        statuses[status] = {
+            "count": count,
+            "oldest_age_seconds": round((now - datetime.fromisoformat(oldest_created_at)).total_seconds(), 3),
+            "max_attempts": max_attempts
+        }
+
+    alerts = {}
+    for status, count, oldest_created_at in await alert_queue_stats():
+        alerts[status] = {
+            "count": count,
+            "oldest_age_seconds": round((now - datetime.fromisoformat(oldest_created_at)).total_seconds(), 3)
+        }
+
+    return {
+        "depth": statuses.get("pending", {}).get("count", 0),
+        "running": statuses.get("running", {}).get("count", 0),
+        "dead": statuses.get("dead", {}).get("count", 0),
+        "statuses": statuses,
+        "alerts": alerts,
+        "alert_dispatcher": alert_dispatcher.stats()
+    }
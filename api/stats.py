@@ -1,34 +1,143 @@
-from fastapi import APIRouter, Depends
-import aiosqlite
+import json
+from datetime import date, datetime, timedelta
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
 from config import config
-from auth import get_current_user
+from coordinator import coordinator
+from dbpool import pool
+from decoy_cache import decoy_cache
+from geo import geo_resolver
+from ingest_guard import ingest_guard
+from pubsub import event_bus
+from rollups import event_rollup, unsaved_top
+from retention import event_archiver
+from auth import get_current_user, get_ops_user, token_cache
+from api.pagination import parse_time
 
 router = APIRouter()
 
+# Totals come from the caller's row in the customer_stats rollup
+TOTALS_QUERY = "SELECT decoys, alerts FROM customer_stats WHERE customer_email = ?"
+INDUSTRIES_QUERY = "SELECT DISTINCT use_case FROM decoys WHERE customer_email = ? AND use_case IS NOT NULL"
+# Trends and top lists read the event_buckets and heavy_hitters rollups, so
+# their cost depends on the range's length, never on how many events it holds
+TREND_QUERY = """
+    SELECT start, hits FROM event_buckets
+    WHERE customer_email = ? AND granularity = ? AND start >= ? AND start <= ?
+    ORDER BY start
+"""
+TOP_QUERY = """
+    SELECT period, dimension, value, hits FROM heavy_hitters
+    WHERE customer_email = ? AND period IN (SELECT value FROM json_each(?))
+"""
+
+# Response key for each heavy-hitter dimension
+TOP_KEYS = {"sender": "senders", "ip": "ips", "location": "locations", "decoy": "decoys"}
+
+def stats_range(since: Optional[str], until: Optional[str], bucket: Optional[str]):
+    """Validated (start, end, bucket) with start aligned to the bucket; end is exclusive"""
+    end = parse_time(until, "until") if until else datetime.utcnow()
+    start = parse_time(since, "since") if since else end - timedelta(days=config.STATS_DEFAULT_RANGE_DAYS)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    bucket = bucket or ("hour" if end - start <= timedelta(hours=48) else "day")
+    if bucket not in BUCKET_STEP:
+        raise HTTPException(status_code=400, detail="bucket must be hour or day")
+    if bucket == "hour" and end - start > timedelta(days=config.STATS_MAX_HOURLY_RANGE_DAYS):
+        raise HTTPException(status_code=400,
+                            detail=f"Hourly trends cover at most {config.STATS_MAX_HOURLY_RANGE_DAYS} days")
+    start = start.replace(minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        start = start.replace(hour=0)
+    return start, end, bucket
+
+BUCKET_STEP = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+def periods(first_day: date, last_day: date) -> list:
+    """Whole months (2025-01) and leftover days (2025-02-03) that exactly cover first_day..last_day"""
+    result, day = [], first_day
+    while day <= last_day:
+        next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        if day.day == 1 and next_month - timedelta(days=1) <= last_day:
+            result.append(day.isoformat()[:7])
+            day = next_month
+        else:
+            result.append(day.isoformat())
+            day += timedelta(days=1)
+    return result
+
+def bucket_key(moment: datetime, bucket: str) -> str:
+    return moment.date().isoformat() if bucket == "day" else moment.isoformat(timespec="seconds")
+
+def top_order(entry):
+    """Most hits first, ties by value"""
+    hits, value = entry
+    return -hits, value
+
 @router.get("/api/stats")
-async def get_stats(current_user: str = Depends(get_current_user)):
-    async with aiosqlite.connect(config.DATABASE_PATH) as db:
-        # Get total decoys
-        async with db.execute("SELECT COUNT(*) FROM decoys") as cursor:
-            total_decoys = (await cursor.fetchone())[0]
-        
-        # Get alerts triggered (events count)
-        async with db.execute("SELECT COUNT(*) FROM events") as cursor:
-            alerts_triggered = (await cursor.fetchone())[0]
+async def get_stats(since: Optional[str] = None, until: Optional[str] = None, bucket: Optional[str] = None,
+                    top: Optional[int] = None, current_user: str = Depends(get_current_user)):
+    """Totals, a hit trend and the top senders, IPs, locations and decoys over a time range"""
+    start, end, bucket = stats_range(since, until, bucket)
+    top_n = min(top or 10, config.STATS_TOP_K_TRACKED)
+    first, last = bucket_key(start, bucket), bucket_key(end, bucket)
+    async with pool.reader() as db:
+        # Get total decoys and alerts triggered
+        async with db.execute(TOTALS_QUERY, (current_user,)) as cursor:
+            total_decoys, alerts_triggered = await cursor.fetchone() or (0, 0)
         
         # Get unique use cases as industries (simplified)
-        async with db.execute("SELECT DISTINCT use_case FROM decoys WHERE use_case IS NOT NULL") as cursor:
+        async with db.execute(INDUSTRIES_QUERY, (current_user,)) as cursor:
             industries = [row[0] for row in await cursor.fetchall()]
-        
-        # For now, return placeholder data for titles and locations
-        # These would need additional fields in the database
-        titles = ["CEO", "VP Sales", "Legal Counsel"]
-        locations = ["San Francisco", "New York", "Remote"]
-        
-        return {
-            "total_decoys": total_decoys,
-            "alerts_triggered": alerts_triggered,
-            "industries": industries,
-            "titles": titles,
-            "locations": locations
-        }
\ No newline at end of file
+
+        async with db.execute(TREND_QUERY, (current_user, bucket, first, last)) as cursor:
+            counts = dict(await cursor.fetchall())
+        covering = periods(start.date(), (end - timedelta(microseconds=1)).date())
+        async with db.execute(TOP_QUERY, (current_user, json.dumps(covering))) as cursor:
+            rows = await cursor.fetchall()
+
+    trend, moment = [], start
+    while moment < end:
+        key = bucket_key(moment, bucket)
+        trend.append({"start": key, "hits": counts.get(key, 0)})
+        moment += BUCKET_STEP[bucket]
+
+    # heavy_hitters lags the writer's sketches by up to STATS_CHECKPOINT_SECONDS, while the
+    # trend is exact, so sketches changed since the last checkpoint replace their saved rows
+    live = await unsaved_top(current_user, covering)
+    replaced = {(period, dimension) for period, dimension, _, _ in live}
+    merged = {}
+    for period, dimension, value, hits in [*(row for row in rows if tuple(row[:2]) not in replaced), *live]:
+        merged[dimension, value] = merged.get((dimension, value), 0) + hits
+
+    by_dimension = {key: [] for key in TOP_KEYS.values()}
+    for (dimension, value), hits in merged.items():
+        by_dimension[TOP_KEYS[dimension]].append((hits, value))
+    top_lists = {key: [{"value": value, "hits": hits} for hits, value in sorted(values, key=top_order)[:top_n]]
+                 for key, values in by_dimension.items()}
+
+    return {
+        "total_decoys": total_decoys,
+        "alerts_triggered": alerts_triggered,
+        "industries": industries,
+        # Decoys carry no job title, so there is nothing to list
+        "titles": [],
+        "locations": [entry["value"] for entry in top_lists["locations"]],
+        "range": {"since": start.isoformat(timespec="seconds"), "until": end.isoformat(timespec="seconds"),
+                  "bucket": bucket},
+        "trend": trend,
+        "top": top_lists
+    }
+
+@router.get("/api/stats/cache")
+async def get_cache_stats(ops_user: str = Depends(get_ops_user)):
+    return {
+        "decoys": decoy_cache.stats(),
+        "geo": geo_resolver.stats(),
+        "pubsub": event_bus.stats(),
+        "tokens": token_cache.stats(),
+        "ingest": ingest_guard.stats(),
+        "rollups": event_rollup.stats(),
+        "retention": event_archiver.stats(),
+        "coordinator": coordinator.stats()
+    }
@@ -1,17 +1,90 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
-from jose import JWTError, jwt
 from datetime import datetime, timedelta
-import aiosqlite
+from collections import OrderedDict
+import asyncio
+import hashlib
+import logging
 import random
+import secrets
 import string
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+import time
+from typing import Optional
 from config import config
+from coordinator import forwarded
+from dbpool import pool
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+class TokenCache:
+    """Verified access tokens keyed by their sha256, so repeat requests skip the JWT check.
+
+    An entry lives until the token's exp; beyond max_entries the least
+    recently used are dropped. A max_entries of 0 turns the cache off.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[str]:
+        key = hashlib.sha256(token.encode()).digest()
+        entry = self._entries.get(key)
+        if entry is not None:
+            email, expires_at = entry
+            if time.time() < expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return email
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, token: str, email: str, expires_at: float):
+        if self.max_entries <= 0:
+            return
+        self._entries[hashlib.sha256(token.encode()).digest()] = (email, expires_at)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+class AllowList:
+    """In-memory copy of authorized_users, reloaded every refresh_interval seconds.
+
+    Nothing in the app writes authorized_users; rows are added and removed
+    by hand. A removed user can still request OTPs for up to refresh_interval
+    seconds (AUTH_ALLOWLIST_REFRESH_SECONDS) in each process, which is the
+    bound on revoking logins; tokens already issued last until their exp.
+    """
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._emails = None
+        self._expires_at = 0.0
+
+    async def load(self):
+        async with pool.reader() as db:
+            async with db.execute("SELECT email FROM authorized_users") as cursor:
+                self._emails = {row[0] for row in await cursor.fetchall()}
+        self._expires_at = time.monotonic() + self.refresh_interval
+
+    async def contains(self, email: str) -> bool:
+        if self._emails is None or time.monotonic() >= self._expires_at:
+            await self.load()
+        return email in self._emails
+
+token_cache = TokenCache(config.AUTH_TOKEN_CACHE_SIZE)
+allow_list = AllowList(config.AUTH_ALLOWLIST_REFRESH_SECONDS)
+_purge_task = None
 
 class OTPRequest(BaseModel):
     email: EmailStr
@@ -24,12 +97,18 @@ class TokenResponse(BaseModel):
     access_token: str
     token_type: str
 
+class StreamTicketResponse(BaseModel):
+    ticket: str
+    expires_in: int
+
 def generate_otp() -> str:
     """Generate a 6-digit OTP"""
     return ''.join(random.choices(string.digits, k=6))
 
 def create_access_token(data: dict):
     """Create JWT access token"""
+    from jose import jwt
+
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(hours=config.JWT_EXPIRATION_HOURS)
     to_encode.update({"exp": expire})
@@ -40,7 +119,10 @@ async def send_otp_email(email: str, otp: str):
     """Send OTP via SendGrid"""
     if not config.SENDGRID_API_KEY:
         raise HTTPException(status_code=500, detail="Email service not configured")
-    
+    # Only logins send mail this way, so the SDK is imported on the first one rather than at startup
+    from sendgrid import SendGridAPIClient
+    from sendgrid.helpers.mail import Mail
+
     message = Mail(
         from_email=config.ALERT_SENDER,
         to_emails=email,
@@ -57,63 +139,101 @@ async def send_otp_email(email: str, otp: str):
     try:
         sg = SendGridAPIClient(config.SENDGRID_API_KEY)
         response = sg.send(message)
-        print(f"OTP email sent to {email}, status: {response.status_code}")
-    except Exception as e:
-        print(f"Failed to send OTP email: {e}")
+        logger.info("OTP email sent", extra={"email": email, "status": response.status_code})
+    except Exception:
+        logger.exception("Failed to send OTP email", extra={"email": email})
         raise HTTPException(status_code=500, detail="Failed to send OTP email")
 
 async def is_user_authorized(email: str) -> bool:
     """Check if user is in authorized_users table"""
-    async with aiosqlite.connect(config.DATABASE_PATH) as db:
-        async with db.execute("SELECT email FROM authorized_users WHERE email = ?", (email,)) as cursor:
-            result = await cursor.fetchone()
-            return result is not None
+    return await allow_list.contains(email)
 
+@forwarded
 async def store_otp(email: str, otp: str):
     """Store OTP in database with expiration"""
     expires_at = (datetime.utcnow() + timedelta(minutes=10)).isoformat()
     
-    async with aiosqlite.connect(config.DATABASE_PATH) as db:
+    async with pool.writer() as db:
         await db.execute("""
             INSERT OR REPLACE INTO otps (email, code, expires_at, used)
             VALUES (?, ?, ?, FALSE)
         """, (email, otp, expires_at))
-        await db.commit()
 
+@forwarded
 async def verify_otp_db(email: str, otp: str) -> bool:
-    """Verify OTP from database"""
-    async with aiosqlite.connect(config.DATABASE_PATH) as db:
+    """Verify OTP from database, consuming it in the same statement"""
+    async with pool.writer() as db:
         async with db.execute("""
-            SELECT code, expires_at, used FROM otps 
-            WHERE email = ? AND code = ?
-        """, (email, otp)) as cursor:
-            result = await cursor.fetchone()
-            
-            if not result:
-                return False
-            
-            stored_code, expires_at, used = result
-            
-            # Check if already used
-            if used:
-                return False
-            
-            # Check if expired
-            if datetime.utcnow() > datetime.fromisoformat(expires_at):
-                return False
-            
-            # Mark as used
-            await db.execute("""
-                UPDATE otps SET used = TRUE WHERE email = ? AND code = ?
-            """, (email, otp))
-            await db.commit()
-            
-            return True
+            UPDATE otps SET used = TRUE
+            WHERE email = ? AND code = ? AND NOT used AND expires_at > ?
+            RETURNING email
+        """, (email, otp, datetime.utcnow().isoformat())) as cursor:
+            return await cursor.fetchone() is not None
+
+@forwarded
+async def issue_stream_ticket(email: str) -> str:
+    """Store a new stream ticket for email and return it. Only its sha256 is kept."""
+    ticket = secrets.token_urlsafe(32)
+    expires_at = (datetime.utcnow() + timedelta(seconds=config.STREAM_TICKET_TTL_SECONDS)).isoformat()
+    async with pool.writer() as db:
+        await db.execute("INSERT INTO stream_tickets (ticket_hash, email, expires_at) VALUES (?, ?, ?)",
+                         (hashlib.sha256(ticket.encode()).hexdigest(), email, expires_at))
+    return ticket
+
+@forwarded
+async def redeem_stream_ticket(ticket: str) -> Optional[str]:
+    """Consume a stream ticket, returning its email, or None if it is unknown, used or expired"""
+    async with pool.writer() as db:
+        async with db.execute("""
+            DELETE FROM stream_tickets WHERE ticket_hash = ?
+            RETURNING email, expires_at
+        """, (hashlib.sha256(ticket.encode()).hexdigest(),)) as cursor:
+            row = await cursor.fetchone()
+    if row is None or row[1] <= datetime.utcnow().isoformat():
+        return None
+    return row[0]
+
+async def purge_otps() -> int:
+    """Delete expired OTPs and stream tickets. Used OTPs go too, as every OTP expires within minutes."""
+    now = datetime.utcnow().isoformat()
+    async with pool.writer() as db:
+        cursor = await db.execute("DELETE FROM otps WHERE expires_at <= ?", (now,))
+        purged = cursor.rowcount
+        cursor = await db.execute("DELETE FROM stream_tickets WHERE expires_at <= ?", (now,))
+        return purged + cursor.rowcount
+
+async def _run_otp_purge():
+    while True:
+        await asyncio.sleep(config.OTP_PURGE_INTERVAL_SECONDS)
+        try:
+            purged = await purge_otps()
+            if purged:
+                logger.info("Purged expired OTPs and stream tickets", extra={"count": purged})
+        except Exception:
+            logger.exception("OTP purge failed")
+
+def start_otp_purge():
+    global _purge_task
+    if _purge_task is None:
+        _purge_task = asyncio.create_task(_run_otp_purge())
+
+async def stop_otp_purge():
+    global _purge_task
+    if _purge_task is not None:
+        _purge_task.cancel()
+        await asyncio.gather(_purge_task, return_exceptions=True)
+        _purge_task = None
+
+def decode_access_token(token: str) -> str:
+    """Return the email in a valid access token, or raise 401"""
+    email = token_cache.get(token)
+    if email is not None:
+        return email
+    # jose pulls in cryptography; webhooks never need it, so a cold start does not pay for it
+    from jose import JWTError, jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Get current user from JWT token"""
     try:
-        payload = jwt.decode(credentials.credentials, config.JWT_SECRET_KEY, algorithms=[config.JWT_ALGORITHM])
+        payload = jwt.decode(token, config.JWT_SECRET_KEY, algorithms=[config.JWT_ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(
@@ -121,6 +241,9 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
                 detail="Invalid authentication credentials",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        # Tokens without an exp are never cached
+        if isinstance(payload.get("exp"), (int, float)):
+            token_cache.put(token, email, payload["exp"])
         return email
     except JWTError:
         raise HTTPException(
@@ -129,6 +252,53 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Get current user from JWT token"""
+    return decode_access_token(credentials.credentials)
+
+async def get_ops_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """Allow only operators, who present OPS_TOKEN as their bearer token.
+
+    Queue, cache and process metrics span every tenant, so customer access
+    tokens are refused. Without OPS_TOKEN set these endpoints are closed.
+    """
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if not config.OPS_TOKEN or not secrets.compare_digest(credentials.credentials.encode(), config.OPS_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Operator credentials required")
+    return "ops"
+
+async def get_stream_user(
+    ticket: Optional[str] = Query(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Get current user from the Authorization header or, for EventSource
+    clients that cannot set headers, a ticket query parameter.
+
+    Query strings end up in access logs, so the access token itself is never
+    accepted there; a ticket is single-use and expires within
+    STREAM_TICKET_TTL_SECONDS.
+    """
+    if credentials is not None:
+        return decode_access_token(credentials.credentials)
+    if ticket:
+        email = await redeem_stream_ticket(ticket)
+        if email is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or expired stream ticket",
+            )
+        return email
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
 @router.post("/auth/request-otp")
 async def request_otp(request: OTPRequest):
     """Request OTP for login"""
@@ -164,4 +334,12 @@ async def verify_otp(request: OTPVerify):
     return {
         "access_token": access_token,
         "token_type": "bearer"
+    }
+
+@router.post("/auth/stream-ticket", response_model=StreamTicketResponse)
+async def create_stream_ticket(current_user: str = Depends(get_current_user)):
+    """Exchange the access token for a ticket to open /api/events/stream with"""
+    return {
+        "ticket": await issue_stream_ticket(current_user),
+        "expires_in": config.STREAM_TICKET_TTL_SECONDS
     }
\ No newline at end of file
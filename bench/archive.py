@@ -0,0 +1,155 @@
+"""Event archival: hot table size, feed latency and webhook write stalls while compacting.
+
+    python bench/archive.py --events 300000 --days 365 --hot-days 90
+
+Fills --tenants tenants with --events hits spread over --days and
+measures the hot events table (rows and bytes, indexes included) and
+the feed queries behind /api/events: the first page, and a page from
+--deep-days ago. It then runs the retention compactor while another
+task keeps enqueuing jobs the way the webhook does, and reports how long
+those writes waited compared with an idle database, along with the
+longest compaction batch. The measurements are repeated on the compacted
+database, where the deep page merges the archived months.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+def populate(path, events, days, tenants, rng):
+    start = datetime.utcnow() - timedelta(days=days)
+    step = days * 86400 / events
+    rows = [(f"d{rng.randrange(500)}@decoys.example", f"tenant{i % tenants}@example.com",
+             f"s{rng.randrange(20000)}@spam.example", f"203.0.{rng.randrange(256)}.{rng.randrange(256)}",
+             "bench", "Paris, France", (start + timedelta(seconds=i * step)).isoformat()) for i in range(events)]
+    conn = sqlite3.connect(path)
+    conn.executemany("""
+        INSERT INTO events (decoy_email, customer_email, sender_email, sender_ip, subject, geo, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    conn.executemany("INSERT INTO customer_stats (customer_email, decoys, alerts) VALUES (?, 0, 0)",
+                     [(f"tenant{i}@example.com",) for i in range(tenants)])
+    conn.commit()
+    conn.close()
+
+def hot_size(conn):
+    rows = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    size = conn.execute("""
+        SELECT SUM(pgsize) FROM dbstat
+        WHERE name = 'events' OR name IN (SELECT name FROM sqlite_master WHERE tbl_name = 'events')
+    """).fetchone()[0]
+    return rows, size
+
+async def feed(db, tenant, cursor, size=100):
+    """The reads get_events() makes for one page, returning (rows, milliseconds)"""
+    from api.events import events_query
+    from retention import archive_partitions
+
+    start = time.perf_counter()
+    query, params = events_query(tenant, cursor=cursor)
+    async with db.execute(query, params + [size + 1]) as result:
+        rows = await result.fetchall()
+    archives = await archive_partitions(db, None, cursor[0] if cursor else None)
+    if archives and (len(rows) <= size or rows[size][6] <= archives[0][1]):
+        query, params = events_query(tenant, cursor=cursor, partitions=["events", *(t for t, _ in archives)])
+        async with db.execute(query, params + [size + 1]) as result:
+            rows = await result.fetchall()
+    return rows, (time.perf_counter() - start) * 1000
+
+async def measure_feeds(deep_days):
+    from dbpool import pool
+
+    deep = [(datetime.utcnow() - timedelta(days=deep_days)).isoformat(), 1 << 62]
+    results = {}
+    async with pool.reader() as db:
+        for name, cursor in (("first page", None), (f"page from {deep_days}d ago", deep)):
+            timings = []
+            for _ in range(5):
+                rows, ms = await feed(db, "tenant0@example.com", cursor)
+                timings.append(ms)
+            results[name] = (len(rows), min(timings))
+    return results
+
+async def write_latencies(seconds, stop=None):
+    """Enqueue jobs back to back, as inbound() does, until stop is set or seconds pass"""
+    from db import enqueue_job
+
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline and not (stop and stop.is_set()):
+        start = time.perf_counter()
+        await enqueue_job("bench", {"n": len(latencies)})
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.001)
+    latencies.sort()
+    return latencies
+
+def describe(latencies):
+    pick = lambda p: latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+    return f"{len(latencies):>6} writes  p50 {pick(50):6.2f} ms  p99 {pick(99):6.2f} ms  max {latencies[-1] * 1000:6.2f} ms"
+
+async def run(args):
+    from dbpool import pool
+    from db import init_db
+    from retention import EventArchiver
+
+    await init_db()
+    await pool.close()
+    print(f"Populating {args.events} events over {args.days} days for {args.tenants} tenants...")
+    populate(pool.path, args.events, args.days, args.tenants, random.Random(5))
+
+    conn = sqlite3.connect(pool.path)
+    rows, size = hot_size(conn)
+    print(f"before: hot events {rows} rows, {size / 1024 / 1024:.1f} MiB with indexes")
+    before = await measure_feeds(args.deep_days)
+    idle = await write_latencies(3)
+
+    archiver = EventArchiver(args.hot_days, {}, 0, args.batch_size, args.pause, 3600)
+    stop = asyncio.Event()
+    writes = asyncio.create_task(write_latencies(3600, stop))
+    start = time.perf_counter()
+    result = await archiver.compact()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    busy = await writes
+
+    rows, size = hot_size(conn)
+    months = conn.execute("SELECT COUNT(*) FROM event_archives").fetchone()[0]
+    print(f"compacted {result['archived']} events into {months} monthly archives in {elapsed:.1f}s, "
+          f"{archiver.batches} batches of up to {args.batch_size}, longest {archiver.longest_batch_seconds * 1000:.1f} ms")
+    print(f"after:  hot events {rows} rows, {size / 1024 / 1024:.1f} MiB with indexes")
+    after = await measure_feeds(args.deep_days)
+    conn.close()
+
+    print("webhook enqueue latency")
+    print(f"  idle        {describe(idle)}")
+    print(f"  compacting  {describe(busy)}")
+    print(f"{'feed query':<22}{'before ms':>10}{'after ms':>10}{'rows':>6}")
+    for name in before:
+        print(f"{name:<22}{before[name][1]:>10.2f}{after[name][1]:>10.2f}{after[name][0]:>6}")
+    await pool.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=300_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--tenants", type=int, default=3)
+    parser.add_argument("--hot-days", type=int, default=90)
+    parser.add_argument("--deep-days", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--pause", type=float, default=0.05)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "archive.db"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
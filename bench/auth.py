@@ -0,0 +1,67 @@
+"""Per-request cost of authentication.
+
+    python bench/auth.py --requests 20000
+
+Serves one route with get_current_user and one without from a minimal app
+over an in-process ASGI transport. The overhead is the difference in mean
+latency. It also times decode_access_token alone, cold and warm. Set
+AUTH_TOKEN_CACHE_SIZE=0 to measure without the token cache.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+async def timed_requests(client, path, headers, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        response = await client.get(path, headers=headers)
+        assert response.status_code == 200, response.text
+    return (time.perf_counter() - start) / count
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--decodes", type=int, default=100_000)
+    args = parser.parse_args()
+
+    import httpx
+    from fastapi import Depends, FastAPI
+    from auth import create_access_token, decode_access_token, get_current_user
+
+    app = FastAPI()
+
+    @app.get("/open")
+    async def open_route():
+        return {"ok": True}
+
+    @app.get("/private")
+    async def private_route(current_user: str = Depends(get_current_user)):
+        return {"ok": True}
+
+    token = create_access_token({"sub": "bench@example.com"})
+    headers = {"Authorization": f"Bearer {token}"}
+
+    start = time.perf_counter()
+    for i in range(1000):
+        decode_access_token(create_access_token({"sub": f"user{i}@example.com"}))
+    print(f"decode, new token      {(time.perf_counter() - start) / 1000 * 1e6:8.1f} us (includes encode)")
+    start = time.perf_counter()
+    for _ in range(args.decodes):
+        decode_access_token(token)
+    print(f"decode, repeat token   {(time.perf_counter() - start) / args.decodes * 1e6:8.1f} us")
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await timed_requests(client, "/private", headers, 100)
+        open_latency = await timed_requests(client, "/open", {}, args.requests)
+        private_latency = await timed_requests(client, "/private", headers, args.requests)
+    print(f"request, no auth       {open_latency * 1e6:8.1f} us")
+    print(f"request, bearer token  {private_latency * 1e6:8.1f} us")
+    print(f"auth overhead          {(private_latency - open_latency) * 1e6:8.1f} us/request")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""Requests/sec for /webhook/inbound and /api/decoys, driven in-process.
+
+Run from the repo root against a scratch database:
+
+    python bench/db_pool.py --requests 2000 --concurrency 50
+
+Job workers are disabled so the webhook number measures ingestion only.
+Check out an older commit and run the same script to get the "before" figure.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+async def drive(client, method, url, total, concurrency, **kwargs):
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            response = await client.request(method, url, **kwargs)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return total / (time.perf_counter() - start)
+
+async def main(args):
+    import httpx
+    import main as app_module
+    from auth import create_access_token
+    from db import insert_decoy
+
+    app = app_module.app
+    await app.router.startup()
+    try:
+        for i in range(args.decoys):
+            await insert_decoy(f"decoy{i}@example.com", "bench@example.com", "bench")
+
+        token = create_access_token({"sub": "bench@example.com"})
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            form = {
+                "recipient": "decoy1@example.com",
+                "sender": "attacker@example.net",
+                "subject": "bench",
+                "body-plain": "hello",
+                "X-Mailgun-Incoming-IP": "203.0.113.7",
+            }
+            webhook = await drive(client, "POST", "/webhook/inbound", args.requests, args.concurrency, data=form)
+            decoys = await drive(client, "GET", "/api/decoys", args.requests, args.concurrency,
+                                 headers={"Authorization": f"Bearer {token}"})
+    finally:
+        await app.router.shutdown()
+
+    print(f"/webhook/inbound: {webhook:8.1f} req/s")
+    print(f"/api/decoys:      {decoys:8.1f} req/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--decoys", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+    os.environ["JOB_WORKERS"] = "0"
+    asyncio.run(main(args))
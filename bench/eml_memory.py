@@ -0,0 +1,116 @@
+"""Peak RSS while N large .eml messages are fetched and attached concurrently.
+
+    python bench/eml_memory.py --messages 8 --size-mb 25
+
+A local HTTP server (in a child process) plays both Mailgun storage and
+SendGrid. Each mode runs in a fresh interpreter so peaks do not mix:
+
+  streamed  fetch_eml() + send_email_alert() with a streamed attachment
+  buffered  the old path: r.content, b64encode, json= request body
+"""
+import argparse
+import asyncio
+import base64
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+BLOCK = os.urandom(64 * 1024)
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    size = 0
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(self.size))
+        self.end_headers()
+        remaining = self.size
+        while remaining:
+            chunk = BLOCK[:min(len(BLOCK), remaining)]
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+    def do_POST(self):
+        remaining = int(self.headers.get("Content-Length", 0))
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def serve(size):
+    UpstreamHandler.size = size
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UpstreamHandler)
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def run_mode(mode, port, messages):
+    from config import config
+    config.SENDGRID_BASE_URL = f"http://127.0.0.1:{port}"
+    config.EML_MAX_BYTES = 1 << 40
+    from http_clients import start_clients, close_clients, get_client
+    from alerts import send_email_alert, file_attachment
+    from main import fetch_eml
+
+    await start_clients()
+    url = f"http://127.0.0.1:{port}/message"
+
+    async def streamed():
+        eml_file = await fetch_eml(url)
+        try:
+            await send_email_alert("c@example.com", "d@example.com", "s@example.net", "203.0.113.7", "", "bench", "",
+                                   file_attachment(eml_file))
+        finally:
+            eml_file.close()
+
+    async def buffered():
+        eml_data = (await get_client("mailgun").get(url)).content
+        message = {"attachments": [{"content": base64.b64encode(eml_data).decode()}]}
+        await get_client("sendgrid").post("/v3/mail/send", json=message)
+
+    baseline = peak_rss_mb()
+    await asyncio.gather(*((streamed if mode == "streamed" else buffered)() for _ in range(messages)))
+    await close_clients()
+    print(f"{mode:>9}: peak RSS {peak_rss_mb():8.1f} MB (+{peak_rss_mb() - baseline:.1f} MB over start)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=8)
+    parser.add_argument("--size-mb", type=float, default=25)
+    parser.add_argument("--mode", choices=["streamed", "buffered"])
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    size = int(args.size_mb * 1024 * 1024)
+
+    if args.serve:
+        serve(size)
+    elif args.mode:
+        os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+        asyncio.run(run_mode(args.mode, args.port, args.messages))
+    else:
+        server = subprocess.Popen([sys.executable, __file__, "--serve", "--size-mb", str(args.size_mb)],
+                                  stdout=subprocess.PIPE, text=True)
+        try:
+            port = server.stdout.readline().strip()
+            print(f"{args.messages} concurrent messages of {args.size_mb} MB")
+            for mode in ("buffered", "streamed"):
+                subprocess.run([sys.executable, __file__, "--mode", mode, "--port", port,
+                                "--messages", str(args.messages)], check=True)
+        finally:
+            server.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Event insert throughput: one commit per row vs group commit.
+
+    python bench/event_writer.py --events 20000 --producers 200
+
+Each mode writes the same number of events from concurrent producers into
+a fresh scratch database. Use --synchronous FULL to see the fsync cost.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+def row(i):
+    return (f"decoy{i % 100}@example.com", "customer@example.com", None, "attacker@example.net", "203.0.113.7", "bench", "Paris, France", None, "2025-01-01T00:00:00")
+
+async def run(mode, batch_size, args):
+    from dbpool import pool
+    from db import init_db
+    from event_writer import EventWriter, INSERT_EVENT
+
+    # Fresh scratch database for every mode
+    await pool.close()
+    pool.path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    await init_db()
+    async with pool.writer() as conn:
+        await conn.execute(f"PRAGMA synchronous = {args.synchronous}")
+
+    counter = iter(range(args.events))
+    writer = EventWriter(batch_size, args.flush_ms / 1000)
+
+    async def producer():
+        for i in counter:
+            if mode == "per-row":
+                async with pool.writer() as conn:
+                    await conn.execute(INSERT_EVENT, row(i))
+            else:
+                await writer.write(row(i))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(producer() for _ in range(args.producers)))
+    await writer.stop()
+    elapsed = time.perf_counter() - start
+    return args.events / elapsed, writer.batches
+
+async def main(args):
+    rate, _ = await run("per-row", 1, args)
+    print(f"{'per-row commit':>22}: {rate:10.0f} events/s")
+    for batch_size in args.batch_sizes:
+        rate, batches = await run("group", batch_size, args)
+        print(f"{f'group commit ({batch_size})':>22}: {rate:10.0f} events/s  ({batches} transactions)")
+
+    from dbpool import pool
+    await pool.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--producers", type=int, default=200)
+    parser.add_argument("--flush-ms", type=float, default=5)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 64, 256, 1024])
+    parser.add_argument("--synchronous", default="NORMAL", choices=["OFF", "NORMAL", "FULL"])
+    asyncio.run(main(parser.parse_args()))
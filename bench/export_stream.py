@@ -0,0 +1,103 @@
+"""Peak memory and time-to-first-byte of the CRM export for a large tenant.
+
+    python bench/export_stream.py --rows 1000000
+
+Populates one tenant with --rows decoys, then runs each mode in a fresh
+interpreter:
+
+  streamed  export_chunks(), as served by /api/export
+  buffered  the old approach: whole CSV in a StringIO, whole ZIP in a BytesIO
+
+SQLite's memory-mapped pages count towards RSS; run with DB_MMAP_SIZE=0 to
+see only the export's own memory.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+TENANT = "bench@example.com"
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def populate(rows):
+    from dbpool import pool
+    from db import init_db
+    await init_db()
+    await pool.close()
+    conn = sqlite3.connect(pool.path)
+    conn.executemany("INSERT INTO decoys VALUES (?, ?, ?, ?)", (
+        (f"first{i}.last{i}@decoys{i % 1000}.example", TENANT, "bench", f"2025-01-01T00:00:{i:012d}")
+        for i in range(rows)
+    ))
+    conn.commit()
+    conn.close()
+
+async def run_mode(mode):
+    from dbpool import pool
+    from api.export import export_chunks, decoy_contact, CRM_MAPPINGS
+
+    await pool.open()
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    first_byte = None
+    size = 0
+
+    if mode == "streamed":
+        async for chunk in export_chunks(TENANT, "hubspot"):
+            if first_byte is None and chunk:
+                first_byte = time.perf_counter() - start
+            size += len(chunk)
+    else:
+        mapping = CRM_MAPPINGS["hubspot"]
+        async with pool.reader() as db:
+            async with db.execute("""
+                SELECT decoy_email FROM decoys WHERE customer_email = ? ORDER BY created_at, decoy_email
+            """, (TENANT,)) as cursor:
+                data = [decoy_contact(row[0]) for row in await cursor.fetchall()]
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=list(mapping.values()))
+        writer.writeheader()
+        for row in data:
+            writer.writerow({crm_field: row.get(field, "") for field, crm_field in mapping.items()})
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr("hubspot_contacts.csv", output.getvalue())
+        body = io.BytesIO(zip_buffer.getvalue()).read()
+        first_byte = time.perf_counter() - start
+        size = len(body)
+
+    total = time.perf_counter() - start
+    await pool.close()
+    print(f"{mode:>9}: first byte {first_byte * 1000:9.1f} ms, total {total:6.2f} s, "
+          f"{size / 1e6:7.1f} MB zip, peak RSS +{peak_rss_mb() - baseline:7.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--mode", choices=["streamed", "buffered"])
+    args = parser.parse_args()
+
+    if args.mode:
+        asyncio.run(run_mode(args.mode))
+        return
+
+    os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "export.db")
+    asyncio.run(populate(args.rows))
+    print(f"Exporting {args.rows} decoys")
+    for mode in ("buffered", "streamed"):
+        subprocess.run([sys.executable, __file__, "--mode", mode], check=True)
+
+if __name__ == "__main__":
+    main()
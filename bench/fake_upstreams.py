@@ -0,0 +1,135 @@
+"""Local stand-ins for ipapi.co, Mailgun message storage and SendGrid.
+
+    python bench/fake_upstreams.py --port 8900 --latency-ms 20 --error-rate 0.01 --eml-bytes 8192
+
+Per-upstream values can be given as "ipapi=80,sendgrid=150"; upstreams not
+listed fall back to the plain number when one is included ("20,ipapi=80").
+Point the app at it with IPAPI_BASE_URL and SENDGRID_BASE_URL, and put
+http://host:port/v3/messages/<key> in the webhook's message-url. Request
+counts by upstream and status are served at /_stats.
+"""
+import argparse
+import asyncio
+import random
+from collections import Counter
+
+UPSTREAMS = ("ipapi", "mailgun", "sendgrid")
+
+CITIES = [
+    ("Paris", "Ile-de-France", "France", "FR"),
+    ("Frankfurt am Main", "Hesse", "Germany", "DE"),
+    ("Ashburn", "Virginia", "United States", "US"),
+    ("Singapore", "Singapore", "Singapore", "SG"),
+    ("Sao Paulo", "Sao Paulo", "Brazil", "BR"),
+]
+
+def per_upstream(value: str, cast=float) -> dict:
+    """Parse "20" or "20,ipapi=80" or "ipapi=80" into {upstream: value}"""
+    default, overrides = None, {}
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        name, eq, number = part.partition("=")
+        if not eq:
+            default = cast(part)
+        elif name in UPSTREAMS:
+            overrides[name] = cast(number)
+        else:
+            raise argparse.ArgumentTypeError(f"unknown upstream {name!r}; expected one of {', '.join(UPSTREAMS)}")
+    return {name: overrides.get(name, default if default is not None else cast(0)) for name in UPSTREAMS}
+
+def fake_eml(key: str, size: int) -> bytes:
+    """An RFC 822 message padded with a quoted-printable body to size bytes"""
+    head = (
+        f"Message-ID: <{key}@mail.example.net>\r\n"
+        "From: Attacker <attacker@example.net>\r\n"
+        "To: decoy@decoys.example\r\n"
+        "Subject: Invoice overdue\r\n"
+        "MIME-Version: 1.0\r\n"
+        "Content-Type: text/plain; charset=utf-8\r\n"
+        "Content-Transfer-Encoding: quoted-printable\r\n\r\n"
+    ).encode()
+    line = b"Please find the outstanding invoice attached and remit payment today.\r\n"
+    body = line * (max(0, size - len(head)) // len(line) + 1)
+    return (head + body)[:max(size, len(head))]
+
+def create_app(latency_ms: dict, jitter_ms: dict, error_rate: dict, eml_bytes: int, seed: int = 0):
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, Response
+    from starlette.routing import Route
+
+    rng = random.Random(seed)
+    counts = Counter()
+    emls = {}
+
+    async def upstream_call(name: str):
+        """Sleep for the configured latency; return True if this call should fail"""
+        delay = latency_ms[name] + rng.uniform(-jitter_ms[name], jitter_ms[name])
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        return rng.random() < error_rate[name]
+
+    async def ipapi(request):
+        if await upstream_call("ipapi"):
+            counts["ipapi", 429] += 1
+            return JSONResponse({"error": True, "reason": "RateLimited"}, status_code=429)
+        counts["ipapi", 200] += 1
+        ip = request.path_params["ip"]
+        city, region, country, code = CITIES[hash(ip) % len(CITIES)]
+        return JSONResponse({"ip": ip, "city": city, "region": region, "country_name": country,
+                             "country_code": code, "org": "AS64500 Example Hosting"})
+
+    async def message(request):
+        if await upstream_call("mailgun"):
+            counts["mailgun", 500] += 1
+            return Response(status_code=500)
+        counts["mailgun", 200] += 1
+        key = request.path_params["key"]
+        if key not in emls and len(emls) < 1000:
+            emls[key] = fake_eml(key, eml_bytes)
+        body = emls.get(key) or fake_eml(key, eml_bytes)
+        return Response(body, media_type="message/rfc822")
+
+    async def mail_send(request):
+        await request.body()
+        if await upstream_call("sendgrid"):
+            counts["sendgrid", 503] += 1
+            return JSONResponse({"errors": [{"message": "Service unavailable"}]}, status_code=503)
+        counts["sendgrid", 202] += 1
+        return Response(status_code=202)
+
+    async def stats(request):
+        result = {name: {} for name in UPSTREAMS}
+        for (name, status), count in counts.items():
+            result[name][str(status)] = count
+        return JSONResponse(result)
+
+    return Starlette(routes=[
+        Route("/{ip}/json", ipapi),
+        Route("/v3/messages/{key}", message),
+        Route("/v3/mail/send", mail_send, methods=["POST"]),
+        Route("/_stats", stats),
+    ])
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=per_upstream, default="20", help="mean upstream latency")
+    parser.add_argument("--jitter-ms", type=per_upstream, default="5", help="latency varies by +/- this much")
+    parser.add_argument("--error-rate", type=per_upstream, default="0", help="fraction of calls that fail")
+    parser.add_argument("--eml-bytes", type=int, default=8192, help="size of each stored .eml")
+
+def argv_for(args) -> list:
+    """Command-line flags that reproduce the upstream settings in args"""
+    def joined(values):
+        return ",".join(f"{name}={value}" for name, value in values.items())
+    return ["--latency-ms", joined(args.latency_ms), "--jitter-ms", joined(args.jitter_ms),
+            "--error-rate", joined(args.error_rate), "--eml-bytes", str(args.eml_bytes)]
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--seed", type=int, default=0)
+    add_arguments(parser)
+    args = parser.parse_args()
+    app = create_app(args.latency_ms, args.jitter_ms, args.error_rate, args.eml_bytes, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
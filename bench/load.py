@@ -0,0 +1,430 @@
+"""End-to-end load test against a real server and fake upstreams.
+
+    python bench/load.py --hits 5000 --concurrency 50 --latency-ms 20,sendgrid=100
+    python bench/load.py --compare bench/results/OLD.json bench/results/NEW.json
+
+Starts bench/fake_upstreams.py and `uvicorn main:app` on free local ports.
+The app gets a fresh database and its IPAPI_BASE_URL and SENDGRID_BASE_URL
+point at the fakes. The run seeds decoys through /api/decoys/bulk, then
+does the following:
+
+  steady     --hits multipart webhooks from --concurrency closed-loop workers
+  burst      --bursts bursts of --burst-size webhooks, --burst-interval apart
+  drain      waits until the job queue is empty; hits/s counts every hit
+             from the first webhook until its job finished
+  api        --api-requests GETs for each dashboard endpoint
+
+Webhooks carry a Mailgun-like multipart form with an attachment. A
+--match-rate fraction of them go to provisioned decoys. Sender IPs come
+from a pool of --ips addresses, so the geo cache warms up the way it does
+in production.
+
+Each phase reports throughput and p50/p95/p99/max latency. The run also
+reports the server's peak RSS (VmHWM) and the fake upstream call counts.
+Everything is written as JSON to --output (default
+bench/results/<commit>.json). Server settings can be overridden with
+--env NAME=VALUE.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import fake_upstreams
+
+# Bearer token the server is started with for its operator-only endpoints
+OPS_TOKEN = "load-ops"
+OPS_HEADERS = {"Authorization": f"Bearer {OPS_TOKEN}"}
+OPS_ENDPOINTS = {"/api/queue", "/api/stats/cache", "/metrics"}
+
+API_ENDPOINTS = ("/api/stats", "/api/decoys", "/api/events", "/api/queue", "/api/stats/cache", "/metrics")
+
+# Headline numbers shown by --compare, with whether higher is better
+COMPARED = [
+    ("steady.throughput_rps", True),
+    ("steady.latency_ms.p50", False),
+    ("steady.latency_ms.p99", False),
+    ("burst.throughput_rps", True),
+    ("burst.latency_ms.p99", False),
+    ("drain.hits_per_second", True),
+    ("api./api/events.latency_ms.p99", False),
+    ("api./api/stats.latency_ms.p99", False),
+    ("server.peak_rss_bytes", False),
+]
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(samples, p):
+    """Nearest-rank percentile of sorted samples"""
+    if not samples:
+        return None
+    return samples[max(0, min(len(samples) - 1, int(round(p / 100 * len(samples))) - 1))]
+
+def summarize(latencies, errors: Counter, elapsed) -> dict:
+    """errors counts failures by status code or exception name"""
+    samples = sorted(latencies)
+    return {
+        "requests": len(samples) + sum(errors.values()),
+        "errors": sum(errors.values()),
+        "error_kinds": dict(errors),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            name: round(percentile(samples, p) * 1000, 2) if samples else None
+            for name, p in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+        },
+    }
+
+def peak_rss(pid: int):
+    """High-water resident set size of a process in bytes, or None off Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def wait_until_up(client, url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode}")
+        try:
+            if (await client.get(url)).status_code < 500:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+class Traffic:
+    """Mailgun-shaped webhook forms"""
+
+    def __init__(self, args, upstream_url):
+        self.rng = random.Random(args.seed)
+        self.decoys = [f"decoy{i}@decoys.example" for i in range(args.decoys)]
+        self.ips = [f"198.51.{i // 250 % 256}.{i % 250 + 1}" for i in range(args.ips)]
+        self.match_rate = args.match_rate
+        self.attachment = os.urandom(args.attachment_bytes)
+        self.upstream_url = upstream_url
+        self.sent = 0
+
+    def webhook(self):
+        rng = self.rng
+        self.sent += 1
+        n = self.sent
+        recipient = rng.choice(self.decoys) if rng.random() < self.match_rate else f"nobody{n}@decoys.example"
+        data = {
+            "recipient": recipient,
+            "sender": f"attacker{rng.randrange(1000)}@example.net",
+            "from": "Attacker <attacker@example.net>",
+            "subject": f"Invoice {n} overdue",
+            "body-plain": "Please find the outstanding invoice attached and remit payment today.\n" * 4,
+            "stripped-text": "Please find the outstanding invoice attached.",
+            "X-Mailgun-Incoming-IP": rng.choice(self.ips),
+            "message-url": f"{self.upstream_url}/v3/messages/m{n}",
+            "timestamp": str(int(time.time())),
+            "attachment-count": "1",
+        }
+        files = {"attachment-1": ("invoice.pdf", self.attachment, "application/pdf")}
+        return data, files
+
+async def timed_request(client, method, path, latencies, errors, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, path, **kwargs)
+    except Exception as e:
+        errors[type(e).__name__] += 1
+        return
+    if response.status_code == 200:
+        latencies.append(time.perf_counter() - start)
+    else:
+        errors[str(response.status_code)] += 1
+
+async def send_webhook(client, traffic, latencies, errors):
+    data, files = traffic.webhook()
+    await timed_request(client, "POST", "/webhook/inbound", latencies, errors, data=data, files=files)
+
+async def steady(client, traffic, hits, concurrency) -> dict:
+    latencies, errors = [], Counter()
+    remaining = iter(range(hits))
+
+    async def worker():
+        for _ in remaining:
+            await send_webhook(client, traffic, latencies, errors)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+async def bursts(client, traffic, count, size, interval) -> dict:
+    latencies, errors, busy = [], Counter(), 0.0
+    start = time.perf_counter()
+    for i in range(count):
+        burst_start = time.perf_counter()
+        await asyncio.gather(*(send_webhook(client, traffic, latencies, errors) for _ in range(size)))
+        busy += time.perf_counter() - burst_start
+        if i < count - 1:
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - burst_start)))
+    result = summarize(latencies, errors, busy)
+    result["wall_seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+async def drain(client, started_at, hits, timeout) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        queue = (await client.get("/api/queue", headers=OPS_HEADERS)).json()
+        if queue["depth"] == 0 and queue["running"] == 0:
+            break
+        if time.monotonic() > deadline:
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started_at
+    return {
+        "hits": hits,
+        "seconds": round(elapsed, 3),
+        "hits_per_second": round(hits / elapsed, 1),
+        "timed_out": queue["depth"] + queue["running"] > 0,
+        "dead_jobs": queue["dead"],
+        "alerts": {status: info["count"] for status, info in queue["alerts"].items()},
+    }
+
+async def api(client, headers, requests, concurrency) -> dict:
+    results = {}
+    for path in API_ENDPOINTS:
+        latencies, errors = [], Counter()
+        remaining = iter(range(requests))
+
+        async def worker():
+            for _ in remaining:
+                await timed_request(client, "GET", path, latencies, errors,
+                                    headers=OPS_HEADERS if path in OPS_ENDPOINTS else headers)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        results[path] = summarize(latencies, errors, time.perf_counter() - start)
+    return results
+
+async def seed(db_path, user):
+    """Create the schema and authorize the bench user before the server starts"""
+    os.environ["DATABASE_PATH"] = db_path
+    from dbpool import pool
+    from db import init_db
+
+    await pool.open()
+    try:
+        await init_db()
+        async with pool.writer() as db:
+            await db.execute("INSERT OR IGNORE INTO authorized_users (email) VALUES (?)", (user,))
+    finally:
+        await pool.close()
+
+@asynccontextmanager
+async def stack(args):
+    """Seed a fresh database, start the fake upstreams and the server, and provision the decoys.
+
+    Yields (client, upstream_client, headers, traffic, server).
+    """
+    import httpx
+
+    workdir = tempfile.mkdtemp(prefix="honeypot-load-")
+    user = "load@example.com"
+    db_path = os.path.join(workdir, "load.db")
+    await seed(db_path, user)
+    from auth import create_access_token
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': user})}"}
+
+    upstream_port, app_port = free_port(), free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    env = dict(os.environ,
+               DATABASE_PATH=db_path,
+               BLOB_DIR=os.path.join(workdir, "blobs"),
+               EXPORT_DIR=os.path.join(workdir, "exports"),
+               IPAPI_BASE_URL=upstream_url,
+               SENDGRID_BASE_URL=upstream_url,
+               SENDGRID_API_KEY="load",
+               MAILGUN_API_KEY="load",
+               OPS_TOKEN=OPS_TOKEN,
+               LOG_LEVEL="WARNING")
+    env.pop("GEO_DB_PATH", None)
+    env.update(args.env)
+
+    server_log = open(os.path.join(workdir, "server.log"), "wb")
+    upstreams = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "fake_upstreams.py"), "--port", str(upstream_port),
+         "--seed", str(args.seed), *fake_upstreams.argv_for(args)],
+        stdout=server_log, stderr=subprocess.STDOUT)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+         "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+        cwd=REPO_DIR, env=env, stdout=server_log, stderr=subprocess.STDOUT)
+    try:
+        limits = httpx.Limits(max_connections=max(args.concurrency, args.burst_size))
+        timeout = httpx.Timeout(60)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", limits=limits,
+                                     timeout=timeout) as client, \
+                httpx.AsyncClient(base_url=upstream_url, timeout=timeout) as upstream_client:
+            await wait_until_up(upstream_client, "/_stats", upstreams)
+            await wait_until_up(client, "/", server)
+
+            traffic = Traffic(args, upstream_url)
+            decoys = "".join(f"{decoy},load{i % 5}\n" for i, decoy in enumerate(traffic.decoys))
+            response = await client.post("/api/decoys/bulk?format=csv", headers=headers,
+                                         content=f"decoy_email,use_case\n{decoys}")
+            response.raise_for_status()
+            yield client, upstream_client, headers, traffic, server
+    finally:
+        for process in (server, upstreams):
+            process.terminate()
+        for process in (server, upstreams):
+            process.wait()
+        server_log.close()
+
+def server_rss(server):
+    """Peak RSS of the server, summed over its worker processes when it has several"""
+    try:
+        children = [int(pid) for pid in open(f"/proc/{server.pid}/task/{server.pid}/children").read().split()]
+    except OSError:
+        children = []
+    sizes = [peak_rss(pid) for pid in children or [server.pid]]
+    return sum(sizes) if all(sizes) else None
+
+async def run(args) -> dict:
+    async with stack(args) as (client, upstream_client, headers, traffic, server):
+        log(f"steady: {args.hits} webhooks, concurrency {args.concurrency}")
+        started_at = time.perf_counter()
+        results = {"steady": await steady(client, traffic, args.hits, args.concurrency)}
+        log(f"burst: {args.bursts} x {args.burst_size} webhooks every {args.burst_interval}s")
+        results["burst"] = await bursts(client, traffic, args.bursts, args.burst_size, args.burst_interval)
+        log("drain: waiting for the job queue to empty")
+        results["drain"] = await drain(client, started_at, traffic.sent, args.drain_timeout)
+        log(f"api: {args.api_requests} requests per endpoint")
+        results["api"] = await api(client, headers, args.api_requests, args.concurrency)
+        results["upstreams"] = (await upstream_client.get("/_stats")).json()
+        results["server"] = {"peak_rss_bytes": server_rss(server)}
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "settings": {
+            "hits": args.hits, "workers": args.workers, "concurrency": args.concurrency, "bursts": args.bursts,
+            "burst_size": args.burst_size, "burst_interval": args.burst_interval,
+            "api_requests": args.api_requests, "decoys": args.decoys, "match_rate": args.match_rate,
+            "ips": args.ips, "attachment_bytes": args.attachment_bytes, "eml_bytes": args.eml_bytes,
+            "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "error_rate": args.error_rate,
+            "env": args.env,
+        },
+        **results,
+    }
+
+def log(message):
+    print(message, file=sys.stderr)
+
+def lookup(result, dotted):
+    value = result
+    for part in dotted.split(".") if not dotted.startswith("api.") else ["api", *dotted[4:].rsplit(".", 2)]:
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def compare(old_path, new_path) -> int:
+    """Print the headline numbers of two result files side by side"""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if old.get("settings") != new.get("settings"):
+        print("note: the runs used different settings")
+    print(f"{'metric':<34}{old.get('commit') or 'old':>14}{new.get('commit') or 'new':>14}{'change':>10}")
+    for name, higher_is_better in COMPARED:
+        a, b = lookup(old, name), lookup(new, name)
+        if a is None or b is None:
+            continue
+        change = (b - a) / a * 100 if a else 0.0
+        worse = change < 0 if higher_is_better else change > 0
+        flag = "  worse" if worse and abs(change) >= 5 else ""
+        print(f"{name:<34}{a:>14}{b:>14}{change:>+9.1f}%{flag}")
+    return 0
+
+def report(result):
+    print(f"{'phase':<20}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    rows = [("steady", result["steady"]), ("burst", result["burst"])]
+    rows += [(path, stats) for path, stats in result["api"].items()]
+    for name, stats in rows:
+        latency = stats["latency_ms"]
+        print(f"{name:<20}{stats['throughput_rps']:>10}{latency['p50']:>10}{latency['p95']:>10}"
+              f"{latency['p99']:>10}{stats['errors']:>8}")
+    drain_result = result["drain"]
+    print(f"hits processed end to end: {drain_result['hits_per_second']} hits/s"
+          f"{' (drain timed out)' if drain_result['timed_out'] else ''}, {drain_result['dead_jobs']} dead jobs")
+    rss = result["server"]["peak_rss_bytes"]
+    print(f"server peak RSS: {rss / 1024 / 1024:.1f} MiB" if rss else "server peak RSS: unavailable")
+
+def env_pair(value: str):
+    name, eq, setting = value.partition("=")
+    if not eq:
+        raise argparse.ArgumentTypeError("expected NAME=VALUE")
+    return name, setting
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hits", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=1, help="server processes")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--burst-size", type=int, default=500)
+    parser.add_argument("--burst-interval", type=float, default=2.0)
+    parser.add_argument("--api-requests", type=int, default=1000)
+    parser.add_argument("--decoys", type=int, default=1000)
+    parser.add_argument("--match-rate", type=float, default=0.9)
+    parser.add_argument("--ips", type=int, default=500)
+    parser.add_argument("--attachment-bytes", type=int, default=4096)
+    parser.add_argument("--drain-timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--env", type=env_pair, action="append", default=[], help="server setting NAME=VALUE")
+    parser.add_argument("--output", help="result file (default bench/results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    fake_upstreams.add_arguments(parser)
+    args = parser.parse_args()
+    if args.compare:
+        return compare(*args.compare)
+    args.env = dict(args.env)
+
+    result = asyncio.run(run(args))
+    report(result)
+    output = args.output or os.path.join(BENCH_DIR, "results", f"{result['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {output}")
+    return 1 if result["drain"]["timed_out"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Cost of recording metrics on the decoy hit path.
+
+    python bench/metrics.py --hits 200000
+
+Replays the recordings a decoy hit makes. The webhook request does two
+stage timers and one writer-wait observation. The job that processes the
+hit does six stage timers, the match, fetched-bytes and two upstream
+counters, and two writer waits. Reports the mean cost of each, net of the
+loop. The target is a few microseconds per webhook request.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+TARGET_US_PER_REQUEST = 5.0
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hits", type=int, default=200_000)
+    args = parser.parse_args()
+
+    from metrics import STAGE_SECONDS, HITS, UPSTREAM_RESPONSES, EML_BYTES, DB_WRITER_WAIT
+
+    form_parse, enqueue = STAGE_SECONDS.labels("form_parse"), STAGE_SECONDS.labels("enqueue")
+    job_stages = [STAGE_SECONDS.labels(stage) for stage in (
+        "find_customer", "geo_lookup", "eml_fetch", "blob_put", "log_event", "queue_alert"
+    )]
+    matches, fetched, writer_wait = HITS.labels("match"), EML_BYTES.labels(), DB_WRITER_WAIT.labels()
+
+    def request():
+        with form_parse.time():
+            pass
+        writer_wait.observe(0.0001)
+        with enqueue.time():
+            pass
+
+    def job():
+        for stage in job_stages:
+            with stage.time():
+                pass
+        matches.inc()
+        fetched.inc(4096)
+        UPSTREAM_RESPONSES.labels("ipapi", 200).inc()
+        UPSTREAM_RESPONSES.labels("mailgun", 200).inc()
+        writer_wait.observe(0.0001)
+        writer_wait.observe(0.0001)
+
+    def empty():
+        for stage in job_stages:
+            pass
+
+    def timed(func):
+        start = time.perf_counter()
+        for _ in range(args.hits):
+            func()
+        return (time.perf_counter() - start) / args.hits * 1e6
+
+    timed(request)
+    timed(job)
+    baseline = timed(empty)
+    per_request = timed(request) - baseline
+    per_job = timed(job) - baseline
+    print(f"webhook request (3 recordings)   {per_request:6.2f} us")
+    print(f"hit job (12 recordings)          {per_job:6.2f} us")
+    print(f"target {TARGET_US_PER_REQUEST} us/request: {'met' if per_request <= TARGET_US_PER_REQUEST else 'MISSED'}")
+    return 0 if per_request <= TARGET_US_PER_REQUEST else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
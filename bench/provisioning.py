@@ -0,0 +1,73 @@
+"""Decoy provisioning throughput: insert_decoy per row vs the bulk loader.
+
+    python bench/provisioning.py --decoys 200000
+
+Writes a CSV of --decoys rows for --customers tenants (default: one new
+customer's rollout), loads it with DecoyLoader into a fresh scratch
+database, then loads it again to time the idempotent re-run. The per-row baseline only provisions --baseline rows
+because it is far slower. The target for the bulk load is 50k decoys/sec.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+TARGET_PER_SECOND = 50_000
+
+async def fresh_db():
+    from dbpool import pool
+    from db import init_db
+    await pool.close()
+    pool.path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    await init_db()
+
+async def bulk(path, args):
+    from provisioning import DecoyLoader, iter_lines, file_chunks
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        report = await DecoyLoader("csv", batch_size=args.batch_size).load(iter_lines(file_chunks(f)))
+    elapsed = time.perf_counter() - start
+    assert report["error_count"] == 0, report["errors"][:5]
+    return report, elapsed
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--decoys", type=int, default=200_000)
+    parser.add_argument("--customers", type=int, default=1)
+    parser.add_argument("--baseline", type=int, default=2_000)
+    parser.add_argument("--batch-size", type=int, default=20_000)
+    args = parser.parse_args()
+
+    from dbpool import pool
+    from db import insert_decoy
+
+    path = os.path.join(tempfile.mkdtemp(), "decoys.csv")
+    with open(path, "w") as f:
+        f.write("decoy_email,customer_email,use_case\n")
+        for i in range(args.decoys):
+            f.write(f"decoy{i}@example.com,customer{i % args.customers}@example.com,use case {i % 7}\n")
+
+    await fresh_db()
+    start = time.perf_counter()
+    for i in range(args.baseline):
+        await insert_decoy(f"decoy{i}@example.com", f"customer{i % args.customers}@example.com", f"use case {i % 7}")
+    elapsed = time.perf_counter() - start
+    print(f"insert_decoy   {args.baseline:>8} rows  {elapsed:7.2f}s  {args.baseline / elapsed:>9.0f} decoys/s")
+
+    await fresh_db()
+    report, elapsed = await bulk(path, args)
+    rate = args.decoys / elapsed
+    print(f"bulk load      {report['inserted']:>8} rows  {elapsed:7.2f}s  {rate:>9.0f} decoys/s")
+    report, rerun = await bulk(path, args)
+    print(f"bulk re-run    {report['unchanged']:>8} rows  {rerun:7.2f}s  {args.decoys / rerun:>9.0f} decoys/s (unchanged)")
+    await pool.close()
+
+    print(f"target {TARGET_PER_SECOND} decoys/s: {'met' if rate >= TARGET_PER_SECOND else 'MISSED'}")
+    return 0 if rate >= TARGET_PER_SECOND else 1
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,80 @@
+"""Fail if a dashboard query falls back to a full table scan.
+
+    python bench/query_plans.py
+
+Builds the schema in a scratch database, runs EXPLAIN QUERY PLAN for each
+dashboard query and exits non-zero when a plan scans a table without an
+index or sorts rows the index should have ordered. Run it after changing a dashboard query or the schema.
+"""
+import asyncio
+import os
+import re
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# A bare "SCAN <table or alias>" is a full table scan; "SCAN x USING ... INDEX"
+# is not. Sorting in a temp b-tree means the index does not serve the ORDER BY.
+FULL_SCAN = re.compile(r"^SCAN \w+$|TEMP B-TREE FOR ORDER BY")
+
+# Hot events plus two archived months, created in the scratch database
+PARTITIONS = ("events", "events_archive_2025_01", "events_archive_2024_12")
+
+def dashboard_queries():
+    from api.decoys import decoys_query
+    from api.events import events_query, REPLAY_QUERY
+    from api.stats import TOTALS_QUERY, INDUSTRIES_QUERY, TREND_QUERY, TOP_QUERY
+    from api.export import export_query
+    from event_writer import STORED_MESSAGE_KEYS
+    from ingest_guard import EVENT_EXISTS
+    tenant, cursor = "c@example.com", ["2025-01-01T00:00:00", 10]
+    return {
+        "/api/decoys": decoys_query(tenant, None),
+        "/api/decoys next page": decoys_query(tenant, ["2025-01-01T00:00:00", "d@example.com"]),
+        "/api/events": events_query(tenant),
+        "/api/events next page": events_query(tenant, cursor=cursor),
+        "/api/events by decoy": events_query(tenant, decoy="d@example.com", cursor=cursor),
+        "/api/events by sender": events_query(tenant, sender="s@example.net", since="2025-01-01"),
+        "/api/events by ip": events_query(tenant, ip="203.0.113.7", until="2025-01-01"),
+        "/api/events with archives": events_query(tenant, cursor=cursor, partitions=PARTITIONS),
+        "/api/events by sender with archives": events_query(tenant, sender="s@example.net", partitions=PARTITIONS),
+        "/api/events/stream replay": (REPLAY_QUERY, (tenant, 10, 100)),
+        "/api/stats totals": (TOTALS_QUERY, (tenant,)),
+        "/api/stats industries": (INDUSTRIES_QUERY, (tenant,)),
+        "/api/stats trend": (TREND_QUERY, (tenant, "day", "2025-01-01", "2025-02-01")),
+        "/api/stats top": (TOP_QUERY, (tenant, '["2025-01", "2025-02-01"]')),
+        "/api/export": export_query(tenant),
+        "/api/export next chunk": export_query(tenant, after=["2025-01-01T00:00:00", "d@example.com"]),
+        "/api/exports by use case": export_query(tenant, "sales"),
+        "/api/exports by use case next chunk": export_query(tenant, "sales", ["2025-01-01T00:00:00", "d@example.com"]),
+        "webhook duplicate check": (EVENT_EXISTS, ("k",)),
+        "event writer duplicate check": (STORED_MESSAGE_KEYS, ('["k"]',)),
+    }
+
+async def main():
+    from dbpool import pool
+    from db import init_db
+    from retention import create_archive
+
+    pool.path = os.path.join(tempfile.mkdtemp(), "plans.db")
+    await init_db()
+    async with pool.writer() as db:
+        for table in PARTITIONS[1:]:
+            await create_archive(db, table[-7:].replace("_", "-"))
+    failures = 0
+    async with pool.reader() as db:
+        for name, (query, params) in dashboard_queries().items():
+            params = list(params) + [1] * (query.count("?") - len(params))
+            async with db.execute(f"EXPLAIN QUERY PLAN {query}", params) as cursor:
+                details = [row[3] for row in await cursor.fetchall()]
+            scans = [detail for detail in details if FULL_SCAN.match(detail)]
+            failures += bool(scans)
+            print(f"{'FAIL' if scans else 'ok  '} {name}")
+            for detail in details:
+                print(f"       {detail}")
+    await pool.close()
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(main()) else 0)
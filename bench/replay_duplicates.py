@@ -0,0 +1,149 @@
+"""Upstream calls and stored hits when a webhook burst contains Mailgun redeliveries.
+
+    python bench/replay_duplicates.py --messages 1000 --duplicates 0.3
+    python bench/replay_duplicates.py --capture burst.ndjson
+    python bench/replay_duplicates.py --tree /path/to/older/checkout
+
+Builds a burst of --messages distinct deliveries, then adds redeliveries
+until they are --duplicates of the traffic. Some redeliveries arrive
+while the first delivery is still being processed, and some after it
+has finished. --capture replays webhook forms from an NDJSON file instead,
+one form per line. The app runs in-process with its job workers.
+httpx.MockTransport answers and counts the ipapi, Mailgun and SendGrid
+calls. The bench reports those counts, with the events and alerts stored,
+and checks that each distinct delivery was stored exactly once. --tree
+runs against another checkout for a "before" figure.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+def synthesize(messages, duplicates, seed):
+    rng = random.Random(seed)
+    forms = [{
+        "recipient": f"decoy{i % 50}@decoys.example",
+        "sender": f"attacker{i}@example.net",
+        "subject": f"Invoice {i}",
+        "body-plain": "Please remit payment today.",
+        "Message-Id": f"<{i}.{seed}@mail.example.net>",
+        "X-Mailgun-Incoming-IP": f"198.51.{i // 250 % 256}.{i % 250 + 1}",
+        "message-url": f"https://storage.mailgun.net/v3/domains/example.net/messages/m{i}",
+    } for i in range(messages)]
+    redeliveries = int(messages * duplicates / (1 - duplicates))
+    burst = list(forms)
+    for _ in range(redeliveries):
+        # Anywhere after the first delivery: right behind it, or much later
+        original = rng.randrange(messages)
+        burst.insert(rng.randrange(original + 1, len(burst) + 1), forms[original])
+    return burst
+
+async def replay(burst, concurrency, delivered):
+    import httpx
+    import http_clients
+    import main as app_module
+    from db import insert_decoy
+    from dbpool import pool
+
+    calls = Counter()
+
+    def upstream(request):
+        host = request.url.host
+        if host == "storage.mailgun.net":
+            calls["mailgun"] += 1
+            return httpx.Response(200, content=b"From: a@example.net\r\n\r\n" + b"x" * 4096)
+        if host == "api.sendgrid.com":
+            calls["sendgrid"] += 1
+            return httpx.Response(202)
+        calls["ipapi"] += 1
+        return httpx.Response(200, json={"city": "Paris", "region": "Ile-de-France", "country_name": "France"})
+
+    app = app_module.app
+    await app.router.startup()
+    try:
+        for name, client in list(http_clients._clients.items()):
+            http_clients._clients[name] = httpx.AsyncClient(
+                transport=httpx.MockTransport(upstream), base_url=client.base_url, event_hooks=client.event_hooks
+            )
+        for recipient in sorted({form["recipient"] for form in burst}):
+            await insert_decoy(recipient, "bench@example.com", "bench")
+
+        queue = iter(burst)
+        statuses = Counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def worker():
+                for form in queue:
+                    response = await client.post("/webhook/inbound", data=form)
+                    response.raise_for_status()
+                    statuses[response.json()["status"]] += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            while True:
+                async with pool.reader() as db:
+                    async with db.execute("SELECT COUNT(*) FROM jobs WHERE status != 'dead'") as cursor:
+                        if (await cursor.fetchone())[0] == 0:
+                            break
+                await asyncio.sleep(0.01)
+            elapsed = time.perf_counter() - start
+
+        async with pool.reader() as db:
+            async with db.execute("SELECT COUNT(*), COUNT(DISTINCT sender_email || subject) FROM events") as cursor:
+                events, distinct_events = await cursor.fetchone()
+            async with db.execute("SELECT COUNT(*) FROM alerts") as cursor:
+                (alerts,) = await cursor.fetchone()
+    finally:
+        await app.router.shutdown()
+
+    return {
+        "webhooks": len(burst),
+        "deliveries": delivered,
+        "responses": dict(statuses),
+        "upstream_calls": dict(calls),
+        "events": events,
+        "distinct_events": distinct_events,
+        "alerts": alerts,
+        "seconds": round(elapsed, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--duplicates", type=float, default=0.3, help="fraction of the burst that is redeliveries")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--capture", help="NDJSON file of webhook forms to replay instead")
+    parser.add_argument("--tree", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."),
+                        help="checkout to run")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "replay.db")
+    os.environ["BLOB_DIR"] = tempfile.mkdtemp()
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Keep alerts queued so the count is of alerts raised, not of digests sent
+    os.environ.setdefault("ALERT_DIGEST_WINDOW_SECONDS", "3600")
+    os.chdir(args.tree)
+    sys.path.insert(0, os.path.abspath(args.tree))
+
+    if args.capture:
+        with open(args.capture) as f:
+            burst = [json.loads(line) for line in f if line.strip()]
+    else:
+        burst = synthesize(args.messages, args.duplicates, args.seed)
+    delivered = len({(form.get("Message-Id") or form.get("token"), form["recipient"]) for form in burst})
+
+    result = asyncio.run(replay(burst, args.concurrency, delivered))
+    print(json.dumps(result, indent=2))
+    print(f"{result['webhooks']} webhooks, {delivered} distinct deliveries: "
+          f"{sum(result['upstream_calls'].get(name, 0) for name in ('ipapi', 'mailgun'))} ipapi+Mailgun calls, "
+          f"{result['events']} events, {result['alerts']} alerts")
+    return 0 if result["events"] == result["alerts"] == delivered else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
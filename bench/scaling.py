@@ -0,0 +1,156 @@
+"""Webhook throughput as the server runs more worker processes.
+
+    python bench/scaling.py --workers 1,2,4 --hits 4000 --drivers 4
+    python bench/scaling.py --workers 1,2,4,8 --latency-ms 50
+
+For each --workers count, starts bench/fake_upstreams.py and
+`uvicorn main:app --workers N` on a fresh database the way bench/load.py
+does. --drivers load generator processes then send --hits webhooks between
+them, --concurrency in flight in total, so a single client process does
+not cap the figure. The run waits for the job queue to drain and reports
+webhooks/s and latency at the edge, hits/s end to end, errors by kind and
+the speedup over the first count. Results are written as JSON to --output.
+
+One process writes and the rest forward their writes to it (see
+coordinator.py), so webhooks/s should scale with cores while end-to-end
+hits/s is bounded by the writer. Worker processes beyond the machine's
+cores only add contention; the report says how many cores there were.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_upstreams
+import load
+
+def driver_argv(args, url, upstream_url, hits, concurrency, seed):
+    return [sys.executable, os.path.abspath(__file__), "--drive", url, "--upstream-url", upstream_url,
+            "--hits", str(hits), "--concurrency", str(concurrency), "--seed", str(seed),
+            "--decoys", str(args.decoys), "--match-rate", str(args.match_rate), "--ips", str(args.ips),
+            "--attachment-bytes", str(args.attachment_bytes)]
+
+async def drive(args):
+    """Driver process: send --hits webhooks and print the raw latencies as JSON"""
+    import httpx
+
+    traffic = load.Traffic(args, args.upstream_url)
+    latencies, errors = [], Counter()
+    remaining = iter(range(args.hits))
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.drive, limits=limits, timeout=httpx.Timeout(60)) as client:
+        async def worker():
+            for _ in remaining:
+                await load.send_webhook(client, traffic, latencies, errors)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    json.dump({"latencies": latencies, "errors": dict(errors), "seconds": elapsed, "sent": traffic.sent}, sys.stdout)
+
+async def run_one(args) -> dict:
+    """Measure one --workers count"""
+    async with load.stack(args) as (client, upstream_client, headers, traffic, server):
+        url = str(client.base_url).rstrip("/")
+        upstream_url = str(upstream_client.base_url).rstrip("/")
+        share, extra = divmod(args.hits, args.drivers)
+        drivers = [
+            await asyncio.create_subprocess_exec(
+                *driver_argv(args, url, upstream_url, share + (i < extra),
+                             max(1, args.concurrency // args.drivers), args.seed * 1000 + i),
+                stdout=asyncio.subprocess.PIPE)
+            for i in range(args.drivers)
+        ]
+        started_at = time.perf_counter()
+        outputs = await asyncio.gather(*(process.communicate() for process in drivers))
+        edge_seconds = time.perf_counter() - started_at
+
+        latencies, errors, sent = [], Counter(), 0
+        for stdout, _ in outputs:
+            result = json.loads(stdout)
+            latencies += result["latencies"]
+            errors.update(result["errors"])
+            sent += result["sent"]
+        webhooks = load.summarize(latencies, errors, edge_seconds)
+        drained = await load.drain(client, started_at, sent, args.drain_timeout)
+        coordinator = (await client.get("/api/stats/cache", headers=load.OPS_HEADERS)).json().get("coordinator")
+        rss = load.server_rss(server)
+    return {"workers": args.workers, "webhooks": webhooks, "drain": drained, "peak_rss_bytes": rss,
+            "answered_by": coordinator}
+
+def report(results, cores):
+    print(f"{cores} CPU core(s) available")
+    print(f"{'workers':>8}{'webhooks/s':>12}{'speedup':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}"
+          f"{'hits/s':>9}{'RSS MiB':>9}")
+    base = results[0]["webhooks"]["throughput_rps"] or 1
+    for result in results:
+        webhooks, latency = result["webhooks"], result["webhooks"]["latency_ms"]
+        rss = result["peak_rss_bytes"]
+        print(f"{result['workers']:>8}{webhooks['throughput_rps']:>12}{webhooks['throughput_rps'] / base:>8.2f}x"
+              f"{latency['p50']:>9}{latency['p99']:>9}{webhooks['errors']:>8}"
+              f"{result['drain']['hits_per_second']:>9}{rss / 1024 / 1024 if rss else 0:>9.1f}")
+        if webhooks["error_kinds"]:
+            print(f"{'':>8}errors: {webhooks['error_kinds']}")
+    if any(result["workers"] > cores for result in results):
+        print(f"note: counts above {cores} run more processes than cores and cannot scale here")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated server process counts")
+    parser.add_argument("--hits", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=64, help="webhooks in flight across all drivers")
+    parser.add_argument("--drivers", type=int, default=max(1, min(4, os.cpu_count() or 1)),
+                        help="load generator processes")
+    parser.add_argument("--decoys", type=int, default=1000)
+    parser.add_argument("--match-rate", type=float, default=0.9)
+    parser.add_argument("--ips", type=int, default=500)
+    parser.add_argument("--attachment-bytes", type=int, default=4096)
+    parser.add_argument("--drain-timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--env", type=load.env_pair, action="append", default=[], help="server setting NAME=VALUE")
+    parser.add_argument("--output", help="result file (default bench/results/<commit>-scaling.json)")
+    parser.add_argument("--one", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--drive", help=argparse.SUPPRESS)
+    parser.add_argument("--upstream-url", help=argparse.SUPPRESS)
+    fake_upstreams.add_arguments(parser)
+    args = parser.parse_args()
+    args.env = dict(args.env)
+
+    if args.drive:
+        asyncio.run(drive(args))
+        return 0
+    if args.one is not None:
+        # load.stack() seeds through the app's own modules, which read DATABASE_PATH once per
+        # process, so every count runs in a process of its own
+        args.workers = args.one
+        args.burst_size = 0
+        json.dump(asyncio.run(run_one(args)), sys.stdout)
+        return 0
+
+    results = []
+    for workers in [int(n) for n in args.workers.split(",")]:
+        load.log(f"{workers} worker(s): {args.hits} webhooks from {args.drivers} driver(s)")
+        one = subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--one", str(workers)],
+                             stdout=subprocess.PIPE, check=True)
+        results.append(json.loads(one.stdout))
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    report(results, cores)
+    output = args.output or os.path.join(BENCH_DIR, "results", f"{load.git_commit() or 'local'}-scaling.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"commit": load.git_commit(), "cores": cores, "settings": {
+            "hits": args.hits, "concurrency": args.concurrency, "drivers": args.drivers,
+            "latency_ms": args.latency_ms, "env": args.env}, "results": results}, f, indent=2)
+    print(f"results written to {output}")
+    return 1 if any(result["drain"]["timed_out"] for result in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
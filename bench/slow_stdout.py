@@ -0,0 +1,116 @@
+"""Decoy hit throughput while stdout drains into a slow pipe.
+
+    python bench/slow_stdout.py --hits 2000 --pipe-kbps 50
+    python bench/slow_stdout.py --tree /path/to/older/checkout
+
+Runs the app in a child process whose stdout is a pipe that the parent
+reads at --pipe-kbps. That is the situation that stalled the server when
+it logged with print(). The child posts --hits webhooks and times until
+every hit job has finished. Upstreams are answered in-process by
+httpx.MockTransport. --tree runs the same load against another checkout
+to get a "before" figure. Compare with --pipe-kbps 0, which drains as fast
+as possible.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+async def child(args):
+    import httpx
+    import http_clients
+    import main as app_module
+    from db import insert_decoy
+    from dbpool import pool
+
+    def upstream(request):
+        if request.url.host == "storage.mailgun.net":
+            return httpx.Response(200, content=b"x" * 2048)
+        return httpx.Response(200, json={"city": "Paris", "region": "Ile-de-France", "country_name": "France"})
+
+    app = app_module.app
+    await app.router.startup()
+    try:
+        for name, client in list(http_clients._clients.items()):
+            http_clients._clients[name] = httpx.AsyncClient(
+                transport=httpx.MockTransport(upstream), base_url=client.base_url, event_hooks=client.event_hooks
+            )
+        await insert_decoy("decoy@example.com", "bench@example.com", "bench")
+
+        remaining = iter(range(args.hits))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def worker():
+                for i in remaining:
+                    response = await client.post("/webhook/inbound", data={
+                        "recipient": "decoy@example.com",
+                        "sender": f"attacker{i}@example.net",
+                        "subject": f"Invoice {i}",
+                        "body-plain": "hello",
+                        "X-Mailgun-Incoming-IP": f"203.0.113.{i % 250}",
+                        "message-url": f"https://storage.mailgun.net/v3/messages/{i}",
+                    })
+                    response.raise_for_status()
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            accepted = time.perf_counter() - start
+            while True:
+                async with pool.reader() as db:
+                    async with db.execute("SELECT COUNT(*) FROM jobs") as cursor:
+                        if (await cursor.fetchone())[0] == 0:
+                            break
+                await asyncio.sleep(0.01)
+            processed = time.perf_counter() - start
+    finally:
+        await app.router.shutdown()
+
+    sys.stderr.write(f"webhook accepted   {args.hits / accepted:8.1f} req/s\n")
+    sys.stderr.write(f"hits processed     {args.hits / processed:8.1f} hits/s\n")
+
+def drain(pipe, kbps, totals):
+    chunk = 1024
+    while True:
+        data = pipe.read1(chunk) if kbps else pipe.read1(1 << 16)
+        if not data:
+            break
+        totals["bytes"] += len(data)
+        if kbps:
+            time.sleep(len(data) / (kbps * 1024))
+
+def parent(args):
+    env = dict(os.environ,
+               DATABASE_PATH=os.path.join(tempfile.mkdtemp(), "bench.db"),
+               BLOB_DIR=tempfile.mkdtemp(),
+               ALERT_DIGEST_WINDOW_SECONDS="3600",
+               PYTHONPATH=args.tree)
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--hits", str(args.hits),
+               "--concurrency", str(args.concurrency)]
+    process = subprocess.Popen(command, cwd=args.tree, env=env, stdout=subprocess.PIPE)
+    totals = {"bytes": 0}
+    reader = threading.Thread(target=drain, args=(process.stdout, args.pipe_kbps, totals))
+    reader.start()
+    process.wait()
+    reader.join()
+    print(f"tree {args.tree}, pipe {args.pipe_kbps or 'unthrottled'} KB/s, {totals['bytes']} bytes of logs read")
+    return process.returncode
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hits", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--pipe-kbps", type=int, default=50, help="pipe read rate; 0 drains as fast as possible")
+    parser.add_argument("--tree", default=os.path.dirname(BENCH_DIR), help="checkout to run")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        sys.path.insert(0, os.getcwd())
+        asyncio.run(child(args))
+    else:
+        sys.exit(parent(args))
@@ -0,0 +1,186 @@
+"""Cold start: time from launching the server to its first successful webhook.
+
+    python bench/startup.py --decoys 100000 --runs 5
+    python bench/startup.py --warmups startup,background,off
+
+Seeds a database with --decoys decoys, starts bench/fake_upstreams.py, and
+then, for each decoy cache warm-up mode in --warmups (DECOY_CACHE_WARMUP),
+starts `uvicorn main:app` --runs times on that database, the way a
+spun-down instance wakes up. From the moment the process is launched,
+each run times:
+
+  first 200    the first POST /webhook/inbound answered 200, retried as
+               soon as the server refuses a connection
+  first event  that hit stored in the events table, once its job has
+               found the decoy
+
+It also times `import main` in a fresh interpreter, the floor under both.
+Each figure is the median over the runs. Results are written as JSON to
+--output.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_upstreams
+import load
+
+IMPORT_MAIN = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+
+async def seed(db_path, decoys, user):
+    """Schema, the bench user and its decoys, written before any server starts"""
+    await load.seed(db_path, user)
+    from dbpool import pool
+    from db import write_decoys
+
+    rows = [(f"decoy{i}@decoys.example", user, "startup") for i in range(decoys)]
+    for start in range(0, len(rows), 20000):
+        await write_decoys(rows[start:start + 20000])
+    await pool.close()
+
+def import_seconds(env) -> float:
+    result = subprocess.run([sys.executable, "-c", IMPORT_MAIN], cwd=load.REPO_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.split()[-1])
+
+def webhook(upstream_url, recipient, message_id):
+    return {
+        "recipient": recipient,
+        "sender": "attacker@example.net",
+        "subject": "Invoice overdue",
+        "body-plain": "Please find the outstanding invoice attached.",
+        "X-Mailgun-Incoming-IP": "198.51.100.7",
+        "Message-Id": message_id,
+        "message-url": f"{upstream_url}/v3/messages/{message_id}",
+    }
+
+async def cold_start(env, port, upstream_url, db_path, recipient, label, timeout) -> dict:
+    """Launch the server once and time its first accepted and first stored hit"""
+    import httpx
+
+    conn = sqlite3.connect(db_path)
+    (last_event,) = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()
+    server_log = open(os.path.join(os.path.dirname(db_path), "server.log"), "ab")
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=load.REPO_DIR, env=env, stdout=server_log, stderr=subprocess.STDOUT)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=httpx.Timeout(timeout)) as client:
+            attempts = 0
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError(f"server exited with status {server.returncode}")
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError(f"no webhook accepted within {timeout}s")
+                attempts += 1
+                try:
+                    response = await client.post("/webhook/inbound",
+                                                 data=webhook(upstream_url, recipient, f"<{label}-{attempts}@bench>"))
+                    if response.status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.005)
+            first_ok = time.perf_counter() - started
+            while conn.execute("SELECT 1 FROM events WHERE id > ?", (last_event,)).fetchone() is None:
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError(f"the first hit was not stored within {timeout}s")
+                await asyncio.sleep(0.005)
+            first_event = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+        server_log.close()
+        conn.close()
+    return {"first_ok": first_ok, "first_event": first_event, "attempts": attempts}
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="honeypot-startup-")
+    db_path = os.path.join(workdir, "startup.db")
+    load.log(f"seeding {args.decoys} decoys")
+    await seed(db_path, args.decoys, "startup@example.com")
+
+    upstream_port, app_port = load.free_port(), load.free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    env = dict(os.environ,
+               DATABASE_PATH=db_path,
+               BLOB_DIR=os.path.join(workdir, "blobs"),
+               EXPORT_DIR=os.path.join(workdir, "exports"),
+               IPAPI_BASE_URL=upstream_url,
+               SENDGRID_BASE_URL=upstream_url,
+               SENDGRID_API_KEY="startup",
+               MAILGUN_API_KEY="startup",
+               LOG_LEVEL="WARNING")
+    env.pop("GEO_DB_PATH", None)
+    env.pop("WEB_CONCURRENCY", None)
+    env.update(args.env)
+
+    rng = random.Random(args.seed)
+    results = {"import_main": statistics.median(import_seconds(env) for _ in range(args.runs)), "warmups": {}}
+    upstreams = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "fake_upstreams.py"), "--port", str(upstream_port),
+         "--seed", str(args.seed), *fake_upstreams.argv_for(args)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    try:
+        import httpx
+        async with httpx.AsyncClient(base_url=upstream_url) as upstream_client:
+            await load.wait_until_up(upstream_client, "/_stats", upstreams)
+        for warmup in args.warmups.split(","):
+            load.log(f"DECOY_CACHE_WARMUP={warmup}: {args.runs} cold starts")
+            runs = [await cold_start(dict(env, DECOY_CACHE_WARMUP=warmup), app_port, upstream_url, db_path,
+                                     f"decoy{rng.randrange(args.decoys)}@decoys.example", f"{warmup}-{n}",
+                                     args.timeout)
+                    for n in range(args.runs)]
+            results["warmups"][warmup] = {
+                "first_ok": statistics.median(r["first_ok"] for r in runs),
+                "first_event": statistics.median(r["first_event"] for r in runs),
+                "runs": runs,
+            }
+    finally:
+        upstreams.terminate()
+        upstreams.wait()
+    return results
+
+def report(results):
+    print(f"import main   {results['import_main'] * 1000:8.0f} ms")
+    print(f"{'warm-up':<12}{'first 200 ms':>14}{'first event ms':>16}")
+    for warmup, result in results["warmups"].items():
+        print(f"{warmup:<12}{result['first_ok'] * 1000:>14.0f}{result['first_event'] * 1000:>16.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--decoys", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warmups", default="startup,background,off", help="DECOY_CACHE_WARMUP modes to compare")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--env", type=load.env_pair, action="append", default=[], help="server setting NAME=VALUE")
+    parser.add_argument("--output", help="result file (default bench/results/<commit>-startup.json)")
+    fake_upstreams.add_arguments(parser)
+    args = parser.parse_args()
+    args.env = dict(args.env)
+
+    results = asyncio.run(run(args))
+    report(results)
+    output = args.output or os.path.join(BENCH_DIR, "results", f"{load.git_commit() or 'local'}-startup.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"commit": load.git_commit(), "settings": {"decoys": args.decoys, "runs": args.runs,
+                                                             "env": args.env}, "results": results}, f, indent=2)
+    print(f"results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""/api/stats breakdowns from the rollups vs GROUP BY over events.
+
+    python bench/stats_rollups.py --events 1000000 --days 365
+
+Fills one tenant with --events hits spread over --days. Senders, IPs and
+decoys follow a Zipf-like distribution. The rollups are built with the
+same backfill init_db runs on an existing database. For ranges from a day
+to the whole period, the bench times the rollup queries behind
+/api/stats against the GROUP BY queries the dashboard would otherwise
+need. It then streams the events through a TopK sketch and reports how
+many of the exact top 10 senders the sketch found, and the largest error
+in their counts.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+TENANT = "tenant@example.com"
+
+GROUP_BY_QUERIES = {
+    "trend": "SELECT substr(created_at, 1, 10), COUNT(*) FROM events "
+             "WHERE customer_email = ? AND created_at >= ? AND created_at < ? GROUP BY 1",
+    "senders": "SELECT sender_email, COUNT(*) FROM events "
+               "WHERE customer_email = ? AND created_at >= ? AND created_at < ? GROUP BY 1 ORDER BY 2 DESC LIMIT 10",
+    "ips": "SELECT sender_ip, COUNT(*) FROM events "
+           "WHERE customer_email = ? AND created_at >= ? AND created_at < ? GROUP BY 1 ORDER BY 2 DESC LIMIT 10",
+    "decoys": "SELECT decoy_email, COUNT(*) FROM events "
+              "WHERE customer_email = ? AND created_at >= ? AND created_at < ? GROUP BY 1 ORDER BY 2 DESC LIMIT 10",
+}
+
+def zipf_choice(rng, n, s=1.2):
+    weights = [1 / (k + 1) ** s for k in range(n)]
+    return lambda: rng.choices(range(n), weights=weights, k=1)[0]
+
+def populate(path, events, days, rng):
+    start = datetime.utcnow() - timedelta(days=days)
+    sender, ip, decoy = zipf_choice(rng, 20000), zipf_choice(rng, 5000), zipf_choice(rng, 500)
+    step = days * 86400 / events
+    rows = [(f"d{decoy()}@decoys.example", TENANT, f"s{sender()}@spam.example", f"203.0.{(n := ip()) // 256}.{n % 256}",
+             "bench", "Paris, France", (start + timedelta(seconds=i * step)).isoformat()) for i in range(events)]
+    conn = sqlite3.connect(path)
+    conn.executemany("""
+        INSERT INTO events (decoy_email, customer_email, sender_email, sender_ip, subject, geo, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    conn.commit()
+    conn.close()
+    return rows
+
+def timed(conn, query, params, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(query, params).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+async def build(events, days, rng):
+    from dbpool import pool
+    from db import init_db, backfill_event_rollups
+
+    await init_db()
+    await pool.close()
+    print(f"Populating {events} events over {days} days...")
+    rows = populate(pool.path, events, days, rng)
+    start = time.perf_counter()
+    await pool.open()
+    async with pool.writer() as db:
+        await backfill_event_rollups(db)
+    await pool.close()
+    print(f"rollup backfill: {time.perf_counter() - start:.1f}s")
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "stats.db"))
+    rng = random.Random(3)
+    rows = asyncio.run(build(args.events, args.days, rng))
+
+    from config import config
+    from api.stats import TREND_QUERY, TOP_QUERY, periods
+    from rollups import TopK
+
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    now = datetime.utcnow()
+    print(f"{'range':>8}{'GROUP BY ms':>14}{'rollups ms':>12}")
+    for span in (1, 7, 30, args.days):
+        since, until = now - timedelta(days=span), now
+        group_by = sum(timed(conn, query, (TENANT, since.isoformat(), until.isoformat()))
+                       for query in GROUP_BY_QUERIES.values())
+        rollups = (timed(conn, TREND_QUERY, (TENANT, "day", since.date().isoformat(), until.date().isoformat()))
+                   + timed(conn, TOP_QUERY, (TENANT, json.dumps(periods(since.date(), until.date())))))
+        print(f"{f'{span}d':>8}{group_by:>14.1f}{rollups:>12.2f}")
+    conn.close()
+
+    exact = Counter(row[2] for row in rows)
+    sketch = TopK(config.STATS_TOP_K_TRACKED, config.STATS_SKETCH_WIDTH, config.STATS_SKETCH_DEPTH)
+    for row in rows:
+        sketch.add(row[2])
+    true_top = [value for value, _ in exact.most_common(10)]
+    found = sorted(sketch.top.items(), key=lambda item: -item[1])[:10]
+    recall = len(set(true_top) & {value for value, _ in found})
+    error = max(abs(sketch.top.get(value, 0) - exact[value]) / exact[value] for value in true_top)
+    print(f"sketch top 10 senders: {recall}/10 found, worst count error {error:.2%} "
+          f"({config.STATS_SKETCH_WIDTH}x{config.STATS_SKETCH_DEPTH} counters)")
+
+if __name__ == "__main__":
+    main()
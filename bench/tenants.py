@@ -0,0 +1,122 @@
+"""Dashboard latency across many tenants with a skewed event distribution.
+
+    python bench/tenants.py --tenants 1000 --events 500000
+
+Tenant k gets a Zipf-like share of decoys and events, so a few tenants own
+most of the data. Requests go to uniformly chosen tenants and to the
+largest tenant separately; p50/p99 latency is reported per endpoint.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+def zipf_weights(n, s=1.1):
+    weights = [1 / (k + 1) ** s for k in range(n)]
+    total = sum(weights)
+    return [w / total for w in weights]
+
+def populate(path, tenants, decoys, events, rng):
+    weights = zipf_weights(tenants)
+    start = datetime(2025, 1, 1)
+    conn = sqlite3.connect(path)
+    decoy_rows, owners = [], []
+    for t, weight in enumerate(weights):
+        for i in range(max(1, int(decoys * weight))):
+            decoy = f"d{i}.t{t}@decoys.example"
+            decoy_rows.append((decoy, f"tenant{t}@example.com", f"uc{i % 5}",
+                               (start + timedelta(minutes=len(decoy_rows))).isoformat()))
+            owners.append((decoy, f"tenant{t}@example.com", t))
+    conn.executemany("INSERT INTO decoys VALUES (?, ?, ?, ?)", decoy_rows)
+
+    by_tenant = {}
+    for decoy, customer, t in owners:
+        by_tenant.setdefault(t, []).append((decoy, customer))
+    chosen = rng.choices(range(tenants), weights=weights, k=events)
+    conn.executemany("""
+        INSERT INTO events (decoy_email, customer_email, sender_email, sender_ip, subject, geo, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, ((*rng.choice(by_tenant[t]), f"s{rng.randrange(500)}@spam.example",
+           f"203.0.{rng.randrange(256)}.{rng.randrange(256)}", "bench", "Nowhere",
+           (start + timedelta(seconds=n * 30)).isoformat()) for n, t in enumerate(chosen)))
+    conn.execute("""
+        INSERT INTO decoy_stats (decoy_email, alerts, last_event_at)
+        SELECT decoy_email, COUNT(*), MAX(created_at) FROM events GROUP BY decoy_email
+    """)
+    conn.execute("""
+        INSERT INTO customer_stats (customer_email, decoys, alerts)
+        SELECT d.customer_email, COUNT(*), COALESCE(SUM(s.alerts), 0)
+        FROM decoys d LEFT JOIN decoy_stats s ON s.decoy_email = d.decoy_email
+        GROUP BY d.customer_email
+    """)
+    conn.commit()
+    conn.close()
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (statistics.median(samples) * 1000, samples[int(len(samples) * 0.99) - 1] * 1000)
+
+async def measure(client, url, tokens, requests, concurrency):
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def worker():
+        for i in remaining:
+            token = tokens[i % len(tokens)]
+            start = time.perf_counter()
+            response = await client.get(url, headers={"Authorization": f"Bearer {token}"})
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return percentiles(latencies)
+
+async def main(args):
+    import httpx
+    from auth import create_access_token
+    from dbpool import pool
+    from db import init_db
+
+    rng = random.Random(42)
+    await init_db()
+    await pool.close()
+    print(f"Populating {args.tenants} tenants, {args.decoys} decoys, {args.events} events...")
+    populate(pool.path, args.tenants, args.decoys, args.events, rng)
+
+    import main as app_module
+    app = app_module.app
+    await app.router.startup()
+    try:
+        uniform = [create_access_token({"sub": f"tenant{rng.randrange(args.tenants)}@example.com"})
+                   for _ in range(200)]
+        largest = [create_access_token({"sub": "tenant0@example.com"})]
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            print(f"{'endpoint':<16}{'tenants':<10}{'p50 ms':>10}{'p99 ms':>10}")
+            for url in ("/api/decoys", "/api/events", "/api/stats"):
+                for label, tokens in (("uniform", uniform), ("largest", largest)):
+                    p50, p99 = await measure(client, url, tokens, args.requests, args.concurrency)
+                    print(f"{url:<16}{label:<10}{p50:>10.2f}{p99:>10.2f}")
+    finally:
+        await app.router.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tenants", type=int, default=1000)
+    parser.add_argument("--decoys", type=int, default=100000)
+    parser.add_argument("--events", type=int, default=500000)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "tenants.db"))
+    os.environ["JOB_WORKERS"] = "0"
+    asyncio.run(main(args))
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import zlib
+from datetime import datetime, timedelta
+from config import config
+from dbpool import pool
+from retention import archive_table
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_BYTES = 64 * 1024
+
+class BlobStore:
+    """Content-addressed, zlib-compressed store for raw .eml payloads.
+
+    Blobs live at <root>/<aa>/<bb>/<sha256>.z with a row in the blobs table.
+    put() writes each distinct payload once. The refcount is raised by the
+    event writer in the same transaction that inserts the referencing event,
+    and sweep() removes unreferenced blobs.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._task = None
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.z")
+
+    def _hash_file(self, f) -> tuple:
+        digest = hashlib.sha256()
+        size = 0
+        f.seek(0)
+        while chunk := f.read(READ_CHUNK_BYTES):
+            digest.update(chunk)
+            size += len(chunk)
+        return digest.hexdigest(), size
+
+    def _write_file(self, f, path: str) -> int:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressor = zlib.compressobj(config.BLOB_COMPRESSION_LEVEL)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                f.seek(0)
+                while chunk := f.read(READ_CHUNK_BYTES):
+                    out.write(compressor.compress(chunk))
+                out.write(compressor.flush())
+                stored_size = out.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return stored_size
+
+    async def put(self, f) -> str:
+        """Store the contents of an open binary file and return its sha256"""
+        digest, size = await asyncio.to_thread(self._hash_file, f)
+        path = self.path_for(digest)
+        if not os.path.exists(path):
+            stored_size = await asyncio.to_thread(self._write_file, f, path)
+        else:
+            stored_size = os.path.getsize(path)
+        f.seek(0)
+
+        now = datetime.utcnow().isoformat()
+        async with pool.writer() as db:
+            await db.execute("""
+                INSERT INTO blobs (hash, size, stored_size, refcount, created_at, last_ref_at)
+                VALUES (?, ?, ?, 0, ?, ?)
+                ON CONFLICT (hash) DO UPDATE SET last_ref_at = excluded.last_ref_at
+            """, (digest, size, stored_size, now, now))
+            # sweep() unlinks under the writer too, so a file it removed after the
+            # check above is gone by now; the fresh last_ref_at keeps it from the next one
+            if not os.path.exists(path):
+                await asyncio.to_thread(self._write_file, f, path)
+        f.seek(0)
+        return digest
+
+    async def iter_blob(self, digest: str):
+        """Yield the decompressed payload in chunks"""
+        decompressor = zlib.decompressobj()
+        with open(self.path_for(digest), "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+
+    async def _release(self, db, table: str, released):
+        """Drop the .eml references of (event id, hash) rows of an events table"""
+        await db.executemany(
+            f"UPDATE {table} SET eml_hash = NULL WHERE id = ?",
+            [(event_id,) for event_id, _ in released]
+        )
+        await db.executemany(
+            "UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?",
+            [(digest,) for _, digest in released]
+        )
+
+    async def sweep(self) -> dict:
+        """Drop payload references past retention, then delete unreferenced blobs"""
+        now = datetime.utcnow()
+        cutoff = (now - timedelta(days=config.BLOB_RETENTION_DAYS)).isoformat()
+        grace_cutoff = (now - timedelta(seconds=config.BLOB_GC_GRACE_SECONDS)).isoformat()
+        expired = 0
+        while True:
+            async with pool.writer() as db:
+                async with db.execute("""
+                    SELECT id, eml_hash FROM events
+                    WHERE eml_hash IS NOT NULL AND created_at < ?
+                    LIMIT ?
+                """, (cutoff, config.BLOB_GC_BATCH_SIZE)) as cursor:
+                    released = await cursor.fetchall()
+                await self._release(db, "events", released)
+            expired += len(released)
+            if len(released) < config.BLOB_GC_BATCH_SIZE:
+                break
+
+        # Archived months have no created_at index of their own; walk them by id
+        async with pool.reader() as db:
+            async with db.execute("SELECT month FROM event_archives WHERE min_created_at < ?", (cutoff,)) as cursor:
+                tables = [archive_table(month) for (month,) in await cursor.fetchall()]
+        for table in tables:
+            after = 0
+            while True:
+                async with pool.writer() as db:
+                    async with db.execute(f"""
+                        SELECT id, eml_hash FROM {table}
+                        WHERE id > ? AND eml_hash IS NOT NULL AND created_at < ?
+                        ORDER BY id
+                        LIMIT ?
+                    """, (after, cutoff, config.BLOB_GC_BATCH_SIZE)) as cursor:
+                        released = await cursor.fetchall()
+                    await self._release(db, table, released)
+                expired += len(released)
+                if len(released) < config.BLOB_GC_BATCH_SIZE:
+                    break
+                after = released[-1][0]
+
+        # Blobs that never got an event (e.g. a failed job) are kept for a grace
+        # period so a put() racing with its event insert is not collected. Files
+        # are unlinked before the writer is released, so a put() of the same
+        # payload either refreshes last_ref_at first or finds the file gone.
+        async with pool.writer() as db:
+            async with db.execute("""
+                DELETE FROM blobs WHERE refcount <= 0 AND last_ref_at < ?
+                RETURNING hash
+            """, (grace_cutoff,)) as cursor:
+                deleted = [row[0] for row in await cursor.fetchall()]
+            for digest in deleted:
+                try:
+                    os.unlink(self.path_for(digest))
+                except FileNotFoundError:
+                    pass
+        return {"expired_references": expired, "deleted_blobs": len(deleted)}
+
+    async def _run_sweeps(self):
+        while True:
+            await asyncio.sleep(config.BLOB_GC_INTERVAL_SECONDS)
+            try:
+                result = await self.sweep()
+                logger.info("Blob sweep finished", extra=result)
+            except Exception:
+                logger.exception("Blob sweep failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_sweeps())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+blob_store = BlobStore(config.BLOB_DIR)
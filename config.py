@@ -3,6 +3,11 @@ from typing import Optional
 
 class Config:
     DATABASE_PATH: str = os.getenv("DATABASE_PATH", "./decoys.db")
+    DB_READERS: int = int(os.getenv("DB_READERS", "4"))
+    DB_CACHE_SIZE_KB: int = int(os.getenv("DB_CACHE_SIZE_KB", "20000"))
+    DB_MMAP_SIZE: int = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+    DB_CACHED_STATEMENTS: int = int(os.getenv("DB_CACHED_STATEMENTS", "256"))
+    DB_BUSY_TIMEOUT_MS: int = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
     SENDGRID_API_KEY: Optional[str] = os.getenv("SENDGRID_API_KEY")
     MAILGUN_API_KEY: Optional[str] = os.getenv("MAILGUN_API_KEY")
     ALERT_SENDER: str = os.getenv("ALERT_SENDER", "canary@honeypotalerts.com")
@@ -10,5 +15,80 @@ class Config:
     JWT_SECRET_KEY: str = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
     JWT_ALGORITHM: str = "HS256"
     JWT_EXPIRATION_HOURS: int = 24
+    AUTH_TOKEN_CACHE_SIZE: int = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+    AUTH_ALLOWLIST_REFRESH_SECONDS: float = float(os.getenv("AUTH_ALLOWLIST_REFRESH_SECONDS", "60"))
+    OTP_PURGE_INTERVAL_SECONDS: float = float(os.getenv("OTP_PURGE_INTERVAL_SECONDS", "3600"))
+    IPAPI_BASE_URL: str = os.getenv("IPAPI_BASE_URL", "https://ipapi.co")
+    SENDGRID_BASE_URL: str = os.getenv("SENDGRID_BASE_URL", "https://api.sendgrid.com")
+    UPSTREAM_TIMEOUT_SECONDS: float = float(os.getenv("UPSTREAM_TIMEOUT_SECONDS", "10"))
+    UPSTREAM_MAX_CONNECTIONS: int = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "20"))
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "4"))
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+    JOB_BACKOFF_SECONDS: float = float(os.getenv("JOB_BACKOFF_SECONDS", "2"))
+    JOB_POLL_INTERVAL_SECONDS: float = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1"))
+    EVENT_BATCH_SIZE: int = int(os.getenv("EVENT_BATCH_SIZE", "256"))
+    EVENT_FLUSH_MS: float = float(os.getenv("EVENT_FLUSH_MS", "5"))
+    DECOY_CACHE_MAX_ENTRIES: int = int(os.getenv("DECOY_CACHE_MAX_ENTRIES", "1000000"))
+    DECOY_CACHE_TTL_SECONDS: float = float(os.getenv("DECOY_CACHE_TTL_SECONDS", "300"))
+    DECOY_CACHE_GENERATION_CHECK_SECONDS: float = float(os.getenv("DECOY_CACHE_GENERATION_CHECK_SECONDS", "5"))
+    GEO_DB_PATH: Optional[str] = os.getenv("GEO_DB_PATH")
+    GEO_CACHE_SIZE: int = int(os.getenv("GEO_CACHE_SIZE", "10000"))
+    GEO_CACHE_TTL_SECONDS: float = float(os.getenv("GEO_CACHE_TTL_SECONDS", "86400"))
+    GEO_FAILURE_TTL_SECONDS: float = float(os.getenv("GEO_FAILURE_TTL_SECONDS", "60"))
+    # Attached as base64, which adds a third, so 20 MiB keeps the alert under SendGrid's 30 MB message limit
+    EML_MAX_BYTES: int = int(os.getenv("EML_MAX_BYTES", str(20 * 1024 * 1024)))
+    EML_SPOOL_THRESHOLD_BYTES: int = int(os.getenv("EML_SPOOL_THRESHOLD_BYTES", str(1024 * 1024)))
+    BLOB_DIR: str = os.getenv("BLOB_DIR", "./blobs")
+    BLOB_COMPRESSION_LEVEL: int = int(os.getenv("BLOB_COMPRESSION_LEVEL", "6"))
+    BLOB_RETENTION_DAYS: int = int(os.getenv("BLOB_RETENTION_DAYS", "90"))
+    BLOB_GC_INTERVAL_SECONDS: float = float(os.getenv("BLOB_GC_INTERVAL_SECONDS", "3600"))
+    BLOB_GC_GRACE_SECONDS: float = float(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))
+    BLOB_GC_BATCH_SIZE: int = int(os.getenv("BLOB_GC_BATCH_SIZE", "500"))
+    ALERT_DIGEST_WINDOW_SECONDS: float = float(os.getenv("ALERT_DIGEST_WINDOW_SECONDS", "30"))
+    ALERT_POLL_INTERVAL_SECONDS: float = float(os.getenv("ALERT_POLL_INTERVAL_SECONDS", "1"))
+    ALERT_RATE_PER_SECOND: float = float(os.getenv("ALERT_RATE_PER_SECOND", "5"))
+    ALERT_RATE_BURST: int = int(os.getenv("ALERT_RATE_BURST", "10"))
+    ALERT_MAX_ATTEMPTS: int = int(os.getenv("ALERT_MAX_ATTEMPTS", "8"))
+    ALERT_BACKOFF_SECONDS: float = float(os.getenv("ALERT_BACKOFF_SECONDS", "5"))
+    PAGE_SIZE_DEFAULT: int = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+    PAGE_SIZE_MAX: int = int(os.getenv("PAGE_SIZE_MAX", "500"))
+    PUBSUB_QUEUE_SIZE: int = int(os.getenv("PUBSUB_QUEUE_SIZE", "100"))
+    PUBSUB_SLOW_CONSUMER_POLICY: str = os.getenv("PUBSUB_SLOW_CONSUMER_POLICY", "drop_oldest")
+    SSE_HEARTBEAT_SECONDS: float = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+    SSE_REPLAY_LIMIT: int = int(os.getenv("SSE_REPLAY_LIMIT", "1000"))
+    EXPORT_CHUNK_ROWS: int = int(os.getenv("EXPORT_CHUNK_ROWS", "2000"))
+    EXPORT_DIR: str = os.getenv("EXPORT_DIR", "./exports")
+    EXPORT_TTL_SECONDS: int = int(os.getenv("EXPORT_TTL_SECONDS", "86400"))
+    EXPORT_DISK_QUOTA_BYTES: int = int(os.getenv("EXPORT_DISK_QUOTA_BYTES", str(5 * 1024 * 1024 * 1024)))
+    EXPORT_SWEEP_INTERVAL_SECONDS: float = float(os.getenv("EXPORT_SWEEP_INTERVAL_SECONDS", "300"))
+    PROVISION_BATCH_SIZE: int = int(os.getenv("PROVISION_BATCH_SIZE", "20000"))
+    PROVISION_MAX_ERRORS: int = int(os.getenv("PROVISION_MAX_ERRORS", "1000"))
+    METRICS_LOOP_LAG_INTERVAL_SECONDS: float = float(os.getenv("METRICS_LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_SAMPLE_RATE: float = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+    LOG_REDACT: bool = os.getenv("LOG_REDACT", "true").lower() not in ("0", "false", "no")
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    INGEST_DEDUP_WINDOW_SECONDS: float = float(os.getenv("INGEST_DEDUP_WINDOW_SECONDS", str(8 * 3600)))
+    INGEST_SEEN_MAX_ENTRIES: int = int(os.getenv("INGEST_SEEN_MAX_ENTRIES", "200000"))
+    INGEST_BLOOM_CAPACITY: int = int(os.getenv("INGEST_BLOOM_CAPACITY", "1000000"))
+    INGEST_BLOOM_ERROR_RATE: float = float(os.getenv("INGEST_BLOOM_ERROR_RATE", "0.001"))
+    STATS_TOP_K_TRACKED: int = int(os.getenv("STATS_TOP_K_TRACKED", "50"))
+    STATS_SKETCH_WIDTH: int = int(os.getenv("STATS_SKETCH_WIDTH", "256"))
+    STATS_SKETCH_DEPTH: int = int(os.getenv("STATS_SKETCH_DEPTH", "4"))
+    STATS_CHECKPOINT_SECONDS: float = float(os.getenv("STATS_CHECKPOINT_SECONDS", "30"))
+    STATS_DEFAULT_RANGE_DAYS: int = int(os.getenv("STATS_DEFAULT_RANGE_DAYS", "30"))
+    STATS_MAX_HOURLY_RANGE_DAYS: int = int(os.getenv("STATS_MAX_HOURLY_RANGE_DAYS", "31"))
+    WRITER_LOCK_PATH: Optional[str] = os.getenv("WRITER_LOCK_PATH")
+    WRITER_SOCKET_PATH: Optional[str] = os.getenv("WRITER_SOCKET_PATH")
+    WRITER_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("WRITER_CONNECT_TIMEOUT_SECONDS", "60"))
+    EVENTS_HOT_DAYS: int = int(os.getenv("EVENTS_HOT_DAYS", "90"))
+    EVENTS_HOT_DAYS_BY_TENANT: str = os.getenv("EVENTS_HOT_DAYS_BY_TENANT", "")
+    EVENTS_ARCHIVE_RETENTION_MONTHS: int = int(os.getenv("EVENTS_ARCHIVE_RETENTION_MONTHS", "0"))
+    EVENTS_ARCHIVE_BATCH_SIZE: int = int(os.getenv("EVENTS_ARCHIVE_BATCH_SIZE", "200"))
+    EVENTS_ARCHIVE_PAUSE_SECONDS: float = float(os.getenv("EVENTS_ARCHIVE_PAUSE_SECONDS", "0.05"))
+    EVENTS_ARCHIVE_INTERVAL_SECONDS: float = float(os.getenv("EVENTS_ARCHIVE_INTERVAL_SECONDS", "3600"))
+    DECOY_CACHE_WARMUP: str = os.getenv("DECOY_CACHE_WARMUP", "background").lower()
+    OPS_TOKEN: Optional[str] = os.getenv("OPS_TOKEN")
+    STREAM_TICKET_TTL_SECONDS: int = int(os.getenv("STREAM_TICKET_TTL_SECONDS", "30"))
 
 config = Config()
\ No newline at end of file
@@ -0,0 +1,245 @@
+import asyncio
+import fcntl
+import functools
+import itertools
+import json
+import logging
+import os
+import struct
+from config import config
+from logs import correlation_id
+from pubsub import event_bus
+
+logger = logging.getLogger(__name__)
+
+WRITER, WORKER = "writer", "worker"
+
+# Functions marked @forwarded, by name
+OPERATIONS = {}
+
+_HEADER = struct.Struct("!I")
+
+# A worker this far behind on relayed hits misses the rest until it catches up;
+# its live feeds resume from the events table on reconnect
+_RELAY_BUFFER_LIMIT = 1024 * 1024
+
+class ForwardedWriteError(Exception):
+    """A forwarded write failed in the writer process"""
+
+def encode_frame(message) -> bytes:
+    data = json.dumps(message, separators=(",", ":")).encode()
+    return _HEADER.pack(len(data)) + data
+
+async def read_frame(reader):
+    (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return json.loads(await reader.readexactly(size))
+
+def forwarded(func):
+    """Run func in the writer process when it is called in a worker.
+
+    Arguments and the result cross a socket as JSON, so tuples arrive as lists.
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+    OPERATIONS[name] = func
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if coordinator.role == WORKER:
+            return await coordinator.call(name, args, kwargs)
+        return await func(*args, **kwargs)
+    return wrapper
+
+class WriterCoordinator:
+    """Lets several server processes share the SQLite database with a single writer.
+
+    At startup each process tries to lock lock_path. The one that gets it is
+    the writer: it creates the schema, runs the event writer, job workers,
+    alert dispatcher and sweepers, and answers forwarded writes on a Unix
+    socket at socket_path. The rest are workers: they serve HTTP, read
+    straight from the WAL database and send @forwarded calls to the writer,
+    which also relays every published hit back to them for their live
+    feeds. A lone process is always the writer, so running one process
+    works as before. If the writer dies, the lock is released and the next
+    process to start takes over.
+    """
+
+    def __init__(self, lock_path: str, socket_path: str, connect_timeout: float):
+        self.lock_path = lock_path
+        self.socket_path = socket_path
+        self.connect_timeout = connect_timeout
+        self.role = None
+        self._lock_fd = None
+        # Writer side
+        self._server = None
+        self._peers = set()
+        # Worker side
+        self._reader = None
+        self._writer = None
+        self._listener = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+        self.forwarded = 0
+        self.served = 0
+        self.relayed = 0
+        self.relay_skipped = 0
+
+    def claim(self) -> str:
+        """Become the writer if no other process is, otherwise a worker"""
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            self.role = WORKER
+        else:
+            self._lock_fd = fd
+            self.role = WRITER
+        return self.role
+
+    async def serve(self):
+        """Start answering forwarded writes (writer only)"""
+        # Holding the lock means any socket file left there belongs to a dead writer
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.socket_path)
+        event_bus.relay = self.relay
+        logger.info("Serving as the writer process", extra={"socket": self.socket_path})
+
+    async def _serve_peer(self, reader, writer):
+        self._peers.add(writer)
+        calls = set()
+        try:
+            while True:
+                try:
+                    message = await read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                call = asyncio.create_task(self._answer(writer, message))
+                calls.add(call)
+                call.add_done_callback(calls.discard)
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _answer(self, writer, message):
+        correlation_id.set(message.get("correlation_id"))
+        try:
+            result = await OPERATIONS[message["op"]](*message["args"], **message["kwargs"])
+        except Exception as e:
+            logger.warning("Forwarded write failed", extra={"op": message["op"], "error": str(e)})
+            reply = {"id": message["id"], "error": f"{type(e).__name__}: {e}"}
+        else:
+            reply = {"id": message["id"], "result": result}
+        self.served += 1
+        if not writer.is_closing():
+            writer.write(encode_frame(reply))
+
+    def relay(self, tenant: str, event: dict):
+        """Pass a hit published in the writer on to every worker"""
+        if not self._peers:
+            return
+        data = encode_frame({"publish": [tenant, event]})
+        for writer in self._peers:
+            if writer.is_closing() or writer.transport.get_write_buffer_size() > _RELAY_BUFFER_LIMIT:
+                self.relay_skipped += 1
+                continue
+            writer.write(data)
+            self.relayed += 1
+
+    async def connect(self):
+        """Connect to the writer, waiting up to connect_timeout for it to finish starting (worker only)"""
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.connect_timeout
+            while True:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(self.socket_path)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if loop.time() >= deadline:
+                        raise ConnectionError(f"No writer process is listening on {self.socket_path}")
+                    await asyncio.sleep(0.05)
+            self._reader, self._writer = reader, writer
+            self._listener = asyncio.create_task(self._listen(reader, writer))
+
+    async def _listen(self, reader, writer):
+        try:
+            while True:
+                message = await read_frame(reader)
+                if "publish" in message:
+                    event_bus.publish(*message["publish"])
+                    continue
+                future = self._pending.pop(message["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(ForwardedWriteError(message["error"]))
+                else:
+                    future.set_result(message["result"])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.warning("Lost the connection to the writer process")
+        finally:
+            writer.close()
+            if self._writer is writer:
+                self._reader = self._writer = None
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Lost the connection to the writer process"))
+
+    async def call(self, name: str, args, kwargs):
+        """Run a forwarded operation in the writer and return its result.
+
+        Not retried: the write may or may not have happened if the connection drops.
+        """
+        if self._writer is None:
+            await self.connect()
+        call_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[call_id] = future
+        self._writer.write(encode_frame({"id": call_id, "op": name, "args": args, "kwargs": kwargs,
+                                         "correlation_id": correlation_id.get()}))
+        self.forwarded += 1
+        try:
+            return await future
+        finally:
+            self._pending.pop(call_id, None)
+
+    async def stop(self):
+        if self._server is not None:
+            event_bus.relay = None
+            self._server.close()
+            for writer in list(self._peers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.role = None
+
+    def stats(self) -> dict:
+        return {
+            "role": self.role,
+            "pid": os.getpid(),
+            "workers_connected": len(self._peers),
+            "forwarded": self.forwarded,
+            "served": self.served,
+            "relayed": self.relayed,
+            "relay_skipped": self.relay_skipped,
+        }
+
+coordinator = WriterCoordinator(
+    config.WRITER_LOCK_PATH or config.DATABASE_PATH + ".writer.lock",
+    config.WRITER_SOCKET_PATH or config.DATABASE_PATH + ".writer.sock",
+    config.WRITER_CONNECT_TIMEOUT_SECONDS,
+)
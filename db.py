@@ -1,63 +1,610 @@
-import aiosqlite
-from datetime import datetime
+import json
+import logging
+from datetime import datetime, timedelta
 from config import config
+from coordinator import forwarded
+from dbpool import pool
+from event_writer import event_writer
+from decoy_cache import decoy_cache, normalise_email
+from geo import UNKNOWN_LOCATION
+from rollups import DIMENSIONS
+from retention import archive_tables
+from logs import correlation_id
 
-DB_PATH = config.DATABASE_PATH
+logger = logging.getLogger(__name__)
 
-async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+async def add_column(db, table, column, definition):
+    """Add a column to an existing table unless it is already there"""
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        columns = [row[1] for row in await cursor.fetchall()]
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
+async def table_exists(db, table):
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)) as cursor:
+        return await cursor.fetchone() is not None
+
+async def create_schema(db):
+    """Migration 1: the schema as it stood when migrations started being numbered.
+
+    Every statement checks before it changes anything, so this also brings a
+    database created by any earlier release up to date.
+    """
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS decoys (
+            decoy_email TEXT PRIMARY KEY,
+            customer_email TEXT,
+            use_case TEXT,
+            created_at TEXT
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            decoy_email TEXT,
+            sender_email TEXT,
+            sender_ip TEXT,
+            subject TEXT,
+            created_at TEXT,
+            FOREIGN KEY (decoy_email) REFERENCES decoys (decoy_email)
+        )
+    """)
+    # Location resolved at ingest so the dashboard never looks it up again
+    await add_column(db, "events", "geo", "TEXT")
+    await add_column(db, "events", "eml_hash", "TEXT")
+    # Mailgun message id + recipient digest; redeliveries of a hit share it
+    await add_column(db, "events", "message_key", "TEXT")
+    # Owning tenant, copied from the decoy so tenant queries never join decoys
+    if await add_column(db, "events", "customer_email", "TEXT"):
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS decoys (
-                decoy_email TEXT PRIMARY KEY,
-                customer_email TEXT,
-                use_case TEXT,
-                created_at TEXT
+            UPDATE events SET customer_email = (
+                SELECT customer_email FROM decoys WHERE decoys.decoy_email = events.decoy_email
             )
         """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            last_ref_at TEXT NOT NULL
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_email TEXT NOT NULL,
+            decoy_email TEXT NOT NULL,
+            event_id INTEGER,
+            sender TEXT,
+            ip TEXT,
+            geo TEXT,
+            subject TEXT,
+            body_preview TEXT,
+            eml_hash TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            delivered_at TEXT
+        )
+    """)
+    # Hit that raised the alert, so its log lines can be followed to delivery
+    await add_column(db, "alerts", "correlation_id", "TEXT")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_alerts_status_customer ON alerts (status, customer_email, next_attempt_at)
+    """)
+    # One alert per event, however many times its hit was processed
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_alerts_event_id ON alerts (event_id)")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_events_eml_created_at ON events (created_at) WHERE eml_hash IS NOT NULL
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_events_decoy_created_at ON events (decoy_email, created_at)")
+    await db.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_events_message_key ON events (message_key) WHERE message_key IS NOT NULL
+    """)
+    # Dashboard indexes lead with the tenant so one customer's queries never
+    # touch another's rows; the rowid (id) is the implicit last column
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_decoys_tenant_created_at ON decoys (customer_email, created_at, decoy_email)
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_decoys_tenant_use_case ON decoys (customer_email, use_case)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_events_tenant_created_at ON events (customer_email, created_at)")
+    # (customer_email, id) for resuming a live feed after a given event id
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_events_tenant_id ON events (customer_email)")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_events_tenant_decoy ON events (customer_email, decoy_email, created_at)
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_events_tenant_sender ON events (customer_email, sender_email, created_at)
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_events_tenant_ip ON events (customer_email, sender_ip, created_at)
+    """)
+
+    # Rollups kept in step with decoys/events so the dashboard never aggregates events
+    backfill_rollups = not await table_exists(db, "decoy_stats")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS decoy_stats (
+            decoy_email TEXT PRIMARY KEY,
+            alerts INTEGER NOT NULL DEFAULT 0,
+            last_event_at TEXT
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS customer_stats (
+            customer_email TEXT PRIMARY KEY,
+            decoys INTEGER NOT NULL DEFAULT 0,
+            alerts INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    if backfill_rollups:
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                decoy_email TEXT,
-                sender_email TEXT,
-                sender_ip TEXT,
-                subject TEXT,
-                created_at TEXT,
-                FOREIGN KEY (decoy_email) REFERENCES decoys (decoy_email)
-            )
+            INSERT INTO decoy_stats (decoy_email, alerts, last_event_at)
+            SELECT decoy_email, COUNT(*), MAX(created_at) FROM events GROUP BY decoy_email
         """)
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS authorized_users (
-                email TEXT PRIMARY KEY
-            )
+            INSERT INTO customer_stats (customer_email, decoys, alerts)
+            SELECT d.customer_email, COUNT(*), COALESCE(SUM(s.alerts), 0)
+            FROM decoys d LEFT JOIN decoy_stats s ON s.decoy_email = d.decoy_email
+            GROUP BY d.customer_email
         """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS otps (
-                email TEXT PRIMARY KEY,
-                code TEXT NOT NULL,
-                expires_at TEXT NOT NULL,
-                used BOOLEAN DEFAULT FALSE
-            )
+    # Hourly and daily hit counts and per-day and per-month heavy hitters for /api/stats
+    backfill_buckets = not await table_exists(db, "event_buckets")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS event_buckets (
+            customer_email TEXT NOT NULL,
+            granularity TEXT NOT NULL,
+            start TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (customer_email, granularity, start)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS heavy_hitters (
+            customer_email TEXT NOT NULL,
+            period TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            value TEXT NOT NULL,
+            hits INTEGER NOT NULL,
+            PRIMARY KEY (customer_email, period, dimension, value)
+        ) WITHOUT ROWID
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_sketches (
+            customer_email TEXT NOT NULL,
+            period TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            counts BLOB NOT NULL,
+            top TEXT NOT NULL,
+            PRIMARY KEY (customer_email, period, dimension)
+        ) WITHOUT ROWID
+    """)
+    if backfill_buckets:
+        await backfill_event_rollups(db)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS authorized_users (
+            email TEXT PRIMARY KEY
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS otps (
+            email TEXT PRIMARY KEY,
+            code TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            used BOOLEAN DEFAULT FALSE
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_otps_expires_at ON otps (expires_at)")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            run_after TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT
+        )
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after)
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS exports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_email TEXT NOT NULL,
+            crm TEXT NOT NULL,
+            use_case TEXT,
+            fingerprint TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            size INTEGER,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            finished_at TEXT,
+            last_access_at TEXT
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_exports_tenant_fingerprint ON exports (customer_email, fingerprint)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_exports_status_finished_at ON exports (status, finished_at)")
+    # Months of events moved out of the hot table by the retention compactor
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS event_archives (
+            month TEXT PRIMARY KEY,
+            rows INTEGER NOT NULL,
+            min_id INTEGER NOT NULL,
+            max_id INTEGER NOT NULL,
+            min_created_at TEXT NOT NULL,
+            max_created_at TEXT NOT NULL
+        )
+    """)
+
+async def normalise_decoy_emails(db):
+    """Migration 2: store decoy addresses trimmed and lowercased, as lookups expect.
+
+    Early releases stored addresses as given. Where several rows normalise to
+    the same address, the one already normalised (or else the newest) is kept
+    and the others are dropped; their hits and alert counts move to it.
+    """
+    await db.execute("""
+        CREATE TEMP TABLE decoy_renames AS
+        SELECT decoy_email AS old, new, customer_email, rank FROM (
+            SELECT decoy_email, customer_email, lower(trim(decoy_email)) AS new,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY lower(trim(decoy_email))
+                       ORDER BY decoy_email = lower(trim(decoy_email)) DESC, created_at DESC
+                   ) AS rank
+            FROM decoys
+        )
+        WHERE new IN (SELECT lower(trim(decoy_email)) FROM decoys WHERE decoy_email != lower(trim(decoy_email)))
+    """)
+    await db.execute("""
+        INSERT INTO decoy_stats (decoy_email, alerts, last_event_at)
+        SELECT r.new, SUM(s.alerts), MAX(s.last_event_at)
+        FROM decoy_renames r JOIN decoy_stats s ON s.decoy_email = r.old
+        WHERE r.old != r.new
+        GROUP BY r.new
+        ON CONFLICT (decoy_email) DO UPDATE SET
+            alerts = alerts + excluded.alerts,
+            last_event_at = NULLIF(MAX(COALESCE(last_event_at, ''), COALESCE(excluded.last_event_at, '')), '')
+    """)
+    await db.execute("DELETE FROM decoy_stats WHERE decoy_email IN (SELECT old FROM decoy_renames WHERE old != new)")
+    await db.execute("""
+        UPDATE customer_stats SET decoys = decoys - r.dropped
+        FROM (SELECT customer_email, COUNT(*) AS dropped FROM decoy_renames WHERE rank > 1 GROUP BY customer_email) r
+        WHERE customer_stats.customer_email = r.customer_email
+    """)
+    await db.execute("DELETE FROM decoys WHERE decoy_email IN (SELECT old FROM decoy_renames WHERE rank > 1)")
+    await db.execute("""
+        UPDATE decoys SET decoy_email = lower(trim(decoy_email))
+        WHERE decoy_email IN (SELECT old FROM decoy_renames WHERE old != new)
+    """)
+    # Hits keep the tenant they were recorded under, whichever row survived
+    for table in ["events", *await archive_tables(db)]:
+        await db.execute(f"""
+            UPDATE {table} SET decoy_email = lower(trim(decoy_email))
+            WHERE decoy_email IN (SELECT old FROM decoy_renames WHERE old != new)
         """)
-        await db.commit()
+    await db.execute("DROP TABLE decoy_renames")
+    await bump_decoys_generation(db)
+
+async def create_stream_tickets(db):
+    """Migration 3: single-use tickets that open the live event stream"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stream_tickets (
+            ticket_hash TEXT PRIMARY KEY,
+            email TEXT NOT NULL,
+            expires_at TEXT NOT NULL
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_stream_tickets_expires_at ON stream_tickets (expires_at)")
+
+# Schema changes in order; PRAGMA user_version is how many a database has had.
+# Add changes as new functions at the end, never by editing a released one.
+MIGRATIONS = [create_schema, normalise_decoy_emails, create_stream_tickets]
+
+async def init_db():
+    """Run the migrations the database has not had yet, each in its own transaction.
+
+    A database that is already current costs a single PRAGMA read.
+    """
+    async with pool.writer() as db:
+        async with db.execute("PRAGMA user_version") as cursor:
+            (version,) = await cursor.fetchone()
+        if version > len(MIGRATIONS):
+            logger.warning("Database schema is newer than this release", extra={"version": version})
+        for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+            await db.execute("BEGIN IMMEDIATE")
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {number}")
+            await db.commit()
+            logger.info("Applied schema migration", extra={"version": number, "migration": migration.__name__})
+
+async def backfill_event_rollups(db):
+    """Fill event_buckets and heavy_hitters from the events already stored"""
+    for granularity, length, suffix in (("hour", 13, ":00:00"), ("day", 10, "")):
+        await db.execute("""
+            INSERT INTO event_buckets (customer_email, granularity, start, hits)
+            SELECT customer_email, ?, substr(created_at, 1, ?) || ?, COUNT(*)
+            FROM events WHERE customer_email IS NOT NULL AND created_at IS NOT NULL
+            GROUP BY customer_email, substr(created_at, 1, ?)
+        """, (granularity, length, suffix, length))
+    for dimension, column in DIMENSIONS.items():
+        # Days (2025-01-31), then months (2025-01)
+        for length in (10, 7):
+            await db.execute(f"""
+                INSERT INTO heavy_hitters (customer_email, period, dimension, value, hits)
+                SELECT customer_email, period, ?, value, hits FROM (
+                    SELECT customer_email, substr(created_at, 1, ?) AS period, {column} AS value, COUNT(*) AS hits,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY customer_email, substr(created_at, 1, ?) ORDER BY COUNT(*) DESC
+                           ) AS rank
+                    FROM events
+                    WHERE customer_email IS NOT NULL AND created_at IS NOT NULL AND {column} IS NOT NULL
+                      AND {column} != ?
+                    GROUP BY customer_email, period, value
+                ) WHERE rank <= ?
+            """, (dimension, length, length, UNKNOWN_LOCATION, config.STATS_TOP_K_TRACKED))
 
 async def find_customer(decoy_email):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT customer_email, use_case FROM decoys WHERE decoy_email = ?", (decoy_email,)) as cursor:
-            return await cursor.fetchone()
+    return await decoy_cache.get(decoy_email)
+
+async def bump_decoys_generation(db):
+    """Tell decoy caches in every process that the decoys table changed"""
+    async with db.execute("""
+        INSERT INTO meta (key, value) VALUES ('decoys_generation', 1)
+        ON CONFLICT (key) DO UPDATE SET value = value + 1
+        RETURNING value
+    """) as cursor:
+        return (await cursor.fetchone())[0]
+
+async def upsert_decoys(db, rows, owner=None):
+    """Insert or update (decoy_email, customer_email, use_case) rows in one transaction.
+
+    Rows must already be normalised and unique by decoy_email. Rows that match
+    what is stored are left alone, so re-running a load changes nothing. With
+    an owner, decoys that belong to another customer are not touched and are
+    returned as conflicts instead. customer_stats and events.customer_email
+    follow any change of owner. Pass the result to forget_decoys() after commit.
+    """
+    async with db.execute("""
+        SELECT j.value, d.customer_email, d.use_case, COALESCE(s.alerts, 0)
+        FROM json_each(?) j
+        LEFT JOIN decoys d ON d.decoy_email = j.value
+        LEFT JOIN decoy_stats s ON s.decoy_email = j.value
+    """, (json.dumps([row[0] for row in rows]),)) as cursor:
+        existing = {decoy_email: (customer, use_case, alerts)
+                    for decoy_email, customer, use_case, alerts in await cursor.fetchall()}
+
+    now = datetime.utcnow().isoformat()
+    result = {"inserted": 0, "updated": 0, "unchanged": 0, "conflicts": []}
+    changes, moved, stats = [], [], {}
+    for decoy_email, customer_email, use_case in rows:
+        previous_customer, previous_use_case, alerts = existing[decoy_email]
+        if owner is not None and previous_customer not in (None, owner):
+            result["conflicts"].append(decoy_email)
+            continue
+        if previous_customer == customer_email and previous_use_case == use_case:
+            result["unchanged"] += 1
+            continue
+        changes.append((decoy_email, customer_email, use_case, now))
+        if previous_customer is None:
+            result["inserted"] += 1
+        else:
+            result["updated"] += 1
+        if previous_customer != customer_email:
+            for customer, sign in ((previous_customer, -1), (customer_email, 1)):
+                if customer is not None:
+                    decoys, alert_total = stats.get(customer, (0, 0))
+                    stats[customer] = (decoys + sign, alert_total + sign * alerts)
+            if previous_customer is not None:
+                moved.append((customer_email, decoy_email))
+
+    if not changes:
+        return result
+    await db.executemany("""
+        INSERT INTO decoys (decoy_email, customer_email, use_case, created_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (decoy_email) DO UPDATE SET
+            customer_email = excluded.customer_email, use_case = excluded.use_case, created_at = excluded.created_at
+    """, changes)
+    await db.executemany("""
+        INSERT INTO customer_stats (customer_email, decoys, alerts) VALUES (?, ?, ?)
+        ON CONFLICT (customer_email) DO UPDATE SET decoys = decoys + excluded.decoys, alerts = alerts + excluded.alerts
+    """, [(customer, decoys, alerts) for customer, (decoys, alerts) in stats.items()])
+    await db.executemany("UPDATE events SET customer_email = ? WHERE decoy_email = ?", moved)
+    if moved:
+        # Archived history moves with the decoy too; archives have no decoy index, so one pass per month
+        for table in await archive_tables(db):
+            await db.execute(f"""
+                UPDATE {table} SET customer_email = json_extract(m.value, '$[0]')
+                FROM json_each(?) m WHERE {table}.decoy_email = json_extract(m.value, '$[1]')
+            """, (json.dumps(moved),))
+    result["generation"] = await bump_decoys_generation(db)
+    result["changed"] = [change[0] for change in changes]
+    return result
+
+def forget_decoys(result):
+    """Drop changed decoys from this process's cache once upsert_decoys has committed"""
+    for decoy_email in result.pop("changed", []):
+        decoy_cache.invalidate(decoy_email)
+    if "generation" in result:
+        decoy_cache.note_generation(result.pop("generation"))
+
+@forwarded
+async def write_decoys(rows, owner=None):
+    """upsert_decoys() in a transaction of its own; returns the report without the cache fields"""
+    async with pool.writer() as db:
+        result = await upsert_decoys(db, rows, owner)
+    forget_decoys(result)
+    return result
 
 async def insert_decoy(decoy_email, customer_email, use_case):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            INSERT OR REPLACE INTO decoys (decoy_email, customer_email, use_case, created_at)
-            VALUES (?, ?, ?, ?)
-        """, (decoy_email, customer_email, use_case, datetime.utcnow().isoformat()))
-        await db.commit()
-
-async def log_event(recipient, sender, ip, subject):
-    print(f"LOG → {recipient} hit by {sender} from {ip} with subject '{subject}'")
-    async with aiosqlite.connect(DB_PATH) as db:
+    await write_decoys([(normalise_email(decoy_email), customer_email, use_case)])
+
+async def log_event(recipient, customer_email, sender, ip, subject, geo=None, eml_hash=None, created_at=None,
+                    message_key=None):
+    """Store a hit and return its event id.
+
+    Raises DuplicateEvent when an event with the same message_key is already stored.
+    """
+    logger.info("Logging decoy hit", extra={"decoy_email": recipient, "sender": sender, "ip": ip,
+                                            "subject": subject, "sampled": True})
+    # Group-committed with other hits; resolves with the event id once durable
+    return await event_writer.write(
+        (recipient, customer_email, message_key, sender, ip, subject, geo, eml_hash,
+         created_at or datetime.utcnow().isoformat())
+    )
+
+async def enqueue_job(kind, payload):
+    now = datetime.utcnow().isoformat()
+    async with pool.writer() as db:
+        cursor = await db.execute("""
+            INSERT INTO jobs (kind, payload, status, run_after, created_at, updated_at)
+            VALUES (?, ?, 'pending', ?, ?, ?)
+        """, (kind, json.dumps(payload), now, now, now))
+        return cursor.lastrowid
+
+async def claim_job():
+    """Atomically take the oldest due pending job, or return None"""
+    now = datetime.utcnow().isoformat()
+    async with pool.writer() as db:
+        async with db.execute("""
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE status = 'pending' AND run_after <= ?
+                ORDER BY run_after, id
+                LIMIT 1
+            )
+            RETURNING id, kind, payload, attempts
+        """, (now, now)) as cursor:
+            row = await cursor.fetchone()
+    if row is None:
+        return None
+    job_id, kind, payload, attempts = row
+    return job_id, kind, json.loads(payload), attempts
+
+async def complete_job(job_id):
+    async with pool.writer() as db:
+        await db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+async def fail_job(job_id, payload, attempts, error):
+    """Reschedule a failed job with exponential backoff, or dead-letter it"""
+    now = datetime.utcnow()
+    if attempts >= config.JOB_MAX_ATTEMPTS:
+        status, run_after = "dead", now
+    else:
+        delay = config.JOB_BACKOFF_SECONDS * (2 ** (attempts - 1))
+        status, run_after = "pending", now + timedelta(seconds=delay)
+    async with pool.writer() as db:
         await db.execute("""
-            INSERT INTO events (decoy_email, sender_email, sender_ip, subject, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (recipient, sender, ip, subject, datetime.utcnow().isoformat()))
-        await db.commit()
+            UPDATE jobs SET status = ?, payload = ?, last_error = ?, run_after = ?, updated_at = ?
+            WHERE id = ?
+        """, (status, json.dumps(payload), error, run_after.isoformat(), now.isoformat(), job_id))
+    return status
+
+async def requeue_running_jobs():
+    """Return jobs left running by a previous process to the queue"""
+    async with pool.writer() as db:
+        cursor = await db.execute("""
+            UPDATE jobs SET status = 'pending', updated_at = ? WHERE status = 'running'
+        """, (datetime.utcnow().isoformat(),))
+        return cursor.rowcount
+
+async def job_queue_stats():
+    async with pool.reader() as db:
+        async with db.execute("""
+            SELECT status, COUNT(*), MIN(created_at), MAX(attempts) FROM jobs GROUP BY status
+        """) as cursor:
+            return await cursor.fetchall()
+
+ALERT_COLUMNS = ("id", "customer_email", "decoy_email", "event_id", "sender", "ip", "geo",
+                 "subject", "body_preview", "eml_hash", "attempts", "created_at", "correlation_id")
+
+async def queue_alert(customer_email, decoy_email, event_id, sender, ip, geo, subject, body_text, eml_hash):
+    """Queue the alert for an event; returns its id, or None if the event already has one"""
+    now = datetime.utcnow().isoformat()
+    async with pool.writer() as db:
+        async with db.execute("""
+            INSERT INTO alerts (customer_email, decoy_email, event_id, sender, ip, geo, subject,
+                                body_preview, eml_hash, status, next_attempt_at, created_at, correlation_id)
+            SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?, ?
+            WHERE NOT EXISTS (SELECT 1 FROM alerts WHERE event_id = ?)
+            RETURNING id
+        """, (customer_email, decoy_email, event_id, sender, ip, geo, subject,
+              body_text[:5000] if body_text else None, eml_hash, now, now, correlation_id.get(),
+              event_id)) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+async def claim_alerts(window_seconds, max_customers):
+    """Mark due alerts as sending and return them as dicts.
+
+    A customer's alerts are due once the oldest pending one has waited
+    window_seconds, so everything that arrived in the window goes together.
+    """
+    now = datetime.utcnow()
+    cutoff = (now - timedelta(seconds=window_seconds)).isoformat()
+    async with pool.writer() as db:
+        async with db.execute(f"""
+            UPDATE alerts SET status = 'sending', attempts = attempts + 1
+            WHERE status = 'pending' AND next_attempt_at <= ? AND customer_email IN (
+                SELECT customer_email FROM alerts
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                GROUP BY customer_email
+                HAVING MIN(created_at) <= ?
+                LIMIT ?
+            )
+            RETURNING {", ".join(ALERT_COLUMNS)}
+        """, (now.isoformat(), now.isoformat(), cutoff, max_customers)) as cursor:
+            alerts = [dict(zip(ALERT_COLUMNS, row)) for row in await cursor.fetchall()]
+
+        hashes = list({alert["eml_hash"] for alert in alerts if alert["eml_hash"]})
+        sizes = {}
+        if hashes:
+            placeholders = ", ".join("?" for _ in hashes)
+            async with db.execute(f"SELECT hash, size FROM blobs WHERE hash IN ({placeholders})", hashes) as cursor:
+                sizes = dict(await cursor.fetchall())
+
+    for alert in alerts:
+        alert["eml_size"] = sizes.get(alert["eml_hash"])
+    alerts.sort(key=lambda alert: alert["id"])
+    return alerts
+
+async def finish_alerts(alert_ids, status, error=None, next_attempt_at=None):
+    """Record the outcome of a send: delivered, dead, or pending again for a retry"""
+    now = datetime.utcnow().isoformat()
+    delivered_at = now if status == "delivered" else None
+    next_attempt_at = next_attempt_at.isoformat() if next_attempt_at else now
+    async with pool.writer() as db:
+        await db.executemany("""
+            UPDATE alerts SET status = ?, last_error = ?, next_attempt_at = ?, delivered_at = ?
+            WHERE id = ?
+        """, [(status, error, next_attempt_at, delivered_at, alert_id) for alert_id in alert_ids])
+
+async def requeue_sending_alerts():
+    """Return alerts left mid-send by a previous process to the queue"""
+    async with pool.writer() as db:
+        cursor = await db.execute("UPDATE alerts SET status = 'pending' WHERE status = 'sending'")
+        return cursor.rowcount
+
+async def alert_queue_stats():
+    async with pool.reader() as db:
+        async with db.execute("""
+            SELECT status, COUNT(*), MIN(created_at) FROM alerts
+            WHERE status IN ('pending', 'sending', 'dead')
+            GROUP BY status
+        """) as cursor:
+            return await cursor.fetchall()
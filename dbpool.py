@@ -0,0 +1,113 @@
+import asyncio
+import time
+import aiosqlite
+from contextlib import asynccontextmanager
+from config import config
+from metrics import DB_WRITER_WAIT
+
+class ConnectionPool:
+    """Long-lived SQLite connections: one writer plus a small set of readers.
+
+    WAL journaling lets the readers keep serving dashboard queries while the
+    writer commits. Each connection keeps its own prepared-statement cache.
+    """
+
+    def __init__(self, path: str, readers: int):
+        self.path = path
+        self.size = readers
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = None
+        self._all_readers = []
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, read_only: bool) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=config.DB_CACHED_STATEMENTS)
+        await conn.execute(f"PRAGMA busy_timeout = {config.DB_BUSY_TIMEOUT_MS}")
+        await conn.execute("PRAGMA journal_mode = WAL")
+        await conn.execute("PRAGMA synchronous = NORMAL")
+        await conn.execute(f"PRAGMA cache_size = -{config.DB_CACHE_SIZE_KB}")
+        await conn.execute(f"PRAGMA mmap_size = {config.DB_MMAP_SIZE}")
+        await conn.execute("PRAGMA temp_store = MEMORY")
+        if read_only:
+            await conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    async def open(self):
+        async with self._open_lock:
+            if self.is_open:
+                return
+            # The writer goes first so WAL mode is set before any reader connects
+            self._writer = await self._connect(read_only=False)
+            self._readers = asyncio.Queue()
+            for _ in range(self.size):
+                conn = await self._connect(read_only=True)
+                self._all_readers.append(conn)
+                self._readers.put_nowait(conn)
+
+    async def close(self):
+        async with self._open_lock:
+            if not self.is_open:
+                return
+            async with self._write_lock:
+                await self._writer.close()
+                self._writer = None
+            for conn in self._all_readers:
+                await conn.close()
+            self._all_readers.clear()
+            self._readers = None
+
+    @asynccontextmanager
+    async def reader(self):
+        """Borrow a read-only connection"""
+        if not self.is_open:
+            await self.open()
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Hold the writer connection for one transaction, committed on success"""
+        if not self.is_open:
+            await self.open()
+        waited_from = time.perf_counter()
+        async with self._write_lock:
+            _writer_wait.observe(time.perf_counter() - waited_from)
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+    def stats(self) -> dict:
+        return {
+            "readers": self.size,
+            "readers_idle": self._readers.qsize() if self._readers else 0,
+            "writer_busy": self._write_lock.locked(),
+        }
+
+_writer_wait = DB_WRITER_WAIT.labels()
+
+pool = ConnectionPool(config.DATABASE_PATH, config.DB_READERS)
+
+def run_script(main):
+    """asyncio.run() for command-line scripts, closing the pool afterwards.
+
+    The pool opens on first use, and its connection threads keep the process
+    alive until it is closed.
+    """
+    async def run():
+        try:
+            return await main
+        finally:
+            await pool.close()
+    return asyncio.run(run())
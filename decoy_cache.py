@@ -0,0 +1,124 @@
+import time
+from collections import OrderedDict
+from config import config
+from dbpool import pool
+
+def normalise_email(address: str) -> str:
+    return (address or "").strip().lower()
+
+class DecoyCache:
+    """Bounded LRU of decoy address -> (customer_email, use_case), misses included.
+
+    Entries expire after ttl seconds. Every decoy upsert bumps a generation
+    counter in the meta table; the cache compares it at most every
+    generation_check_interval seconds and starts over when another process
+    has changed the decoys table.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, generation_check_interval: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation_check_interval = generation_check_interval
+        self.generation = None
+        self._next_generation_check = 0.0
+        self._entries = OrderedDict()
+        self._invalidations = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def load(self):
+        """Warm the cache with up to max_entries decoys"""
+        self.clear()
+        async with pool.reader() as db:
+            self.generation = await self._read_generation(db)
+            async with db.execute(
+                "SELECT decoy_email, customer_email, use_case FROM decoys LIMIT ?", (self.max_entries,)
+            ) as cursor:
+                async for decoy_email, customer_email, use_case in cursor:
+                    self._store(normalise_email(decoy_email), (customer_email, use_case))
+        self._next_generation_check = time.monotonic() + self.generation_check_interval
+        return len(self._entries)
+
+    async def get(self, decoy_email: str):
+        key = normalise_email(decoy_email)
+        await self._check_generation()
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(key)
+            if entry[0] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        invalidations = self._invalidations
+        async with pool.reader() as db:
+            async with db.execute(
+                "SELECT customer_email, use_case FROM decoys WHERE decoy_email = ?", (key,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        value = tuple(row) if row else None
+        # A write that committed while this read was in flight may have made the row stale
+        if self._invalidations == invalidations:
+            self._store(key, value)
+        return value
+
+    def invalidate(self, decoy_email: str):
+        self._invalidations += 1
+        self._entries.pop(normalise_email(decoy_email), None)
+
+    def note_generation(self, generation: int):
+        """Record a generation bump made by this process"""
+        if self.generation is not None and generation == self.generation + 1:
+            self.generation = generation
+
+    def clear(self):
+        self._invalidations += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "generation": self.generation,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else None,
+        }
+
+    def _store(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _check_generation(self):
+        now = time.monotonic()
+        if now < self._next_generation_check:
+            return
+        self._next_generation_check = now + self.generation_check_interval
+        async with pool.reader() as db:
+            generation = await self._read_generation(db)
+        if generation != self.generation:
+            self.clear()
+            self.generation = generation
+
+    @staticmethod
+    async def _read_generation(db) -> int:
+        async with db.execute("SELECT value FROM meta WHERE key = 'decoys_generation'") as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else 0
+
+decoy_cache = DecoyCache(
+    config.DECOY_CACHE_MAX_ENTRIES,
+    config.DECOY_CACHE_TTL_SECONDS,
+    config.DECOY_CACHE_GENERATION_CHECK_SECONDS,
+)
@@ -0,0 +1,162 @@
+import asyncio
+import json
+from collections import Counter
+from config import config
+from dbpool import pool
+from rollups import COUNT_BUCKET_HITS, bucket_counts, event_rollup
+
+INSERT_EVENT = """
+    INSERT INTO events (decoy_email, customer_email, message_key, sender_email, sender_ip, subject, geo, eml_hash,
+                        created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+STORED_MESSAGE_KEYS = """
+    SELECT message_key, id FROM events WHERE message_key IN (SELECT value FROM json_each(?))
+"""
+
+REFERENCE_BLOB = """
+    UPDATE blobs SET refcount = refcount + 1, last_ref_at = ? WHERE hash = ?
+"""
+
+COUNT_DECOY_ALERTS = """
+    INSERT INTO decoy_stats (decoy_email, alerts, last_event_at) VALUES (?, ?, ?)
+    ON CONFLICT (decoy_email) DO UPDATE SET
+        alerts = alerts + excluded.alerts,
+        last_event_at = MAX(COALESCE(last_event_at, ''), excluded.last_event_at)
+"""
+
+COUNT_CUSTOMER_ALERTS = """
+    UPDATE customer_stats SET alerts = alerts + ? WHERE customer_email = ?
+"""
+
+class DuplicateEvent(Exception):
+    """An event with the same message_key is already stored"""
+
+    def __init__(self, event_id: int):
+        super().__init__(f"duplicate of event {event_id}")
+        self.event_id = event_id
+
+class EventWriter:
+    """Group-commits event inserts.
+
+    Rows are buffered and written with one executemany() per transaction once
+    batch_size rows are waiting or max_delay seconds have passed, whichever
+    comes first. write() resolves with the new event id after the commit,
+    or raises DuplicateEvent if the row's message_key is already stored or
+    earlier in the same batch.
+    """
+
+    def __init__(self, batch_size: int, max_delay: float):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._pending = []
+        self._has_items = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._stopping = False
+        self._task = None
+        self.batches = 0
+        self.rows = 0
+        self.duplicates = 0
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still buffered, then stop"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._has_items.set()
+        await self._task
+        self._task = None
+
+    def pending(self) -> int:
+        """Events waiting for the next flush"""
+        return len(self._pending)
+
+    async def write(self, row) -> int:
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((row, future))
+        self._has_items.set()
+        if len(self._pending) >= self.batch_size:
+            self._batch_full.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if not self._pending:
+                if self._stopping:
+                    return
+                self._has_items.clear()
+                continue
+            if len(self._pending) < self.batch_size and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), timeout=self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush()
+
+    async def _flush(self):
+        batch, self._pending = self._pending, []
+        self._has_items.clear()
+        self._batch_full.clear()
+        try:
+            async with pool.writer() as db:
+                # Drop redeliveries before the insert so ids stay contiguous
+                keys = [row[2] for row, _ in batch if row[2] is not None]
+                stored = {}
+                if keys:
+                    async with db.execute(STORED_MESSAGE_KEYS, (json.dumps(keys),)) as cursor:
+                        stored = dict(await cursor.fetchall())
+                fresh, duplicates = [], []
+                for row, future in batch:
+                    if row[2] is not None and row[2] in stored:
+                        duplicates.append((row[2], future))
+                        continue
+                    if row[2] is not None:
+                        stored[row[2]] = None
+                    fresh.append((row, future))
+                rows = [row for row, _ in fresh]
+                last_id = 0
+                if rows:
+                    await db.executemany(INSERT_EVENT, rows)
+                    async with db.execute("SELECT last_insert_rowid()") as cursor:
+                        last_id = (await cursor.fetchone())[0]
+                # Blob references commit atomically with the events that hold them
+                await db.executemany(REFERENCE_BLOB, [(row[-1], row[-2]) for row in rows if row[-2]])
+                # Rollup counters commit with the events they count
+                hits = Counter(row[0] for row in rows)
+                last_seen = {row[0]: row[-1] for row in rows}
+                await db.executemany(COUNT_DECOY_ALERTS, [(decoy, n, last_seen[decoy]) for decoy, n in hits.items()])
+                tenant_hits = Counter(row[1] for row in rows)
+                await db.executemany(COUNT_CUSTOMER_ALERTS, [(n, tenant) for tenant, n in tenant_hits.items()])
+                await db.executemany(COUNT_BUCKET_HITS, bucket_counts(rows))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Only this connection writes and ids are AUTOINCREMENT, so the batch got
+        # the contiguous range ending at last_insert_rowid()
+        event_rollup.add(rows)
+
+        first_id = last_id - len(fresh) + 1
+        for offset, (row, future) in enumerate(fresh):
+            if row[2] is not None:
+                stored[row[2]] = first_id + offset
+            if not future.done():
+                future.set_result(first_id + offset)
+        for key, future in duplicates:
+            if not future.done():
+                future.set_exception(DuplicateEvent(stored[key]))
+        self.batches += 1
+        self.rows += len(fresh)
+        self.duplicates += len(duplicates)
+
+event_writer = EventWriter(config.EVENT_BATCH_SIZE, config.EVENT_FLUSH_MS / 1000)
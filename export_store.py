@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timedelta
+from config import config
+from dbpool import pool
+from jobs import job_handler, submit
+from api.export import export_chunks
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = "id, customer_email, crm, use_case, fingerprint, status, size, error, created_at, finished_at"
+
+class ExportStore:
+    """Background CRM exports written to <root>/<id>.zip and reused while the data is unchanged.
+
+    Each export row carries a fingerprint of the tenant, CRM, filter and the
+    state of the tenant's data. A request whose fingerprint matches a finished
+    or in-progress export gets that export instead of a new job. sweep()
+    removes artifacts past EXPORT_TTL_SECONDS, then the least recently
+    downloaded ones until the directory fits EXPORT_DISK_QUOTA_BYTES.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._task = None
+
+    def path_for(self, export_id: int) -> str:
+        return os.path.join(self.root, f"{export_id}.zip")
+
+    async def fingerprint(self, customer_email: str, crm: str, use_case=None) -> str:
+        """Hash of the request and the tenant's latest event and decoy changes"""
+        async with pool.reader() as db:
+            async with db.execute("SELECT MAX(id) FROM events WHERE customer_email = ?", (customer_email,)) as cursor:
+                (max_event_id,) = await cursor.fetchone()
+            # Adding, re-provisioning or moving a decoy changes one of these
+            async with db.execute("""
+                SELECT MAX(created_at), (SELECT decoys FROM customer_stats WHERE customer_email = ?)
+                FROM decoys WHERE customer_email = ?
+            """, (customer_email, customer_email)) as cursor:
+                last_decoy_at, decoys = await cursor.fetchone()
+        key = json.dumps([customer_email, crm, use_case, max_event_id, last_decoy_at, decoys])
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    async def request(self, customer_email: str, crm: str, use_case=None) -> dict:
+        """Return a reusable export for this request, or create one and queue its job"""
+        fingerprint = await self.fingerprint(customer_email, crm, use_case)
+        async with pool.writer() as db:
+            async with db.execute(f"""
+                SELECT {EXPORT_COLUMNS} FROM exports
+                WHERE customer_email = ? AND fingerprint = ? AND status IN ('pending', 'running', 'done')
+                ORDER BY id DESC LIMIT 1
+            """, (customer_email, fingerprint)) as cursor:
+                row = await cursor.fetchone()
+            if row is not None and (row[5] != "done" or os.path.exists(self.path_for(row[0]))):
+                return export_row(row)
+            async with db.execute(f"""
+                INSERT INTO exports (customer_email, crm, use_case, fingerprint, status, created_at)
+                VALUES (?, ?, ?, ?, 'pending', ?)
+                RETURNING {EXPORT_COLUMNS}
+            """, (customer_email, crm, use_case, fingerprint, datetime.utcnow().isoformat())) as cursor:
+                row = await cursor.fetchone()
+        await submit("export", {"export_id": row[0]})
+        return export_row(row)
+
+    async def get(self, export_id: int, customer_email: str):
+        """Return the caller's export, or None"""
+        async with pool.reader() as db:
+            async with db.execute(f"""
+                SELECT {EXPORT_COLUMNS} FROM exports WHERE id = ? AND customer_email = ?
+            """, (export_id, customer_email)) as cursor:
+                row = await cursor.fetchone()
+        return export_row(row) if row else None
+
+    async def touch(self, export_id: int):
+        async with pool.writer() as db:
+            await db.execute("UPDATE exports SET last_access_at = ? WHERE id = ?",
+                             (datetime.utcnow().isoformat(), export_id))
+
+    async def build(self, export_id: int):
+        """Write the export ZIP to a temp file and move it into place when complete"""
+        async with pool.writer() as db:
+            async with db.execute("""
+                UPDATE exports SET status = 'running', error = NULL
+                WHERE id = ? AND status IN ('pending', 'running', 'failed')
+                RETURNING customer_email, crm, use_case
+            """, (export_id,)) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            # Swept before a worker got to it
+            return
+        customer_email, crm, use_case = row
+
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                async for data in export_chunks(customer_email, crm, use_case):
+                    await asyncio.to_thread(out.write, data)
+                size = out.tell()
+            os.replace(tmp_path, self.path_for(export_id))
+        except BaseException as e:
+            os.unlink(tmp_path)
+            if isinstance(e, Exception):
+                async with pool.writer() as db:
+                    await db.execute("UPDATE exports SET status = 'failed', error = ? WHERE id = ?",
+                                     (f"{type(e).__name__}: {e}", export_id))
+            raise
+
+        now = datetime.utcnow().isoformat()
+        async with pool.writer() as db:
+            await db.execute("""
+                UPDATE exports SET status = 'done', size = ?, finished_at = ?, last_access_at = ?
+                WHERE id = ?
+            """, (size, now, now, export_id))
+
+    async def sweep(self) -> dict:
+        """Delete exports past their TTL, then the least recently used beyond the disk quota"""
+        cutoff = (datetime.utcnow() - timedelta(seconds=config.EXPORT_TTL_SECONDS)).isoformat()
+        async with pool.writer() as db:
+            async with db.execute("""
+                DELETE FROM exports
+                WHERE (status = 'done' AND finished_at < ?) OR (status = 'failed' AND created_at < ?)
+                RETURNING id
+            """, (cutoff, cutoff)) as cursor:
+                expired = [row[0] for row in await cursor.fetchall()]
+
+            async with db.execute("""
+                SELECT id, size FROM exports WHERE status = 'done' ORDER BY last_access_at DESC
+            """) as cursor:
+                kept, evicted = 0, []
+                async for export_id, size in cursor:
+                    kept += size
+                    if kept > config.EXPORT_DISK_QUOTA_BYTES:
+                        evicted.append(export_id)
+            await db.executemany("DELETE FROM exports WHERE id = ?", [(export_id,) for export_id in evicted])
+
+        for export_id in expired + evicted:
+            try:
+                os.unlink(self.path_for(export_id))
+            except FileNotFoundError:
+                pass
+        return {"expired": len(expired), "evicted": len(evicted)}
+
+    async def _run_sweeps(self):
+        while True:
+            await asyncio.sleep(config.EXPORT_SWEEP_INTERVAL_SECONDS)
+            try:
+                result = await self.sweep()
+                logger.info("Export sweep finished", extra=result)
+            except Exception:
+                logger.exception("Export sweep failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_sweeps())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+def export_row(row) -> dict:
+    export_id, _, crm, use_case, fingerprint, status, size, error, created_at, finished_at = row
+    return {
+        "id": export_id,
+        "crm": crm,
+        "use_case": use_case,
+        "status": status,
+        "size": size,
+        "error": error,
+        "fingerprint": fingerprint,
+        "created_at": created_at,
+        "finished_at": finished_at,
+        "download_url": f"/api/exports/{export_id}/download" if status == "done" else None
+    }
+
+export_store = ExportStore(config.EXPORT_DIR)
+
+@job_handler("export")
+async def build_export(payload):
+    await export_store.build(payload["export_id"])
@@ -0,0 +1,148 @@
+import asyncio
+import csv
+import ipaddress
+import logging
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from config import config
+from http_clients import get_client
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_LOCATION = "Unknown location"
+
+def format_location(city, region, country) -> str:
+    return ", ".join(part for part in (city, region, country) if part) or UNKNOWN_LOCATION
+
+def _parse_ip(value: str):
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    return int(ipaddress.ip_address(value))
+
+class RangeTable:
+    """Sorted, non-overlapping integer IP ranges searched with bisect"""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.locations = []
+
+    def build(self, ranges):
+        ranges.sort(key=lambda r: r[0])
+        self.starts = [start for start, _, _ in ranges]
+        self.ends = [end for _, end, _ in ranges]
+        self.locations = [location for _, _, location in ranges]
+
+    def find(self, ip: int):
+        i = bisect_right(self.starts, ip) - 1
+        if i >= 0 and ip <= self.ends[i]:
+            return self.locations[i]
+        return None
+
+    def __len__(self):
+        return len(self.starts)
+
+class GeoResolver:
+    """Resolves an IP to a location string.
+
+    The offline range database is tried first. Anything it does not cover
+    goes to ipapi.co; those results are kept in an LRU with a TTL, and
+    concurrent lookups for the same IP share a single upstream request.
+    """
+
+    def __init__(self, cache_size: int, cache_ttl: float, failure_ttl: float):
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.failure_ttl = failure_ttl
+        self.v4 = RangeTable()
+        self.v6 = RangeTable()
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self.local_hits = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.remote_lookups = 0
+
+    def load_ranges(self, path: str) -> int:
+        """Load a CSV of start_ip,end_ip,city,region,country rows (dotted or integer IPs)"""
+        v4, v6 = [], []
+        with open(path, newline="") as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith("#") or row[0] == "start_ip":
+                    continue
+                start_ip, end_ip, city, region, country = (row + [""] * 5)[:5]
+                start, end = _parse_ip(start_ip), _parse_ip(end_ip)
+                is_v6 = ":" in start_ip or start > 0xFFFFFFFF
+                (v6 if is_v6 else v4).append((start, end, format_location(city, region, country)))
+        self.v4.build(v4)
+        self.v6.build(v6)
+        return len(v4) + len(v6)
+
+    async def load(self):
+        if config.GEO_DB_PATH:
+            count = await asyncio.to_thread(self.load_ranges, config.GEO_DB_PATH)
+            logger.info("Loaded geo ranges", extra={"count": count, "path": config.GEO_DB_PATH})
+
+    async def lookup(self, ip: str) -> str:
+        try:
+            address = ipaddress.ip_address((ip or "").strip())
+        except ValueError:
+            return UNKNOWN_LOCATION
+        if not address.is_global:
+            return UNKNOWN_LOCATION
+
+        table = self.v4 if address.version == 4 else self.v6
+        location = table.find(int(address))
+        if location is not None:
+            self.local_hits += 1
+            return location
+
+        key = str(address)
+        entry = self._cache.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return entry[0]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(self._remote_lookup(key))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _remote_lookup(self, ip: str) -> str:
+        self.remote_lookups += 1
+        location, ttl = UNKNOWN_LOCATION, self.failure_ttl
+        try:
+            response = await get_client("ipapi").get(f"/{ip}/json")
+            if response.status_code == 200:
+                data = response.json()
+                location = format_location(data.get("city"), data.get("region"), data.get("country_name"))
+                ttl = self.cache_ttl
+        except Exception as e:
+            logger.warning("Geo lookup failed", extra={"ip": ip, "error": str(e)})
+
+        self._cache[ip] = (location, time.monotonic() + ttl)
+        self._cache.move_to_end(ip)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return location
+
+    def stats(self) -> dict:
+        return {
+            "ranges_v4": len(self.v4),
+            "ranges_v6": len(self.v6),
+            "cached": len(self._cache),
+            "local_hits": self.local_hits,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "remote_lookups": self.remote_lookups,
+        }
+
+geo_resolver = GeoResolver(config.GEO_CACHE_SIZE, config.GEO_CACHE_TTL_SECONDS, config.GEO_FAILURE_TTL_SECONDS)
@@ -0,0 +1,50 @@
+import httpx
+from config import config
+from metrics import UPSTREAM_RESPONSES
+
+# One pooled, keep-alive client per upstream, created on startup and closed on shutdown
+_clients = {}
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=config.UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=config.UPSTREAM_MAX_CONNECTIONS,
+    )
+
+def _count_responses(name: str) -> dict:
+    async def count(response):
+        UPSTREAM_RESPONSES.labels(name, response.status_code).inc()
+    return {"response": [count]}
+
+async def start_clients():
+    """Create the shared upstream HTTP clients"""
+    timeout = httpx.Timeout(config.UPSTREAM_TIMEOUT_SECONDS)
+    _clients["mailgun"] = httpx.AsyncClient(
+        event_hooks=_count_responses("mailgun"),
+        auth=("api", config.MAILGUN_API_KEY or ""),
+        timeout=timeout,
+        limits=_limits(),
+    )
+    _clients["ipapi"] = httpx.AsyncClient(
+        event_hooks=_count_responses("ipapi"),
+        base_url=config.IPAPI_BASE_URL,
+        timeout=timeout,
+        limits=_limits(),
+    )
+    _clients["sendgrid"] = httpx.AsyncClient(
+        event_hooks=_count_responses("sendgrid"),
+        base_url=config.SENDGRID_BASE_URL,
+        headers={"Authorization": f"Bearer {config.SENDGRID_API_KEY}"},
+        timeout=timeout,
+        limits=_limits(),
+    )
+
+async def close_clients():
+    """Close the shared upstream HTTP clients"""
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Return the shared client for an upstream (mailgun, ipapi, sendgrid)"""
+    return _clients[name]
@@ -0,0 +1,131 @@
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from config import config
+from dbpool import pool
+
+NEW, DUPLICATE, MAYBE = "new", "duplicate", "maybe"
+
+def message_key(message_id, recipient):
+    """Dedup key for one delivery of a message to one decoy, or None without a message id"""
+    if not message_id or not recipient:
+        return None
+    raw = f"{message_id.strip()}\n{recipient.strip().lower()}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+class BloomFilter:
+    """Fixed-size Bloom filter over message keys (hex digests, so already uniformly hashed)"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # Double hashing over the two halves of the digest
+        h1, h2 = int(key[:16], 16), int(key[16:32], 16) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class IngestGuard:
+    """Remembers recently accepted webhooks so Mailgun redeliveries are dropped on arrival.
+
+    Keys accepted in the last window seconds are held exactly, up to
+    max_entries. In front of them sit two Bloom filter generations that
+    rotate every window, so a key stays in a filter for one to two windows.
+    A key in neither filter is new without further checks. A key in a filter
+    but not in the exact set is either older or a false positive; the
+    caller settles it against the unique index on events.message_key.
+    """
+
+    def __init__(self, window: float, max_entries: int, bloom_capacity: int, bloom_error_rate: float):
+        self.window = window
+        self.max_entries = max_entries
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self._recent = OrderedDict()
+        self._current = BloomFilter(bloom_capacity, bloom_error_rate)
+        self._previous = BloomFilter(bloom_capacity, bloom_error_rate)
+        self._rotate_at = time.monotonic() + window
+        self.duplicates = 0
+        self.database_checks = 0
+
+    async def load(self) -> int:
+        """Put the newest stored message keys in the Bloom filter so redeliveries after a restart are checked"""
+        async with pool.reader() as db:
+            async with db.execute(RECENT_MESSAGE_KEYS, (self.max_entries,)) as cursor:
+                rows = await cursor.fetchall()
+        for (key,) in rows:
+            self._current.add(key)
+        return len(rows)
+
+    def _expire(self, now: float):
+        if now >= self._rotate_at:
+            self._previous, self._current = self._current, BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+            self._rotate_at = now + self.window
+        cutoff = now - self.window
+        while self._recent and (next(iter(self._recent.values())) < cutoff or len(self._recent) > self.max_entries):
+            self._recent.popitem(last=False)
+
+    def check(self, key: str) -> str:
+        """Classify key as NEW, DUPLICATE or MAYBE and remember it from now on"""
+        now = time.monotonic()
+        self._expire(now)
+        if key in self._recent:
+            self.duplicates += 1
+            return DUPLICATE
+        state = MAYBE if key in self._current or key in self._previous else NEW
+        self.remember(key, now)
+        return state
+
+    def remember(self, key: str, now=None):
+        self._recent[key] = time.monotonic() if now is None else now
+        if key not in self._current:
+            self._current.add(key)
+
+    def forget(self, key: str):
+        """Let a redelivery through again, e.g. after the first delivery failed to queue"""
+        self._recent.pop(key, None)
+
+    async def is_duplicate(self, key: str) -> bool:
+        state = self.check(key)
+        if state is MAYBE:
+            # Already in the exact set, so concurrent redeliveries see DUPLICATE while this runs
+            self.database_checks += 1
+            async with pool.reader() as db:
+                async with db.execute(EVENT_EXISTS, (key,)) as cursor:
+                    if await cursor.fetchone() is not None:
+                        self.duplicates += 1
+                        return True
+            return False
+        return state is DUPLICATE
+
+    def stats(self) -> dict:
+        return {
+            "recent": len(self._recent),
+            "max_entries": self.max_entries,
+            "bloom_keys": self._current.count + self._previous.count,
+            "bloom_bytes": len(self._current.bits) + len(self._previous.bits),
+            "duplicates": self.duplicates,
+            "database_checks": self.database_checks,
+        }
+
+EVENT_EXISTS = "SELECT 1 FROM events WHERE message_key = ?"
+RECENT_MESSAGE_KEYS = "SELECT message_key FROM events WHERE message_key IS NOT NULL ORDER BY id DESC LIMIT ?"
+
+ingest_guard = IngestGuard(
+    config.INGEST_DEDUP_WINDOW_SECONDS,
+    config.INGEST_SEEN_MAX_ENTRIES,
+    config.INGEST_BLOOM_CAPACITY,
+    config.INGEST_BLOOM_ERROR_RATE,
+)
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from config import config
+from coordinator import forwarded
+from db import enqueue_job, claim_job, complete_job, fail_job, requeue_running_jobs
+from logs import correlation_id
+
+logger = logging.getLogger(__name__)
+
+# Job kind -> async handler(payload). Handlers may update the payload dict to
+# checkpoint progress; it is saved with the job if the attempt fails.
+HANDLERS = {}
+
+_workers = []
+_wakeup = asyncio.Event()
+
+def job_handler(kind: str):
+    """Register an async handler for a job kind"""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+@forwarded
+async def submit(kind: str, payload: dict) -> int:
+    """Persist a job and wake a worker to run it"""
+    job_id = await enqueue_job(kind, payload)
+    _wakeup.set()
+    return job_id
+
+async def run_next_job() -> bool:
+    """Claim and run one due job. Returns False if the queue had nothing due."""
+    job = await claim_job()
+    if job is None:
+        return False
+
+    job_id, kind, payload, attempts = job
+    token = correlation_id.set(payload.get("correlation_id"))
+    try:
+        handler = HANDLERS[kind]
+        await handler(payload)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        status = await fail_job(job_id, payload, attempts, f"{type(e).__name__}: {e}")
+        logger.warning("Job failed", extra={"job_id": job_id, "kind": kind, "attempts": attempts,
+                                            "status": status, "error": str(e)})
+    else:
+        await complete_job(job_id)
+    finally:
+        correlation_id.reset(token)
+    return True
+
+async def _worker():
+    while True:
+        try:
+            if await run_next_job():
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Job worker error")
+
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=config.JOB_POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+async def start_workers():
+    """Requeue interrupted jobs and start the worker pool"""
+    requeued = await requeue_running_jobs()
+    if requeued:
+        logger.info("Requeued interrupted jobs", extra={"count": requeued})
+    for _ in range(config.JOB_WORKERS):
+        _workers.append(asyncio.create_task(_worker()))
+
+async def stop_workers():
+    """Stop the worker pool. Jobs still running are requeued on the next start."""
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -0,0 +1,151 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import uuid
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from config import config
+from metrics import Counter
+
+# Id of the decoy hit (or request) being handled, carried into its job and alerts
+correlation_id = ContextVar("correlation_id", default=None)
+
+LOGS_DROPPED = Counter("honeypot_log_records_dropped_total", "Log records dropped because the log queue was full")
+_dropped = LOGS_DROPPED.labels()
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "correlation_id", "sampled"}
+
+EMAIL_FIELDS = {"sender", "recipient", "email", "customer_email", "decoy_email", "to"}
+TEXT_FIELDS = {"subject", "body"}
+IP_FIELDS = {"ip"}
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def mask_email(address) -> str:
+    """j***@example.com"""
+    local, at, domain = str(address).partition("@")
+    return f"{local[:1]}***{at}{domain}" if at else "***"
+
+def mask_ip(address) -> str:
+    """Keep the network, drop the host: 203.0.113.x, 2001:db8:1::x"""
+    address = str(address)
+    if ":" in address:
+        return ":".join(address.split(":")[:3]) + "::x"
+    return ".".join(address.split(".")[:3]) + ".x"
+
+def redact(key: str, value):
+    if value is None:
+        return None
+    if key in EMAIL_FIELDS:
+        return mask_email(value)
+    if key in TEXT_FIELDS:
+        return f"<{len(str(value))} chars>"
+    if key in IP_FIELDS:
+        return mask_ip(value)
+    return value
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the message, level, correlation id and extra= fields"""
+
+    def __init__(self, redact_fields: bool = True):
+        super().__init__()
+        self.redact_fields = redact_fields
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "correlation_id", None):
+            entry["correlation_id"] = record.correlation_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = redact(key, value) if self.redact_fields else value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class ContextFilter(logging.Filter):
+    """Stamp the current correlation id and keep only a sample of high-volume records.
+
+    Records logged with extra={"sampled": True} below WARNING are kept for
+    LOG_SAMPLE_RATE of hits. The choice is made per correlation id, so a
+    kept hit keeps every one of its stage messages.
+    """
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.threshold = int(max(0.0, min(1.0, sample_rate)) * 0xFFFFFFFF)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        if getattr(record, "sampled", False) and record.levelno < logging.WARNING and self.threshold < 0xFFFFFFFF:
+            key = record.correlation_id or record.getMessage()
+            return zlib.crc32(key.encode()) <= self.threshold
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to the writer thread; drop and count them when the queue is full"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped.inc()
+
+    def prepare(self, record):
+        # Keep extra= fields and exc_info as they are; the JSON formatter
+        # renders them in the writer thread
+        record = logging.makeLogRecord(vars(record))
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room rather than failing when a slow stdout has filled the queue
+        self.queue.put(self._sentinel)
+
+# Per-request client logs would flood the output and carry full URLs
+QUIET_LOGGERS = ("httpx", "httpcore")
+
+_listener = None
+
+def setup_logging(stream=None):
+    """Route all logging through a bounded queue to a JSON writer thread"""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter(redact_fields=config.LOG_REDACT))
+    log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter(config.LOG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for existing in [h for h in root.handlers if isinstance(h, DroppingQueueHandler)]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(config.LOG_LEVEL)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    _listener = _Listener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
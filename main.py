@@ -1,16 +1,38 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from db import find_customer, log_event, init_db
-from alerts import send_email_alert
+from db import find_customer, log_event, init_db, queue_alert
+from alerts import alert_dispatcher
 from config import config
+from coordinator import coordinator, forwarded, WRITER
+from dbpool import pool
+from event_writer import event_writer, DuplicateEvent
+from decoy_cache import decoy_cache
+from geo import geo_resolver
+from blobstore import blob_store
+from export_store import export_store
+from pubsub import event_bus
+from rollups import event_rollup
+from retention import event_archiver
+from ingest_guard import ingest_guard, message_key
+from metrics import STAGE_SECONDS, HITS, DUPLICATES, EML_BYTES, loop_lag_monitor
+from logs import setup_logging, stop_logging, correlation_id, new_correlation_id
+from http_clients import start_clients, close_clients, get_client
+from jobs import job_handler, submit, start_workers, stop_workers
 from api.stats import router as stats_router
 from api.decoys import router as decoys_router  
 from api.export import router as export_router
-from auth import router as auth_router
+from api.exports import router as exports_router
+from api.queue import router as queue_router
+from api.events import router as events_router
+from api.metrics import router as metrics_router
+from auth import router as auth_router, start_otp_purge, stop_otp_purge
+import asyncio
 import datetime
-import os
-import requests
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -28,79 +50,239 @@ app.include_router(auth_router)
 app.include_router(stats_router)
 app.include_router(decoys_router)
 app.include_router(export_router)
+app.include_router(exports_router)
+app.include_router(queue_router)
+app.include_router(events_router)
+app.include_router(metrics_router)
+
+_warmup_task = None
+
+async def warm_up():
+    """Preload the decoy cache once serving has started; hits that arrive first look decoys up one by one"""
+    try:
+        count = await decoy_cache.load()
+        logger.info("Decoy cache warmed", extra={"entries": count})
+    except Exception:
+        logger.exception("Decoy cache warm-up failed")
 
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
+    setup_logging()
+    loop_lag_monitor.start()
+    # With several server processes, one writes and the others forward their writes to it
+    if coordinator.claim() != WRITER:
+        await coordinator.connect()
+        await pool.open()
+        return
+    await pool.open()
     await init_db()
+    if config.DECOY_CACHE_WARMUP == "startup":
+        await decoy_cache.load()
+    await ingest_guard.load()
+    await event_rollup.load()
+    await geo_resolver.load()
+    event_writer.start()
+    blob_store.start()
+    export_store.start()
+    event_rollup.start()
+    event_archiver.start()
+    start_otp_purge()
+    await start_clients()
+    await start_workers()
+    await alert_dispatcher.start()
+    await coordinator.serve()
+    if config.DECOY_CACHE_WARMUP == "background":
+        global _warmup_task
+        _warmup_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if coordinator.role == WRITER:
+        if _warmup_task is not None:
+            _warmup_task.cancel()
+            await asyncio.gather(_warmup_task, return_exceptions=True)
+        await coordinator.stop()
+        await alert_dispatcher.stop()
+        await stop_workers()
+        await event_writer.stop()
+        await event_rollup.stop()
+        await event_archiver.stop()
+        await blob_store.stop()
+        await export_store.stop()
+        await stop_otp_purge()
+        await close_clients()
+    else:
+        await coordinator.stop()
+    await pool.close()
+    await loop_lag_monitor.stop()
+    stop_logging()
 
-def lookup_geo(ip):
+# Per-stage latency, bound once so recording is a single observe()
+FORM_PARSE = STAGE_SECONDS.labels("form_parse")
+ENQUEUE = STAGE_SECONDS.labels("enqueue")
+FIND_CUSTOMER = STAGE_SECONDS.labels("find_customer")
+GEO_LOOKUP = STAGE_SECONDS.labels("geo_lookup")
+EML_FETCH = STAGE_SECONDS.labels("eml_fetch")
+BLOB_PUT = STAGE_SECONDS.labels("blob_put")
+LOG_EVENT = STAGE_SECONDS.labels("log_event")
+QUEUE_ALERT = STAGE_SECONDS.labels("queue_alert")
+MATCHES = HITS.labels("match")
+MISSES = HITS.labels("miss")
+EML_FETCHED_BYTES = EML_BYTES.labels()
+WEBHOOK_DUPLICATES = DUPLICATES.labels("webhook")
+JOB_DUPLICATES = DUPLICATES.labels("job")
+
+async def timed(stage, awaitable):
+    with stage.time():
+        return await awaitable
+
+async def fetch_eml(message_url):
+    """Stream the raw .eml from Mailgun storage into a spooled temp file.
+
+    Returns an open file positioned at 0, or None. Messages larger than
+    EML_MAX_BYTES are dropped rather than attached.
+    """
+    if not message_url:
+        return None
+    eml_file = tempfile.SpooledTemporaryFile(max_size=config.EML_SPOOL_THRESHOLD_BYTES)
+    size = 0
     try:
-        response = requests.get(f"https://ipapi.co/{ip}/json")
-        if response.status_code == 200:
-            data = response.json()
-            return f"{data.get('city', '')}, {data.get('region', '')}, {data.get('country_name', '')}".strip(", ")
-        else:
-            return "Unknown location"
+        async with get_client("mailgun").stream("GET", message_url) as r:
+            if r.status_code != 200:
+                logger.warning("Failed to fetch .eml from Mailgun", extra={"status": r.status_code})
+                eml_file.close()
+                return None
+            async for chunk in r.aiter_bytes():
+                size += len(chunk)
+                if size > config.EML_MAX_BYTES:
+                    logger.warning(".eml too large, not attaching it", extra={"limit": config.EML_MAX_BYTES})
+                    eml_file.close()
+                    return None
+                eml_file.write(chunk)
     except Exception as e:
-        print(f"Geo lookup error: {e}")
-        return "Unknown location"
+        logger.warning("Failed to fetch .eml from Mailgun", extra={"error": str(e)})
+        eml_file.close()
+        return None
+
+    EML_FETCHED_BYTES.inc(size)
+    if size < 100:
+        logger.warning(".eml is suspiciously small and may be incomplete", extra={"size": size})
+    logger.info(".eml fetched", extra={"size": size, "sampled": True})
+    eml_file.seek(0)
+    return eml_file
 
 
 @app.post("/webhook/inbound")
 async def inbound(request: Request):
-    form = await request.form()
-
-    recipient = form.get("recipient")
-    sender = form.get("sender")
-    subject = form.get("subject")
-    body = form.get("body-plain")
-    ip = form.get("X-Mailgun-Incoming-IP") or request.client.host
-    geo = lookup_geo(ip)
-    message_url = form.get("message-url")
-
-    print("📨 Decoy hit detected!")
-    print(f"To: {recipient}")
-    print(f"From: {sender}")
-    print(f"IP: {ip}")
-    print(f"Subject: {subject}")
-    print(f"Time: {datetime.datetime.utcnow().isoformat()}")
-
-    # Fetch raw .eml
-    eml_data = None
-    if message_url:
-        mg_api = os.getenv("MAILGUN_API_KEY")
-        r = requests.get(message_url, auth=("api", mg_api))
-        if r.status_code == 200:
-            eml_data = r.content
-            if len(eml_data) < 100:
-                print("⚠️ .eml file seems suspiciously small. Might not contain full content.")
-            print(f"✅ .eml fetched, size: {len(eml_data)} bytes")
-        else:
-            print("⚠️ Failed to fetch .eml from Mailgun:", r.text)
-
-    match = await find_customer(recipient)
-    if match:
-        customer_email, use_case = match
-        await log_event(recipient, sender, ip, subject)
-        send_email_alert(customer_email, recipient, sender, ip, geo, subject, body, eml_data)
-        print(f"✅ Alert sent to {customer_email} for decoy: {recipient} ({use_case})")
-    else:
-        print(f"⚠️ No match for decoy: {recipient}")
+    with FORM_PARSE.time():
+        form = await request.form()
+
+    # One id follows the hit through its job, event and alert
+    correlation_id.set((request.headers.get("X-Request-ID") or new_correlation_id())[:64])
+    payload = {
+        "correlation_id": correlation_id.get(),
+        # Mailgun redelivers when we are slow; a repeat must not cost upstream calls or a second alert
+        "message_key": message_key(form.get("Message-Id") or form.get("token"), form.get("recipient")),
+        "recipient": form.get("recipient"),
+        "sender": form.get("sender"),
+        "subject": form.get("subject"),
+        "body": form.get("body-plain"),
+        "ip": form.get("X-Mailgun-Incoming-IP") or request.client.host,
+        "message_url": form.get("message-url"),
+        "received_at": datetime.datetime.utcnow().isoformat()
+    }
+
+    # Acknowledge Mailgun right away; the job workers do the slow part
+    with ENQUEUE.time():
+        job_id = await accept_hit(payload)
+    if job_id is None:
+        WEBHOOK_DUPLICATES.inc()
+        logger.info("Duplicate webhook dropped", extra={"recipient": payload["recipient"], "sampled": True})
+        return JSONResponse(content={"status": "duplicate"}, status_code=200)
+    logger.info("Decoy hit queued", extra={"job_id": job_id, "recipient": payload["recipient"], "sampled": True})
 
     return JSONResponse(content={"status": "ok"}, status_code=200)
-def lookup_geo(ip):
+
+@forwarded
+async def accept_hit(payload):
+    """Queue a webhook's hit and return the job id, or None for a redelivery.
+
+    Runs in the writer process, whose ingest guard sees every server process's webhooks.
+    """
+    key = payload["message_key"]
+    if key is not None and await ingest_guard.is_duplicate(key):
+        return None
     try:
-        response = requests.get(f"https://ipapi.co/{ip}/json")
-        if response.status_code == 200:
-            data = response.json()
-            return f"{data.get('city', '')}, {data.get('region', '')}, {data.get('country_name', '')}".strip(", ")
+        return await submit("inbound_hit", payload)
+    except BaseException:
+        # Not queued, so Mailgun's retry has to get through
+        if key is not None:
+            ingest_guard.forget(key)
+        raise
+
+@job_handler("inbound_hit")
+async def process_hit(payload):
+    recipient = payload["recipient"]
+    sender = payload["sender"]
+    subject = payload["subject"]
+    body = payload["body"]
+    ip = payload["ip"]
+
+    logger.info("Processing decoy hit", extra={"recipient": recipient, "sender": sender, "ip": ip, "subject": subject,
+                                               "received_at": payload["received_at"], "sampled": True})
+
+    with FIND_CUSTOMER.time():
+        match = await find_customer(recipient)
+    if not match:
+        MISSES.inc()
+        logger.info("No decoy matches the recipient", extra={"recipient": recipient, "sampled": True})
+        return
+    MATCHES.inc()
+
+    customer_email, use_case = match
+    # Checkpoint so a retried job does not log the same hit twice
+    if "event_id" not in payload:
+        # Geo lookup and raw .eml fetch run concurrently
+        geo, eml_file = await asyncio.gather(
+            timed(GEO_LOOKUP, geo_resolver.lookup(ip)),
+            timed(EML_FETCH, fetch_eml(payload["message_url"]))
+        )
+        try:
+            eml_hash = await timed(BLOB_PUT, blob_store.put(eml_file)) if eml_file is not None else None
+        finally:
+            if eml_file is not None:
+                eml_file.close()
+        created_at = datetime.datetime.utcnow().isoformat()
+        try:
+            with LOG_EVENT.time():
+                event_id = await log_event(recipient, customer_email, sender, ip, subject, geo, eml_hash, created_at,
+                                           payload.get("message_key"))
+        except DuplicateEvent as e:
+            # A redelivery that got past the webhook check. queue_alert() is a no-op
+            # if the first delivery already queued the alert.
+            JOB_DUPLICATES.inc()
+            logger.info("Duplicate hit already logged", extra={"event_id": e.event_id})
+            payload["event_id"], payload["geo"], payload["eml_hash"] = e.event_id, geo, eml_hash
         else:
-            return "Unknown location"
-    except Exception as e:
-        print(f"Geo lookup error: {e}")
-        return "Unknown location"
+            payload["event_id"], payload["geo"], payload["eml_hash"] = event_id, geo, eml_hash
+            # Push to the customer's open dashboards
+            event_bus.publish(customer_email, {
+                "id": payload["event_id"],
+                "decoy_email": recipient,
+                "sender_email": sender,
+                "sender_ip": ip,
+                "subject": subject,
+                "geo": geo,
+                "created_at": created_at,
+                "has_eml": eml_hash is not None
+            })
 
+    with QUEUE_ALERT.time():
+        await queue_alert(customer_email, recipient, payload["event_id"], sender, ip,
+                          payload["geo"], subject, body, payload["eml_hash"])
+    logger.info("Alert queued", extra={"customer_email": customer_email, "recipient": recipient,
+                                       "use_case": use_case, "sampled": True})
 
 
 @app.get("/")
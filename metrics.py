@@ -0,0 +1,196 @@
+import asyncio
+from bisect import bisect_left
+from time import perf_counter
+from config import config
+
+# Latency buckets in seconds, from a cache hit to a slow upstream
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Metrics are only touched from the event loop thread, so recording is a
+# plain attribute update with no locks.
+_metrics = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", '\\"').replace("\n", "\\n")
+
+def _label_text(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        # Children by the label values exactly as passed, e.g. (name, 200), to skip str() on repeat calls
+        self._lookup = {}
+        if not self.labelnames:
+            self.labels()
+        _metrics.append(self)
+
+    def labels(self, *values):
+        """Return the child for these label values. Bind it once outside the hot path where possible."""
+        child = self._lookup.get(values)
+        if child is None:
+            key = tuple(str(value) for value in values)
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            self._lookup[values] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, _label_text(self.labelnames, values)))
+        return lines
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self, name, labels):
+        return [f"{name}{labels} {self.value}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        child = self.child
+        elapsed = perf_counter() - self.start
+        child.counts[bisect_left(child.bounds, elapsed)] += 1
+        child.sum += elapsed
+        return False
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # The last slot counts values above the largest bound; the total is summed at scrape time
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def time(self) -> _Timer:
+        """Context manager that observes the seconds spent inside it"""
+        return _Timer(self)
+
+    def render(self, name, labels):
+        prefix = labels[:-1] + "," if labels else "{"
+        lines, cumulative = [], 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{prefix}le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{name}_bucket{prefix}le="+Inf"}} {cumulative}')
+        lines.append(f"{name}_sum{labels} {self.sum}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+class Gauge:
+    """Gauge read at scrape time from a function returning {(label values...): value}"""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), read=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.read = read
+        _metrics.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for values, value in sorted(self.read().items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, values)} {float(value)}")
+        return lines
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+STAGE_SECONDS = Histogram(
+    "honeypot_inbound_stage_seconds", "Time spent in each stage of handling a decoy hit", ("stage",)
+)
+HITS = Counter("honeypot_inbound_hits_total", "Processed decoy hits by whether the recipient is a decoy", ("result",))
+UPSTREAM_RESPONSES = Counter(
+    "honeypot_upstream_responses_total", "Upstream HTTP responses by upstream and status code", ("upstream", "status")
+)
+DUPLICATES = Counter(
+    "honeypot_inbound_duplicates_total", "Redelivered webhooks dropped, by where they were caught", ("stage",)
+)
+EML_BYTES = Counter("honeypot_eml_fetched_bytes_total", "Raw .eml bytes fetched from Mailgun")
+DB_WRITER_WAIT = Histogram("honeypot_db_writer_wait_seconds", "Time spent waiting for the SQLite writer connection")
+LOOP_LAG = Histogram(
+    "honeypot_event_loop_lag_seconds", "How late the event loop ran a timer callback",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+class LoopLagMonitor:
+    """Sleeps for a fixed interval and records how much later than asked it woke up"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = perf_counter()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, perf_counter() - start - self.interval)
+            LOOP_LAG.labels().observe(self.last_lag)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+loop_lag_monitor = LoopLagMonitor(config.METRICS_LOOP_LAG_INTERVAL_SECONDS)
+Gauge("honeypot_event_loop_lag_last_seconds", "Event loop lag at the last check",
+      read=lambda: {(): loop_lag_monitor.last_lag})
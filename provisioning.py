@@ -0,0 +1,200 @@
+"""Bulk decoy provisioning from CSV or NDJSON.
+
+    python provisioning.py decoys.csv
+    python provisioning.py --format ndjson --customer ops@example.com - < decoys.ndjson
+
+CSV input needs a header row with a decoy_email column and optionally
+customer_email and use_case; NDJSON input has one object per line with the
+same keys. Loads are idempotent, so an interrupted one can simply be re-run.
+"""
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import re
+import sys
+from config import config
+from dbpool import pool
+from coordinator import coordinator, WRITER
+from db import init_db, write_decoys
+from decoy_cache import normalise_email
+
+FORMATS = ("csv", "ndjson")
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+MAX_EMAIL_LENGTH = 254
+MAX_USE_CASE_LENGTH = 200
+
+def format_for(content_type: str) -> str:
+    """Pick the input format from a Content-Type header, defaulting to CSV"""
+    content_type = (content_type or "").lower()
+    return "ndjson" if "ndjson" in content_type or "jsonl" in content_type else "csv"
+
+def valid_email(address: str) -> bool:
+    return len(address) <= MAX_EMAIL_LENGTH and EMAIL_PATTERN.match(address) is not None
+
+async def iter_lines(chunks):
+    """Split an async stream of bytes into decoded lines"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+class DecoyLoader:
+    """Validate decoy rows and upsert them in batches of batch_size.
+
+    With an owner every row is provisioned for that customer and decoys that
+    already belong to someone else are reported rather than moved. Without
+    one, rows name their own customer_email or fall back to default_customer.
+    """
+
+    def __init__(self, fmt: str, owner=None, default_customer=None, batch_size=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format: {fmt}")
+        self.fmt = fmt
+        self.owner = owner
+        self.default_customer = owner or default_customer
+        self.batch_size = batch_size or config.PROVISION_BATCH_SIZE
+        self.header = None
+        self.batch = {}
+        self._writing = None
+        self._customers = set()
+        self.report = {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0, "error_count": 0, "errors": []}
+
+    def error(self, line_number: int, message: str):
+        self.report["error_count"] += 1
+        if len(self.report["errors"]) < config.PROVISION_MAX_ERRORS:
+            self.report["errors"].append({"line": line_number, "error": message})
+
+    def parse(self, line: str):
+        """Return the line as a dict, or None for a header or blank line"""
+        if not line.strip():
+            return None
+        if self.fmt == "ndjson":
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+            return record
+        values = next(csv.reader([line]))
+        if self.header is None:
+            self.header = [name.strip().lower() for name in values]
+            if "decoy_email" not in self.header:
+                raise ValueError("CSV header must include decoy_email")
+            return None
+        return dict(zip(self.header, values))
+
+    def field(self, record: dict, name: str):
+        """A record's value for name, which NDJSON could give any JSON type"""
+        value = record.get(name)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{name} must be a string")
+        return value
+
+    def validate(self, record: dict) -> tuple:
+        decoy_email = normalise_email(self.field(record, "decoy_email"))
+        if not valid_email(decoy_email):
+            raise ValueError(f"invalid decoy_email: {record.get('decoy_email')!r}")
+        customer_email = normalise_email(self.field(record, "customer_email")) or self.default_customer
+        # A load usually names a handful of customers, so check each one once
+        if customer_email not in self._customers:
+            if not customer_email or not valid_email(customer_email):
+                raise ValueError(f"invalid customer_email: {record.get('customer_email')!r}")
+            if self.owner is not None and normalise_email(customer_email) != normalise_email(self.owner):
+                raise ValueError("customer_email must be your own account")
+            self._customers.add(customer_email)
+        # The owner's rows are stored under the address they are authenticated as
+        if self.owner is not None:
+            customer_email = self.owner
+        use_case = self.field(record, "use_case")
+        if use_case is not None:
+            use_case = use_case.strip()[:MAX_USE_CASE_LENGTH] or None
+        return decoy_email, customer_email, use_case
+
+    def add(self, line_number: int, line: str) -> bool:
+        """Queue one input line. Returns True once the batch is full."""
+        try:
+            record = self.parse(line)
+            if record is None:
+                return False
+            row = self.validate(record)
+        except ValueError as e:
+            self.error(line_number, str(e))
+            return False
+        self.report["rows"] += 1
+        # A later line for the same decoy wins
+        self.batch.pop(row[0], None)
+        self.batch[row[0]] = (line_number, row)
+        return len(self.batch) >= self.batch_size
+
+    async def _write(self, batch: dict):
+        result = await write_decoys([row for _, row in batch.values()], self.owner)
+        for key in ("inserted", "updated", "unchanged"):
+            self.report[key] += result[key]
+        for decoy_email in result["conflicts"]:
+            self.error(batch[decoy_email][0], f"{decoy_email} belongs to another customer")
+
+    async def flush(self):
+        """Start writing the current batch; the next one is parsed while it commits"""
+        await self.drain()
+        if self.batch:
+            batch, self.batch = self.batch, {}
+            self._writing = asyncio.create_task(self._write(batch))
+
+    async def drain(self):
+        if self._writing is not None:
+            writing, self._writing = self._writing, None
+            await writing
+
+    async def load(self, lines) -> dict:
+        """Provision every row from an async iterable of lines and return the report"""
+        line_number = 0
+        try:
+            async for line in lines:
+                line_number += 1
+                if self.add(line_number, line):
+                    await self.flush()
+            if self.fmt == "csv" and self.header is None and not self.report["error_count"]:
+                self.error(1, "CSV input is empty")
+            await self.flush()
+        finally:
+            await self.drain()
+        return self.report
+
+async def file_chunks(f):
+    while chunk := await asyncio.to_thread(f.read, 1024 * 1024):
+        yield chunk
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Provision decoys from a CSV or NDJSON file")
+    parser.add_argument("path", help="input file, or - for stdin")
+    parser.add_argument("--format", choices=FORMATS, help="input format (default: from the file extension)")
+    parser.add_argument("--customer", help="customer_email for rows that do not name one")
+    parser.add_argument("--batch-size", type=int, default=config.PROVISION_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    loader = DecoyLoader(fmt, default_customer=args.customer, batch_size=args.batch_size)
+    # With the server running, its writer process does the writes
+    if coordinator.claim() == WRITER:
+        await init_db()
+    try:
+        if args.path == "-":
+            report = await loader.load(iter_lines(file_chunks(sys.stdin.buffer)))
+        else:
+            with open(args.path, "rb") as f:
+                report = await loader.load(iter_lines(file_chunks(f)))
+    finally:
+        await coordinator.stop()
+        await pool.close()
+
+    print(json.dumps(report, indent=2))
+    return 1 if report["error_count"] else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,88 @@
+import asyncio
+from config import config
+
+class Subscription:
+    """One subscriber's bounded queue of events for a single tenant"""
+
+    def __init__(self, tenant: str, maxsize: int):
+        self.tenant = tenant
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.closed = False
+
+    def close(self):
+        """End the subscription; get() returns None once the queue is drained"""
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self, timeout: float):
+        """Next event, or None on timeout or when the subscription was closed"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class EventBus:
+    """In-process publish/subscribe of decoy hits, partitioned by tenant.
+
+    publish() never blocks. When a subscriber's queue is full the slow
+    consumer policy applies: drop_oldest discards its oldest queued event,
+    disconnect closes the subscription so the client reconnects and resumes
+    from the events table. relay, when set, is also called with every
+    published event; the writer process uses it to pass hits on to the
+    other server processes.
+    """
+
+    def __init__(self, queue_size: int, slow_consumer_policy: str):
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self._subscribers = {}
+        self.relay = None
+        self.published = 0
+        self.dropped = 0
+        self.disconnected = 0
+
+    def subscribe(self, tenant: str) -> Subscription:
+        subscription = Subscription(tenant, self.queue_size)
+        self._subscribers.setdefault(tenant, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.tenant)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.tenant]
+
+    def publish(self, tenant: str, event: dict):
+        self.published += 1
+        if self.relay is not None:
+            self.relay(tenant, event)
+        for subscription in list(self._subscribers.get(tenant, ())):
+            if subscription.closed:
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                if self.slow_consumer_policy == "disconnect":
+                    subscription.close()
+                    self.unsubscribe(subscription)
+                    self.disconnected += 1
+                else:
+                    subscription.queue.get_nowait()
+                    subscription.queue.put_nowait(event)
+                    subscription.dropped += 1
+                    self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "tenants": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+            "disconnected": self.disconnected,
+        }
+
+event_bus = EventBus(config.PUBSUB_QUEUE_SIZE, config.PUBSUB_SLOW_CONSUMER_POLICY)
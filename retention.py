@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from config import config
+from dbpool import pool
+
+logger = logging.getLogger(__name__)
+
+# Columns moved from events to an archive table, in order
+ARCHIVE_COLUMNS = ("id, decoy_email, sender_email, sender_ip, subject, created_at, geo, eml_hash, message_key, "
+                   "customer_email")
+
+# Archive months that may hold rows in [since, until], newest first
+ARCHIVES_QUERY = """
+    SELECT month, max_created_at FROM event_archives
+    WHERE max_created_at >= ? AND min_created_at <= ?
+    ORDER BY month DESC
+"""
+
+ARCHIVE_FOR_ID_QUERY = "SELECT month FROM event_archives WHERE min_id <= ? AND max_id >= ? ORDER BY month DESC"
+
+def archive_table(month: str) -> str:
+    """Archive table for a YYYY-MM month, e.g. events_archive_2025_01"""
+    year, number = month.split("-")
+    return f"events_archive_{int(year):04d}_{int(number):02d}"
+
+def hot_windows(spec: str) -> dict:
+    """Parse "tenant@example.com=30,other@example.com=365" into {tenant: days}"""
+    windows = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        tenant, _, days = item.rpartition("=")
+        windows[tenant.strip().lower()] = int(days)
+    return windows
+
+async def archive_partitions(db, since=None, until=None) -> list:
+    """(table, max_created_at) of the archive months overlapping [since, until], newest first"""
+    async with db.execute(ARCHIVES_QUERY, (since or "", until or "9999")) as cursor:
+        return [(archive_table(month), max_created_at) for month, max_created_at in await cursor.fetchall()]
+
+async def archive_tables(db) -> list:
+    async with db.execute("SELECT month FROM event_archives ORDER BY month") as cursor:
+        return [archive_table(month) for (month,) in await cursor.fetchall()]
+
+async def create_archive(db, month: str) -> str:
+    table = archive_table(month)
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            decoy_email TEXT,
+            sender_email TEXT,
+            sender_ip TEXT,
+            subject TEXT,
+            created_at TEXT,
+            geo TEXT,
+            eml_hash TEXT,
+            message_key TEXT,
+            customer_email TEXT
+        )
+    """)
+    # Archives are read a month and a tenant at a time, newest first; filters walk that range
+    await db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_tenant_created_at ON {table} (customer_email, created_at)")
+    return table
+
+class EventArchiver:
+    """Moves events out of the hot events table once they are older than their tenant's hot window.
+
+    Each tenant keeps hot_days of events in events (overrides per tenant
+    in windows); older rows move to one table per month,
+    events_archive_YYYY_MM, which keeps the event ids and carries a single
+    index. event_archives records each month's row count and its id and
+    created_at bounds, so readers only open the months a request needs.
+    Rows move batch_size at a time, each batch in its own short write
+    transaction with a pause between batches, so webhook writes queued
+    behind the writer lock wait for one batch at most. With
+    retention_months, whole months older than that are dropped, releasing
+    their .eml references for the blob sweep.
+    """
+
+    def __init__(self, hot_days: int, windows: dict, retention_months: int, batch_size: int, pause: float,
+                 interval: float):
+        self.hot_days = hot_days
+        self.windows = windows
+        self.retention_months = retention_months
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self._task = None
+        self.archived = 0
+        self.batches = 0
+        self.dropped_months = 0
+        self.longest_batch_seconds = 0.0
+
+    def cutoff(self, tenant: str, now: datetime) -> str:
+        """Events of tenant created before this belong in the archive"""
+        return (now - timedelta(days=self.windows.get(tenant.lower(), self.hot_days))).isoformat()
+
+    async def _archive_batch(self, tenant: str, cutoff: str) -> int:
+        started = asyncio.get_running_loop().time()
+        async with pool.writer() as db:
+            async with db.execute("""
+                SELECT id, created_at FROM events
+                WHERE customer_email = ? AND created_at < ?
+                ORDER BY created_at
+                LIMIT ?
+            """, (tenant, cutoff, self.batch_size)) as cursor:
+                rows = await cursor.fetchall()
+            if not rows:
+                return 0
+            months = {}
+            for event_id, created_at in rows:
+                months.setdefault(created_at[:7], []).append(event_id)
+            for month, ids in months.items():
+                table = await create_archive(db, month)
+                await db.execute(f"""
+                    INSERT INTO {table} ({ARCHIVE_COLUMNS})
+                    SELECT {ARCHIVE_COLUMNS} FROM events WHERE id IN (SELECT value FROM json_each(?))
+                """, (json.dumps(ids),))
+                created = [created_at for event_id, created_at in rows if created_at[:7] == month]
+                await db.execute("""
+                    INSERT INTO event_archives (month, rows, min_id, max_id, min_created_at, max_created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (month) DO UPDATE SET
+                        rows = rows + excluded.rows,
+                        min_id = MIN(min_id, excluded.min_id),
+                        max_id = MAX(max_id, excluded.max_id),
+                        min_created_at = MIN(min_created_at, excluded.min_created_at),
+                        max_created_at = MAX(max_created_at, excluded.max_created_at)
+                """, (month, len(ids), min(ids), max(ids), min(created), max(created)))
+            await db.execute("DELETE FROM events WHERE id IN (SELECT value FROM json_each(?))",
+                             (json.dumps([event_id for event_id, _ in rows]),))
+        self.longest_batch_seconds = max(self.longest_batch_seconds, asyncio.get_running_loop().time() - started)
+        self.batches += 1
+        return len(rows)
+
+    async def _drop_expired_months(self, now: datetime) -> int:
+        if not self.retention_months:
+            return 0
+        year, month = now.year, now.month - self.retention_months
+        while month < 1:
+            year, month = year - 1, month + 12
+        oldest_kept = f"{year:04d}-{month:02d}"
+        async with pool.reader() as db:
+            async with db.execute("SELECT month FROM event_archives WHERE month < ?", (oldest_kept,)) as cursor:
+                expired = [row[0] for row in await cursor.fetchall()]
+        for month in expired:
+            table = archive_table(month)
+            async with pool.writer() as db:
+                await db.execute(f"""
+                    UPDATE blobs SET refcount = refcount - r.n
+                    FROM (SELECT eml_hash, COUNT(*) AS n FROM {table} WHERE eml_hash IS NOT NULL GROUP BY eml_hash) r
+                    WHERE blobs.hash = r.eml_hash
+                """)
+                await db.execute(f"DROP TABLE {table}")
+                await db.execute("DELETE FROM event_archives WHERE month = ?", (month,))
+            self.dropped_months += 1
+        return len(expired)
+
+    async def compact(self) -> dict:
+        """Archive every tenant's events past its hot window, then drop months past retention"""
+        now = datetime.utcnow()
+        async with pool.reader() as db:
+            async with db.execute("SELECT customer_email FROM customer_stats") as cursor:
+                tenants = [row[0] for row in await cursor.fetchall()]
+        archived = 0
+        for tenant in tenants:
+            cutoff = self.cutoff(tenant, now)
+            while True:
+                moved = await self._archive_batch(tenant, cutoff)
+                archived += moved
+                if moved < self.batch_size:
+                    break
+                # Let queued webhook writes have the writer between batches
+                await asyncio.sleep(self.pause)
+        self.archived += archived
+        return {"archived": archived, "dropped_months": await self._drop_expired_months(now)}
+
+    async def _run_compactions(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                result = await self.compact()
+                logger.info("Event compaction finished", extra=result)
+            except Exception:
+                logger.exception("Event compaction failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_compactions())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "hot_days": self.hot_days,
+            "tenant_windows": len(self.windows),
+            "archived": self.archived,
+            "batches": self.batches,
+            "dropped_months": self.dropped_months,
+            "longest_batch_ms": round(self.longest_batch_seconds * 1000, 2),
+        }
+
+event_archiver = EventArchiver(
+    config.EVENTS_HOT_DAYS,
+    hot_windows(config.EVENTS_HOT_DAYS_BY_TENANT),
+    config.EVENTS_ARCHIVE_RETENTION_MONTHS,
+    config.EVENTS_ARCHIVE_BATCH_SIZE,
+    config.EVENTS_ARCHIVE_PAUSE_SECONDS,
+    config.EVENTS_ARCHIVE_INTERVAL_SECONDS,
+)
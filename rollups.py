@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import heapq
+import json
+import logging
+from array import array
+from datetime import datetime, timedelta
+from config import config
+from coordinator import forwarded
+from dbpool import pool
+from geo import UNKNOWN_LOCATION
+
+logger = logging.getLogger(__name__)
+
+# Heavy-hitter dimension -> events column it counts
+DIMENSIONS = {"sender": "sender_email", "ip": "sender_ip", "location": "geo", "decoy": "decoy_email"}
+
+# Positions of those columns in an event writer row
+_ROW_INDEX = {"decoy": 0, "sender": 3, "ip": 4, "location": 6}
+
+COUNT_BUCKET_HITS = """
+    INSERT INTO event_buckets (customer_email, granularity, start, hits) VALUES (?, ?, ?, ?)
+    ON CONFLICT (customer_email, granularity, start) DO UPDATE SET hits = hits + excluded.hits
+"""
+
+def hour_start(created_at: str) -> str:
+    return created_at[:13] + ":00:00"
+
+def day_start(created_at: str) -> str:
+    return created_at[:10]
+
+def month_start(created_at: str) -> str:
+    return created_at[:7]
+
+def bucket_counts(rows) -> list:
+    """COUNT_BUCKET_HITS parameters for a batch of event writer rows"""
+    counts = {}
+    for row in rows:
+        tenant, created_at = row[1], row[-1]
+        for key in ((tenant, "hour", hour_start(created_at)), (tenant, "day", day_start(created_at))):
+            counts[key] = counts.get(key, 0) + 1
+    return [(*key, hits) for key, hits in counts.items()]
+
+class TopK:
+    """Approximate k most frequent values: Count-Min sketch counts plus a min-heap of candidates.
+
+    Estimates never undercount and overcount by at most e/width of the
+    total added, with probability 1 - exp(-depth).
+    """
+
+    def __init__(self, k: int, width: int, depth: int, counts: bytes = None, top: dict = None):
+        self.k = k
+        self.width = width
+        self.depth = depth
+        self.counts = array("I")
+        if counts:
+            self.counts.frombytes(counts)
+        else:
+            self.counts.extend([0] * (width * depth))
+        self.top = dict(top or {})
+        # (estimate, value) entries; stale ones are skipped when popped
+        self._heap = [(estimate, value) for value, estimate in self.top.items()]
+        heapq.heapify(self._heap)
+
+    def _cells(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=4 * self.depth).digest()
+        return [row * self.width + int.from_bytes(digest[4 * row:4 * row + 4], "little") % self.width
+                for row in range(self.depth)]
+
+    def add(self, value: str, n: int = 1):
+        counts = self.counts
+        estimate = None
+        for cell in self._cells(value):
+            counts[cell] += n
+            if estimate is None or counts[cell] < estimate:
+                estimate = counts[cell]
+
+        top = self.top
+        if value in top or len(top) < self.k:
+            top[value] = estimate
+            heapq.heappush(self._heap, (estimate, value))
+        else:
+            smallest, smallest_value = self._min()
+            if estimate > smallest:
+                del top[smallest_value]
+                heapq.heappop(self._heap)
+                top[value] = estimate
+                heapq.heappush(self._heap, (estimate, value))
+        if len(self._heap) > 4 * self.k:
+            self._heap = [(estimate, value) for value, estimate in top.items()]
+            heapq.heapify(self._heap)
+
+    def _min(self):
+        heap, top = self._heap, self.top
+        while heap[0][1] not in top or top[heap[0][1]] != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0]
+
+class EventRollup:
+    """Per-tenant heavy hitters for each of DIMENSIONS by day and by month, fed by the event writer.
+
+    Hits are bucketed by hour and day in event_buckets inside the event
+    writer's transaction, so trends are exact. Top senders, IPs, locations
+    and decoys are approximate: each open (tenant, period, dimension) has a
+    TopK sketch in memory, where a period is a day (2025-01-31) or a month
+    (2025-01). Every checkpoint_interval seconds the changed ones are saved
+    to rollup_sketches, and their top values to heavy_hitters, which is what
+    /api/stats reads, with the sketches changed since taken from memory; a
+    long range reads whole months plus the days at its edges. Events are dated when they are processed, so only today,
+    yesterday and their months stay open; older periods are dropped from
+    memory once saved. Both tables keep hits under the tenant that owned
+    the decoy when the hit arrived.
+    """
+
+    def __init__(self, k: int, width: int, depth: int, checkpoint_interval: float):
+        self.k = k
+        self.width = width
+        self.depth = depth
+        self.checkpoint_interval = checkpoint_interval
+        self._sketches = {}
+        self._dirty = set()
+        self._saving = set()
+        self._task = None
+
+    def _sketch(self, key) -> TopK:
+        sketch = self._sketches.get(key)
+        if sketch is None:
+            sketch = self._sketches[key] = TopK(self.k, self.width, self.depth)
+        return sketch
+
+    def add(self, rows):
+        """Count committed event writer rows"""
+        for row in rows:
+            tenant, periods = row[1], (day_start(row[-1]), month_start(row[-1]))
+            for dimension, index in _ROW_INDEX.items():
+                value = row[index]
+                if value and value != UNKNOWN_LOCATION:
+                    for period in periods:
+                        key = (tenant, period, dimension)
+                        self._sketch(key).add(value)
+                        self._dirty.add(key)
+
+    def unsaved_top(self, customer_email: str, periods) -> list:
+        """[period, dimension, value, hits] from the tenant's sketches not yet in heavy_hitters"""
+        periods = set(periods)
+        return [[period, dimension, value, hits]
+                for tenant, period, dimension in self._dirty | self._saving
+                if tenant == customer_email and period in periods
+                for value, hits in self._sketches[tenant, period, dimension].top.items()]
+
+    def _open_periods(self) -> set:
+        today = datetime.utcnow().date()
+        yesterday = today - timedelta(days=1)
+        return {today.isoformat(), yesterday.isoformat(), today.isoformat()[:7], yesterday.isoformat()[:7]}
+
+    async def load(self):
+        """Resume the open periods' sketches from the last checkpoint"""
+        self._sketches.clear()
+        self._dirty.clear()
+        open_periods = json.dumps(sorted(self._open_periods()))
+        async with pool.reader() as db:
+            async with db.execute("""
+                SELECT customer_email, period, dimension, counts, top FROM rollup_sketches
+                WHERE period IN (SELECT value FROM json_each(?))
+            """, (open_periods,)) as cursor:
+                for tenant, period, dimension, counts, top in await cursor.fetchall():
+                    if len(counts) == 4 * self.width * self.depth:
+                        self._sketches[tenant, period, dimension] = TopK(
+                            self.k, self.width, self.depth, counts, json.loads(top)
+                        )
+            # Periods counted before there was a sketch (the rollup backfill) start from their saved top values
+            loaded = set(self._sketches)
+            async with db.execute("""
+                SELECT customer_email, period, dimension, value, hits FROM heavy_hitters
+                WHERE period IN (SELECT value FROM json_each(?))
+            """, (open_periods,)) as cursor:
+                for tenant, period, dimension, value, hits in await cursor.fetchall():
+                    if (tenant, period, dimension) not in loaded:
+                        self._sketch((tenant, period, dimension)).add(value, hits)
+        return len(self._sketches)
+
+    async def checkpoint(self):
+        """Save changed sketches and their top values, then forget closed periods"""
+        dirty, self._dirty = self._dirty, set()
+        if dirty:
+            self._saving = dirty
+            try:
+                async with pool.writer() as db:
+                    await db.executemany("""
+                        INSERT INTO rollup_sketches (customer_email, period, dimension, counts, top)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (customer_email, period, dimension) DO UPDATE SET
+                            counts = excluded.counts, top = excluded.top
+                    """, [(*key, self._sketches[key].counts.tobytes(), json.dumps(self._sketches[key].top))
+                          for key in dirty])
+                    await db.executemany("""
+                        DELETE FROM heavy_hitters WHERE customer_email = ? AND period = ? AND dimension = ?
+                    """, list(dirty))
+                    await db.executemany("""
+                        INSERT INTO heavy_hitters (customer_email, period, dimension, value, hits) VALUES (?, ?, ?, ?, ?)
+                    """, [(*key, value, hits) for key in dirty for value, hits in self._sketches[key].top.items()])
+            except BaseException:
+                self._dirty |= dirty
+                raise
+            finally:
+                self._saving = set()
+
+        open_periods = self._open_periods()
+        closed = [key for key in self._sketches if key[1] not in open_periods and key not in self._dirty]
+        if closed:
+            for key in closed:
+                del self._sketches[key]
+            async with pool.writer() as db:
+                await db.execute("DELETE FROM rollup_sketches WHERE period NOT IN (SELECT value FROM json_each(?))",
+                                 (json.dumps(sorted(open_periods)),))
+        return len(dirty)
+
+    async def _run_checkpoints(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.checkpoint()
+            except Exception:
+                logger.exception("Rollup checkpoint failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_checkpoints())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.checkpoint()
+
+    def stats(self) -> dict:
+        return {"open_sketches": len(self._sketches), "unsaved": len(self._dirty),
+                "sketch_bytes": 4 * self.width * self.depth}
+
+event_rollup = EventRollup(
+    config.STATS_TOP_K_TRACKED,
+    config.STATS_SKETCH_WIDTH,
+    config.STATS_SKETCH_DEPTH,
+    config.STATS_CHECKPOINT_SECONDS,
+)
+
+@forwarded
+async def unsaved_top(customer_email: str, periods: list) -> list:
+    """The writer's unsaved top values for a tenant, which only it counts"""
+    return event_rollup.unsaved_top(customer_email, periods)
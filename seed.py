@@ -1,5 +1,5 @@
-import asyncio
 from db import insert_decoy
+from dbpool import run_script
 
 async def seed():
     await insert_decoy(
@@ -8,4 +8,4 @@ async def seed():
         "Leak Alert from Email Decoys"
     )
 
-asyncio.run(seed())
+run_script(seed())
@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Settings are read once at import, so point the app at a scratch directory before anything imports config
+_workdir = tempfile.mkdtemp(prefix="honeypot-tests-")
+os.environ.setdefault("DATABASE_PATH", os.path.join(_workdir, "tests.db"))
+os.environ.setdefault("BLOB_DIR", os.path.join(_workdir, "blobs"))
+os.environ.setdefault("EXPORT_DIR", os.path.join(_workdir, "exports"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("JOB_POLL_INTERVAL_SECONDS", "0.05")
+os.environ.setdefault("OPS_TOKEN", "test-ops-token")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope="session")
+def client():
+    """The app with its startup run, shared by the tests that go through HTTP"""
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture
+def tenant_headers():
+    from auth import create_access_token
+
+    return {"Authorization": f"Bearer {create_access_token({'sub': 'tenant@example.com'})}"}
+
+@pytest.fixture
+def ops_headers():
+    return {"Authorization": f"Bearer {os.environ['OPS_TOKEN']}"}
@@ -0,0 +1,102 @@
+import asyncio
+from json import loads
+
+import alerts
+
+class FakeSendGrid:
+    def __init__(self, statuses=()):
+        self.messages = []
+        self.statuses = list(statuses)
+
+    async def post(self, path, json=None, content=None, **kwargs):
+        if content is not None:
+            json = loads(b"".join([chunk async for chunk in content]))
+        self.messages.append(json)
+
+        class Response:
+            status_code = self.statuses.pop(0) if self.statuses else 202
+            text = ""
+            headers = {}
+        return Response()
+
+def digest_alerts(customer_email, count):
+    return [{"customer_email": customer_email, "created_at": "2025-01-31T12:00:00",
+             "decoy_email": f"decoy{i}@decoys.example", "sender": f"attacker{i}@example.net",
+             "ip": "198.51.100.7", "geo": "Paris, France", "subject": f"Invoice {i} overdue"}
+            for i in range(count)]
+
+def test_oversized_digest_is_sent_as_content_without_substitutions(monkeypatch):
+    sendgrid = FakeSendGrid()
+    monkeypatch.setattr(alerts, "get_client", lambda name: sendgrid)
+    batch = digest_alerts("big@example.com", 200)
+    text = alerts.digest_text(batch)
+    assert len(text.encode()) > alerts.MAX_SUBSTITUTION_BYTES
+
+    asyncio.run(alerts.send_digest("big@example.com", batch, text))
+
+    (message,) = sendgrid.messages
+    (personalization,) = message["personalizations"]
+    assert personalization["to"] == [{"email": "big@example.com"}]
+    assert "substitutions" not in personalization
+    assert message["content"] == [{"type": "text/plain", "value": text}]
+
+def test_dispatch_sends_oversized_digests_alone(monkeypatch):
+    sendgrid = FakeSendGrid()
+    monkeypatch.setattr(alerts, "get_client", lambda name: sendgrid)
+    claimed = digest_alerts("big@example.com", 200) + digest_alerts("small@example.com", 2)
+    for i, alert in enumerate(claimed):
+        alert.update(id=i, attempts=1, correlation_id=None)
+
+    async def claim_alerts(window_seconds, max_customers):
+        return claimed
+
+    async def finish_alerts(alert_ids, status, error=None, next_attempt_at=None):
+        finished.append((sorted(alert_ids), status))
+
+    finished = []
+    monkeypatch.setattr(alerts, "claim_alerts", claim_alerts)
+    monkeypatch.setattr(alerts, "finish_alerts", finish_alerts)
+    dispatcher = alerts.AlertDispatcher()
+    monkeypatch.setattr(dispatcher.bucket, "acquire", lambda: asyncio.sleep(0))
+
+    assert asyncio.run(dispatcher.dispatch_once())
+
+    big, small = sendgrid.messages
+    assert "substitutions" not in big["personalizations"][0]
+    assert big["content"][0]["value"].startswith("Heads up — your decoys received 200 messages.")
+    assert small["personalizations"][0]["substitutions"][alerts.DIGEST_TOKEN].startswith(
+        "Heads up — your decoys received 2 messages.")
+    assert [status for _, status in finished] == ["delivered", "delivered"]
+
+def test_alert_refused_with_its_attachment_is_resent_without_it(monkeypatch, tmp_path):
+    sendgrid = FakeSendGrid([413])
+    monkeypatch.setattr(alerts, "get_client", lambda name: sendgrid)
+    blob = tmp_path / "blob.z"
+    blob.write_bytes(b"")
+    monkeypatch.setattr(alerts.blob_store, "path_for", lambda digest: str(blob))
+
+    async def iter_blob(digest):
+        yield b"From: attacker@example.net\r\n\r\nHuge."
+    monkeypatch.setattr(alerts.blob_store, "iter_blob", iter_blob)
+
+    alert = digest_alerts("single@example.com", 1)[0]
+    alert.update(id=7, attempts=1, correlation_id=None, eml_hash="ab" * 32, eml_size=36, body_preview="Huge.")
+
+    async def claim_alerts(window_seconds, max_customers):
+        return [alert]
+
+    async def finish_alerts(alert_ids, status, error=None, next_attempt_at=None):
+        finished.append((alert_ids, status))
+
+    finished = []
+    monkeypatch.setattr(alerts, "claim_alerts", claim_alerts)
+    monkeypatch.setattr(alerts, "finish_alerts", finish_alerts)
+    dispatcher = alerts.AlertDispatcher()
+    monkeypatch.setattr(dispatcher.bucket, "acquire", lambda: asyncio.sleep(0))
+
+    assert asyncio.run(dispatcher.dispatch_once())
+
+    with_attachment, without = sendgrid.messages
+    assert "attachments" in with_attachment
+    assert "attachments" not in without
+    assert finished == [([7], "delivered")]
@@ -0,0 +1,34 @@
+import io
+import os
+import sqlite3
+
+def read_blob(client, digest):
+    from blobstore import blob_store
+
+    async def read():
+        return b"".join([chunk async for chunk in blob_store.iter_blob(digest)])
+    return client.portal.call(read)
+
+def test_put_rewrites_a_blob_swept_after_its_existence_check(client, monkeypatch):
+    import blobstore
+    from blobstore import blob_store
+
+    payload = b"From: attacker@example.net\r\nSubject: swept\r\n\r\nSame payload twice.\r\n"
+    digest = client.portal.call(blob_store.put, io.BytesIO(payload))
+    path = blob_store.path_for(digest)
+
+    # A sweep that collects the unreferenced blob between put()'s check and its upsert
+    getsize = os.path.getsize
+    def swept(file_path):
+        size = getsize(file_path)
+        conn = sqlite3.connect(os.environ["DATABASE_PATH"])
+        with conn:
+            conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+        conn.close()
+        os.unlink(path)
+        return size
+    monkeypatch.setattr(blobstore.os.path, "getsize", swept)
+
+    assert client.portal.call(blob_store.put, io.BytesIO(payload)) == digest
+    assert os.path.exists(path)
+    assert read_blob(client, digest) == payload
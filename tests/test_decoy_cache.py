@@ -0,0 +1,51 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import decoy_cache
+from decoy_cache import DecoyCache
+
+class Cursor:
+    def __init__(self, row):
+        self.row = row
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def fetchone(self):
+        return self.row
+
+class ReadDuringWrite:
+    """A reader whose SELECT sees the decoys table just before a provisioning commit lands"""
+
+    def __init__(self, cache, decoy_email):
+        self.cache = cache
+        self.decoy_email = decoy_email
+        self.selects = 0
+
+    def execute(self, query, params=()):
+        if "meta" in query:
+            return Cursor((0,))
+        self.selects += 1
+        if self.selects == 1:
+            self.cache.invalidate(self.decoy_email)
+            return Cursor(None)
+        return Cursor(("tenant@example.com", "sales"))
+
+    @asynccontextmanager
+    async def reader(self):
+        yield self
+
+def test_miss_racing_an_invalidation_is_not_cached(monkeypatch):
+    cache = DecoyCache(100, 300, 300)
+    cache.generation = 0
+    database = ReadDuringWrite(cache, "new@decoys.example")
+    monkeypatch.setattr(decoy_cache, "pool", database)
+
+    async def lookups():
+        return await cache.get("new@decoys.example"), await cache.get("new@decoys.example")
+
+    assert asyncio.run(lookups()) == (None, ("tenant@example.com", "sales"))
+    assert database.selects == 2
@@ -0,0 +1,56 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+HIT = {"recipient": "redelivered@decoys.example", "sender": "attacker@example.net", "subject": "Invoice overdue",
+       "body-plain": "Please pay.", "X-Mailgun-Incoming-IP": "10.0.0.7"}
+
+def wait_for(check, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.02)
+    return False
+
+@pytest.fixture
+def database():
+    conn = sqlite3.connect(os.environ["DATABASE_PATH"])
+    yield conn
+    conn.close()
+
+def jobs_submitted(conn):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'jobs'").fetchone()
+    return row[0] if row else 0
+
+def stored(conn, message_id):
+    events = conn.execute("SELECT id FROM events WHERE decoy_email = ? AND subject = ?",
+                          (HIT["recipient"], message_id)).fetchall()
+    alerts = conn.execute("SELECT COUNT(*) FROM alerts WHERE event_id IN (SELECT value FROM json_each(?))",
+                          (str([event_id for (event_id,) in events]),)).fetchone()[0]
+    return len(events), alerts
+
+@pytest.mark.parametrize("after_processing", [False, True])
+def test_redelivered_message_id_is_dropped(client, database, after_processing):
+    import db
+
+    client.portal.call(db.insert_decoy, HIT["recipient"], "tenant@example.com", "test")
+    message_id = f"<redelivery-{after_processing}@mailgun.example>"
+    hit = dict(HIT, subject=message_id, **{"Message-Id": message_id})
+
+    first = client.post("/webhook/inbound", data=hit)
+    assert first.json() == {"status": "ok"}
+    if after_processing:
+        assert wait_for(lambda: stored(database, message_id) == (1, 1))
+    submitted = jobs_submitted(database)
+
+    second = client.post("/webhook/inbound", data=hit)
+    assert second.status_code == 200
+    assert second.json() == {"status": "duplicate"}
+    assert jobs_submitted(database) == submitted
+
+    assert wait_for(lambda: stored(database, message_id) == (1, 1))
+    time.sleep(0.2)
+    assert stored(database, message_id) == (1, 1)
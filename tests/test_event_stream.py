@@ -0,0 +1,30 @@
+import os
+import sqlite3
+
+class Disconnected:
+    """A request whose client has gone, so the stream ends after replaying"""
+
+    async def is_disconnected(self):
+        return True
+
+def test_replay_continues_past_the_replay_limit(client, monkeypatch):
+    from api.events import stream_events
+    from config import config
+
+    tenant = "replay@example.com"
+    conn = sqlite3.connect(os.environ["DATABASE_PATH"])
+    with conn:
+        last_seen = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        conn.executemany("INSERT INTO events (decoy_email, customer_email, subject, created_at) VALUES (?, ?, ?, ?)",
+                         [("replayed@decoys.example", tenant, f"hit {i}", "2025-01-31T12:00:00") for i in range(5)])
+        ids = [row[0] for row in conn.execute("SELECT id FROM events WHERE customer_email = ? AND id > ? ORDER BY id",
+                                              (tenant, last_seen))]
+    conn.close()
+    monkeypatch.setattr(config, "SSE_REPLAY_LIMIT", 2)
+
+    async def replay():
+        response = await stream_events(Disconnected(), str(last_seen), tenant)
+        return [message async for message in response.body_iterator]
+
+    messages = client.portal.call(replay)
+    assert [int(message.split("\n")[0][len("id: "):]) for message in messages] == ids
@@ -0,0 +1,33 @@
+import asyncio
+
+import aiosqlite
+
+import db
+
+async def migrate_early_decoys(path):
+    async with aiosqlite.connect(path) as conn:
+        await db.create_schema(conn)
+        await conn.executemany("INSERT INTO decoys VALUES (?, ?, ?, ?)", [
+            ("John@X.com", "cust@x.com", "uc", "2024-01-01"),
+            (" Mary@x.com", "cust@x.com", "uc", "2024-01-01"),
+            ("mary@x.com", "other@x.com", "uc", "2024-02-01"),
+        ])
+        await conn.executemany("INSERT INTO decoy_stats VALUES (?, ?, ?)",
+                               [("John@X.com", 3, "2024-05-01"), (" Mary@x.com", 2, None), ("mary@x.com", 1, None)])
+        await conn.executemany("INSERT INTO customer_stats VALUES (?, ?, ?)",
+                               [("cust@x.com", 2, 5), ("other@x.com", 1, 1)])
+        await conn.execute("INSERT INTO events (decoy_email, customer_email) VALUES ('John@X.com', 'cust@x.com')")
+        await db.normalise_decoy_emails(conn)
+        results = {}
+        for table in ("decoys", "decoy_stats", "customer_stats", "events"):
+            async with conn.execute(f"SELECT * FROM {table} ORDER BY 1") as cursor:
+                results[table] = await cursor.fetchall()
+        return results
+
+def test_decoy_emails_are_normalised_and_collisions_merged(tmp_path):
+    results = asyncio.run(migrate_early_decoys(str(tmp_path / "early.db")))
+
+    assert [row[:2] for row in results["decoys"]] == [("john@x.com", "cust@x.com"), ("mary@x.com", "other@x.com")]
+    assert results["decoy_stats"] == [("john@x.com", 3, "2024-05-01"), ("mary@x.com", 3, None)]
+    assert results["customer_stats"] == [("cust@x.com", 1, 5), ("other@x.com", 1, 1)]
+    assert results["events"][0][1] == "john@x.com"
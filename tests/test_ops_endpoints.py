@@ -0,0 +1,15 @@
+import pytest
+
+OPS_ENDPOINTS = ["/api/queue", "/api/stats/cache", "/metrics"]
+
+@pytest.mark.parametrize("path", OPS_ENDPOINTS)
+def test_tenants_cannot_read_operational_endpoints(client, tenant_headers, path):
+    assert client.get(path, headers=tenant_headers).status_code == 403
+
+@pytest.mark.parametrize("path", OPS_ENDPOINTS)
+def test_operational_endpoints_need_credentials(client, path):
+    assert client.get(path).status_code == 401
+
+@pytest.mark.parametrize("path", OPS_ENDPOINTS)
+def test_operators_can_read_operational_endpoints(client, ops_headers, path):
+    assert client.get(path, headers=ops_headers).status_code == 200
@@ -0,0 +1,28 @@
+import pytest
+
+from api.pagination import encode_cursor
+
+@pytest.mark.parametrize("path, cursor", [
+    ("/api/events", [{"a": 1}, 2]),
+    ("/api/events", ["2025-01-31T12:00:00", "10"]),
+    ("/api/events", ["2025-01-31T12:00:00", True]),
+    ("/api/events", [None, 10]),
+    ("/api/decoys", ["2025-01-31T12:00:00", ["d@decoys.example"]]),
+    ("/api/decoys", ["2025-01-31T12:00:00"]),
+])
+def test_malformed_cursor_is_refused(client, tenant_headers, path, cursor):
+    response = client.get(path, params={"cursor": encode_cursor(cursor)}, headers=tenant_headers)
+    assert response.status_code == 400
+
+def test_well_formed_cursor_is_accepted(client, tenant_headers):
+    cursor = encode_cursor(["2025-01-31T12:00:00", 10])
+    assert client.get("/api/events", params={"cursor": cursor}, headers=tenant_headers).status_code == 200
+
+@pytest.mark.parametrize("params", [{"since": "yesterday"}, {"until": "2025-13-01"}])
+def test_unparseable_range_is_refused(client, tenant_headers, params):
+    assert client.get("/api/events", params=params, headers=tenant_headers).status_code == 400
+
+def test_range_with_offset_is_accepted(client, tenant_headers):
+    response = client.get("/api/events", params={"since": "2025-01-01T00:00:00+02:00", "until": "2025-02-01"},
+                          headers=tenant_headers)
+    assert response.status_code == 200
@@ -0,0 +1,27 @@
+import json
+
+def bulk(client, headers, lines, fmt="ndjson"):
+    body = "\n".join(json.dumps(line) if fmt == "ndjson" else line for line in lines)
+    return client.post(f"/api/decoys/bulk?format={fmt}", headers=headers, content=body)
+
+def decoys(client, headers):
+    return {decoy["decoy_email"] for decoy in client.get("/api/decoys?limit=500", headers=headers).json()}
+
+def test_non_string_fields_are_reported_and_the_rest_load(client, tenant_headers):
+    response = bulk(client, tenant_headers, [
+        {"decoy_email": 123},
+        {"decoy_email": "typed-ok@decoys.example"},
+        {"decoy_email": "typed-list@decoys.example", "use_case": ["sales"]},
+        {"decoy_email": "typed-customer@decoys.example", "customer_email": {"a": 1}},
+    ])
+    assert response.status_code == 200
+    report = response.json()
+    assert report["inserted"] == 1
+    assert [error["line"] for error in report["errors"]] == [1, 3, 4]
+    assert "typed-ok@decoys.example" in decoys(client, tenant_headers)
+
+def test_customer_email_matches_the_owner_in_any_case(client, tenant_headers):
+    response = bulk(client, tenant_headers, ["decoy_email,customer_email", "mixed-case@decoys.example, Tenant@Example.com "],
+                    fmt="csv")
+    assert response.json()["errors"] == []
+    assert "mixed-case@decoys.example" in decoys(client, tenant_headers)
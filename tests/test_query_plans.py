@@ -0,0 +1,58 @@
+import asyncio
+import os
+import sys
+
+import aiosqlite
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+
+import query_plans
+from db import create_schema
+from retention import create_archive
+
+# The index each keyset or tenant query is written for
+INTENDED_INDEXES = {
+    "/api/decoys": ["idx_decoys_tenant_created_at"],
+    "/api/decoys next page": ["idx_decoys_tenant_created_at"],
+    "/api/events": ["idx_events_tenant_created_at"],
+    "/api/events next page": ["idx_events_tenant_created_at"],
+    "/api/events by decoy": ["idx_events_tenant_decoy"],
+    "/api/events by sender": ["idx_events_tenant_sender"],
+    "/api/events by ip": ["idx_events_tenant_ip"],
+    "/api/events with archives": ["idx_events_tenant_created_at", "idx_events_archive_2025_01_tenant_created_at",
+                                  "idx_events_archive_2024_12_tenant_created_at"],
+    "/api/events/stream replay": ["idx_events_tenant_id"],
+    "/api/stats industries": ["idx_decoys_tenant_use_case"],
+    "/api/export": ["idx_decoys_tenant_created_at"],
+    "/api/export next chunk": ["idx_decoys_tenant_created_at"],
+    "webhook duplicate check": ["idx_events_message_key"],
+    "event writer duplicate check": ["idx_events_message_key"],
+}
+
+async def explain_all(path):
+    async with aiosqlite.connect(path) as db:
+        await create_schema(db)
+        for table in query_plans.PARTITIONS[1:]:
+            await create_archive(db, table[-7:].replace("_", "-"))
+        plans = {}
+        for name, (query, params) in query_plans.dashboard_queries().items():
+            params = list(params) + [1] * (query.count("?") - len(params))
+            async with db.execute(f"EXPLAIN QUERY PLAN {query}", params) as cursor:
+                plans[name] = [row[3] for row in await cursor.fetchall()]
+        return plans
+
+@pytest.fixture(scope="module")
+def plans(tmp_path_factory):
+    return asyncio.run(explain_all(str(tmp_path_factory.mktemp("plans") / "plans.db")))
+
+def test_no_query_scans_a_table_or_sorts_outside_an_index(plans):
+    scans = {name: details for name, details in plans.items()
+             if any(query_plans.FULL_SCAN.match(detail) for detail in details)}
+    assert scans == {}
+
+@pytest.mark.parametrize("name", INTENDED_INDEXES)
+def test_query_uses_its_index(plans, name):
+    used = " ".join(plans[name])
+    for index in INTENDED_INDEXES[name]:
+        assert f"INDEX {index} (" in used, plans[name]
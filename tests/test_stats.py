@@ -0,0 +1,32 @@
+import os
+import sqlite3
+import time
+
+def test_top_lists_include_hits_not_yet_checkpointed(client, tenant_headers):
+    import db
+    from rollups import event_rollup
+
+    decoy = "stats-live@decoys.example"
+    client.portal.call(db.insert_decoy, decoy, "tenant@example.com", "test")
+    client.portal.call(event_rollup.checkpoint)
+    before = client.get("/api/stats", headers=tenant_headers).json()
+
+    response = client.post("/webhook/inbound", data={
+        "recipient": decoy, "sender": "live-sender@example.net", "subject": "Checkpoint lag",
+        "body-plain": "Hi.", "X-Mailgun-Incoming-IP": "10.0.0.8", "Message-Id": "<stats-live@mailgun.example>"})
+    assert response.json() == {"status": "ok"}
+    conn = sqlite3.connect(os.environ["DATABASE_PATH"])
+    try:
+        deadline = time.monotonic() + 5
+        while conn.execute("SELECT 1 FROM events WHERE decoy_email = ?", (decoy,)).fetchone() is None:
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+        assert conn.execute("SELECT COUNT(*) FROM heavy_hitters WHERE value = ?", (decoy,)).fetchone()[0] == 0
+    finally:
+        conn.close()
+
+    after = client.get("/api/stats", headers=tenant_headers).json()
+    trend_hits = sum(bucket["hits"] for bucket in after["trend"]) - sum(bucket["hits"] for bucket in before["trend"])
+    assert trend_hits == 1
+    assert {"value": decoy, "hits": 1} in after["top"]["decoys"]
+    assert {"value": "live-sender@example.net", "hits": 1} in after["top"]["senders"]
@@ -0,0 +1,31 @@
+import pytest
+from fastapi import HTTPException
+
+def test_ticket_opens_the_stream_once(client, tenant_headers):
+    from auth import get_stream_user
+
+    response = client.post("/auth/stream-ticket", headers=tenant_headers)
+    assert response.status_code == 200
+    ticket = response.json()["ticket"]
+
+    assert client.portal.call(get_stream_user, ticket, None) == "tenant@example.com"
+    with pytest.raises(HTTPException) as refused:
+        client.portal.call(get_stream_user, ticket, None)
+    assert refused.value.status_code == 401
+
+def test_stream_refuses_access_token_in_query(client, tenant_headers):
+    access_token = tenant_headers["Authorization"].split()[1]
+    assert client.get("/api/events/stream", params={"access_token": access_token}).status_code == 401
+
+def test_ticket_requires_access_token(client):
+    assert client.post("/auth/stream-ticket").status_code == 403
+
+def test_expired_ticket_is_refused(client, tenant_headers, monkeypatch):
+    from auth import get_stream_user
+    from config import config
+
+    monkeypatch.setattr(config, "STREAM_TICKET_TTL_SECONDS", -1)
+    ticket = client.post("/auth/stream-ticket", headers=tenant_headers).json()["ticket"]
+    with pytest.raises(HTTPException) as refused:
+        client.portal.call(get_stream_user, ticket, None)
+    assert refused.value.status_code == 401